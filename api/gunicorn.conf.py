@@ -0,0 +1,15 @@
+"""
+Gunicorn settings, `gunicorn -c api/gunicorn.conf.py ...`.
+"""
+import os
+import sys
+
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+
+
+def post_fork(server, worker):
+    # With `--preload` the app, and possibly its database pool, is loaded in the master before
+    # forking, a worker must not share the master's connections.
+    if 'app.repository' in sys.modules:
+        from app.repository import DatabasePool
+        DatabasePool.discard_inherited()
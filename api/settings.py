@@ -33,12 +33,14 @@ INSTALLED_APPS = [
 	'django.contrib.staticfiles',
 	"corsheaders",
 	"rest_framework",
-	"drf_spectacular"
+	"drf_spectacular",
+	"app"
 ]
 
 CORS_ORIGIN_ALLOW_ALL = True
 
 MIDDLEWARE = [
+	'app.instrumentation.ServerTimingMiddleware',
 	'corsheaders.middleware.CorsMiddleware',
 	'django.middleware.security.SecurityMiddleware',
 	'django.middleware.common.CommonMiddleware',
@@ -72,6 +74,10 @@ WSGI_APPLICATION = 'api.wsgi.application'
 REST_FRAMEWORK = {
 	# YOUR SETTINGS
 	'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+	'DEFAULT_RENDERER_CLASSES': [
+		'app.instrumentation.TimedJSONRenderer',
+		'rest_framework.renderers.BrowsableAPIRenderer',
+	],
 
 	# Use Django's standard `django.contrib.auth` permissions,
 	# or allow read-only access for unauthenticated users.
@@ -93,6 +99,7 @@ SPECTACULAR_SETTINGS = {
 	]
 }
 
+# The postgresql backend runs on psycopg 3 (see requirements.txt), Django only falls back to psycopg2 without it.
 DATABASES = {
 	'default': {
 		'ENGINE': 'django.db.backends.postgresql',
@@ -107,6 +114,33 @@ DATABASES = {
 	}
 }
 
+# Connection pool of the repository queries (psycopg 3 only), one per worker process.
+# Connections are checked on checkout, replaced after MAX_LIFETIME seconds and closed after MAX_IDLE idle seconds.
+# Without the pool connections are kept for CONN_MAX_AGE seconds and checked before being reused.
+DB_POOL = {
+	'ENABLED': os.getenv('DB_POOL_ENABLED', 'false').lower() in ('1', 'true', 'yes'),
+	'MIN_SIZE': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+	'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+	'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+	'MAX_LIFETIME': float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+	'MAX_IDLE': float(os.getenv('DB_POOL_MAX_IDLE', 600)),
+}
+
+if DB_POOL['ENABLED']:
+	# Django's pool already checks the connections on checkout.
+	DATABASES['default']['OPTIONS'] = {
+		'pool': {
+			'min_size': DB_POOL['MIN_SIZE'],
+			'max_size': DB_POOL['MAX_SIZE'],
+			'timeout': DB_POOL['TIMEOUT'],
+			'max_lifetime': DB_POOL['MAX_LIFETIME'],
+			'max_idle': DB_POOL['MAX_IDLE'],
+		}
+	}
+else:
+	DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+	DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -178,4 +212,67 @@ LOGGING = {
             'propagate': False,			
 		}
     },
-}
\ No newline at end of file
+}
+
+# Seconds between checks of the ports/regions fingerprint by the in-memory catalogue.
+CATALOGUE_REFRESH_INTERVAL = int(os.getenv('CATALOGUE_REFRESH_INTERVAL', 60))
+
+# Aggregate rates from the `prices_daily` rollup, install it first with `manage.py refresh_rollup --install`.
+RATES_USE_ROLLUP = os.getenv('RATES_USE_ROLLUP', 'false').lower() in ('1', 'true', 'yes')
+
+# Backend of the paginated /rates/ series: `sql` aggregates in Postgres, `memory` from a NumPy snapshot
+# of the prices held by every worker process and reloaded when the prices data version changes, see `app.engine`.
+RATES_ENGINE = os.getenv('RATES_ENGINE', 'sql').lower()
+
+# Snapshot file of the memory engine written by `manage.py build_snapshot`, mapped read-only by the workers.
+RATES_SNAPSHOT_PATH = os.getenv('RATES_SNAPSHOT_PATH', '')
+
+# Execute parameterized repository queries through per-connection prepared statements.
+PREPARED_STATEMENTS = os.getenv('PREPARED_STATEMENTS', 'true').lower() in ('1', 'true', 'yes')
+
+# Cache of the /rates/ results, keyed on the request parameters and the prices data version.
+# `app.cache.DjangoCacheBackend` stores them in `CACHES[CACHE_ALIAS]` instead of the process memory.
+RATES_CACHE = {
+	'ENABLED': os.getenv('RATES_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+	'BACKEND': os.getenv('RATES_CACHE_BACKEND', 'app.cache.LRUCacheBackend'),
+	'OPTIONS': {
+		'MAX_ENTRIES': int(os.getenv('RATES_CACHE_MAX_ENTRIES', 5000)),
+		'TIMEOUT': int(os.getenv('RATES_CACHE_TIMEOUT', 300)),
+		'CACHE_ALIAS': os.getenv('RATES_CACHE_ALIAS', 'default'),
+	}
+}
+
+# Seconds between polls of the prices data version.
+DATA_VERSION_POLL_INTERVAL = float(os.getenv('DATA_VERSION_POLL_INTERVAL', 1))
+
+# Rows fetched at once from the server side cursor when streaming /rates/.
+RATES_STREAM_BATCH_SIZE = int(os.getenv('RATES_STREAM_BATCH_SIZE', 2000))
+
+# Encode the JSON /rates/ responses straight from the rows instead of through `RateSerializer`, same output.
+RATES_FAST_JSON = os.getenv('RATES_FAST_JSON', 'false').lower() in ('1', 'true', 'yes')
+
+# Maximum number of lanes in a POST /rates/batch request.
+RATES_BATCH_MAX_LANES = int(os.getenv('RATES_BATCH_MAX_LANES', 500))
+
+# Maximum number of days of a GET /rates/matrix?by_day=true request, which returns a row per port pair and day.
+RATES_MATRIX_MAX_DAYS = int(os.getenv('RATES_MATRIX_MAX_DAYS', 31))
+
+# Async connection pool of the `/async/rates/` path, one per worker process and event loop.
+ASYNC_DB_POOL = {
+	'MIN_SIZE': int(os.getenv('ASYNC_DB_POOL_MIN_SIZE', 2)),
+	'MAX_SIZE': int(os.getenv('ASYNC_DB_POOL_MAX_SIZE', 10)),
+	'TIMEOUT': float(os.getenv('ASYNC_DB_POOL_TIMEOUT', 30)),
+}
+
+# Rows sent at once to `COPY` when loading prices.
+PRICES_INGEST_CHUNK_SIZE = int(os.getenv('PRICES_INGEST_CHUNK_SIZE', 10000))
+
+# Bearer token of `POST /prices/ingest`, the endpoint refuses every request while it is empty.
+PRICES_INGEST_TOKEN = os.getenv('PRICES_INGEST_TOKEN', '')
+
+# Per-request timings, returned in a `Server-Timing` header (at most SERVER_TIMING_MAX_QUERIES statements listed).
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SERVER_TIMING_MAX_QUERIES = int(os.getenv('SERVER_TIMING_MAX_QUERIES', 20))
+
+# Statements of a request slower than this are logged with their `EXPLAIN (ANALYZE, BUFFERS)` plan, 0 disables it.
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 0))
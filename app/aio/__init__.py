@@ -0,0 +1,3 @@
+"""
+Async counterparts of the rates view, service and repository, served through `api.asgi`.
+"""
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+import weakref
+
+from django.conf import settings
+from django.db import connections
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+from app.instrumentation import record_query
+from app.queries import (
+    Granularity, catalogue_ports_query, catalogue_regions_query, catalogue_region_ports_query, catalogue_version_query,
+    data_version_table_exists_query, data_version_query, region_closure_installed_query
+)
+from app.repository import Prices, catalogue, prices_version
+
+
+class AsyncPool:
+    """
+        Bounded pool of async connections to the `default` database.
+
+        An asyncio pool is bound to the event loop it was opened on and must not be shared by
+        forked workers, so one pool is kept per (process, event loop).
+        Connections are in autocommit mode, every query is its own transaction.
+    """
+
+    def __init__(self, alias: str = 'default') -> None:
+        self.alias = alias
+        self._pid = None
+        # Event loop -> pool opened on it.
+        self._pools = weakref.WeakKeyDictionary()
+
+    @property
+    def config(self) -> dict:
+        return getattr(settings, 'ASYNC_DB_POOL', {})
+
+    def conninfo(self) -> str:
+        settings_dict = connections[self.alias].settings_dict
+        return make_conninfo(
+            dbname=settings_dict['NAME'], user=settings_dict['USER'], password=settings_dict['PASSWORD'],
+            host=settings_dict['HOST'], port=settings_dict['PORT'],
+        )
+
+    async def get(self) -> AsyncConnectionPool:
+        if self._pid != os.getpid():
+            # Forked, the pools belong to the parent process.
+            self._pools = weakref.WeakKeyDictionary()
+            self._pid = os.getpid()
+
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            pool = AsyncConnectionPool(
+                self.conninfo(),
+                min_size=self.config.get('MIN_SIZE', 2),
+                max_size=self.config.get('MAX_SIZE', 10),
+                timeout=self.config.get('TIMEOUT', 30),
+                kwargs={'autocommit': True},
+                open=False,
+            )
+            self._pools[loop] = pool
+            await pool.open()
+        return pool
+
+    async def close(self):
+        """
+        Closes the pool of the running event loop.
+        """
+        pool = self._pools.pop(asyncio.get_running_loop(), None)
+        if pool is not None:
+            await pool.close()
+
+
+async_pool = AsyncPool()
+
+
+class AsyncRepository:
+    """
+        Same interface as `Repository`, through the async pool.
+
+        psycopg prepares a query server side once it was executed `prepare_threshold` times on a
+        connection, which takes the place of `PreparedStatements` here.
+    """
+
+    @staticmethod
+    async def _execute(conn, query: str, params=None):
+        started = time.perf_counter()
+        cursor = await conn.execute(query, params)
+        record_query(query, time.perf_counter() - started, cursor.rowcount)
+        return cursor
+
+    @staticmethod
+    async def fetch_all(query: str, params=None):
+        pool = await async_pool.get()
+        async with pool.connection() as conn:
+            cursor = await AsyncRepository._execute(conn, query, params)
+            return await cursor.fetchall()
+
+    @staticmethod
+    async def fetch_one(query: str, params=None):
+        pool = await async_pool.get()
+        async with pool.connection() as conn:
+            cursor = await AsyncRepository._execute(conn, query, params)
+            result = await cursor.fetchone()
+            return result[-1]
+
+    @staticmethod
+    async def exists(query: str, params=None):
+        pool = await async_pool.get()
+        async with pool.connection() as conn:
+            cursor = await AsyncRepository._execute(conn, query, params)
+            return await cursor.fetchone()
+
+    @staticmethod
+    async def fetch_all_with_bounds(query: str, params=None):
+        rows = await AsyncRepository.fetch_all(query, params)
+        bounds = tuple(rows[0][-2:]) if rows else (None, None)
+        return [row[:-2] for row in rows if row[0] is not None], bounds
+
+
+class AsyncCatalogue:
+    """
+        Keeps the shared in-memory `catalogue` fresh from the async path.
+    """
+
+    @staticmethod
+    async def refresh():
+        if catalogue.is_fresh():
+            return
+
+        version = await AsyncRepository.fetch_one(catalogue_version_query)
+        if catalogue.needs_reload(version):
+            regions, ports, closure_installed = await asyncio.gather(
+                AsyncRepository.fetch_all(catalogue_regions_query), AsyncRepository.fetch_all(catalogue_ports_query),
+                AsyncRepository.fetch_one(region_closure_installed_query)
+            )
+            closure_rows = await AsyncRepository.fetch_all(catalogue_region_ports_query) if closure_installed else None
+            catalogue.load(version, regions, ports, closure_rows)
+        else:
+            catalogue.mark_checked()
+
+
+class AsyncDataVersion:
+    """
+        Polls the shared `prices_version` from the async path.
+    """
+
+    @staticmethod
+    async def refresh():
+        if prices_version.is_fresh():
+            return
+
+        table_exists = prices_version.table_exists or await AsyncRepository.fetch_one(data_version_table_exists_query)
+        prices_version.update(
+            table_exists,
+            await AsyncRepository.exists(data_version_query, [prices_version.name]) if table_exists else None
+        )
+
+
+class AsyncPrices:
+
+    @staticmethod
+    async def fetch_sparse_rates(
+        origin: str, destination: str, date_from:str= None, date_to:str=None, page_size: int = 10, page: int = 1,
+        granularity: Granularity = Granularity.DAY
+    ):
+        """
+        Same as `Prices.fetch_sparse_rates`, the catalogue must have been refreshed beforehand.
+        """
+        rate_query = Prices.rate_query(
+            origin, destination, date_from, date_to, page_size, page, refresh=False, granularity=granularity
+        )
+        rows, (min_date, max_date) = await AsyncRepository.fetch_all_with_bounds(*rate_query.sparse_query)
+        return {
+            "rows": rows,
+            "min_date": min_date,
+            "max_date": max_date
+        }
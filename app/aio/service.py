@@ -0,0 +1,52 @@
+import asyncio
+
+from app import service
+from app.aio.repository import AsyncCatalogue, AsyncDataVersion, AsyncPrices
+from app.cache import rates_cache
+from app.instrumentation import timed
+from app.queries import Granularity
+from app.series import fill_dates
+
+
+async def refresh():
+    """
+    Refreshes the catalogue and polls the prices data version concurrently, the endpoint checks
+    and the cache keys are then served from memory.
+    """
+    await asyncio.gather(AsyncCatalogue.refresh(), AsyncDataVersion.refresh())
+
+
+def validate_parameters(request):
+    """
+    Same parameters as the sync `GetRatesView`, without keyset pagination nor streaming.
+    """
+    with timed('validation'):
+        params = {}
+        params['origin'], params['destination'] = service.validate_endpoints(request, refresh=False)
+        params['date_from'], params['date_to'] = service.validate_dates(request)
+        params['page'], params['page_size'] = service.validate_pagination(request)
+        params['granularity'] = service.validate_granularity(request)
+        return params
+
+
+async def get_rates(
+    origin: str, destination: str, date_from:str = None, date_to:str = None, page_size: int = 10, page: int = 1,
+    granularity: Granularity = Granularity.DAY
+):
+    """
+    Same as `service.get_rates` but returns the raw `(day, average_price)` rows, sharing its cache entries.
+    """
+    key = service.rates_cache_key(
+        origin, destination, date_from, date_to, page_size, page, refresh=False, granularity=granularity
+    )
+    rate_info = await rates_cache.aget(key)
+    if rate_info is None:
+        sparse = await AsyncPrices.fetch_sparse_rates(
+            origin, destination, date_from, date_to, page_size, page, granularity
+        )
+        rates, count = fill_dates(
+            sparse["rows"], sparse["min_date"], sparse["max_date"], page, page_size, granularity=granularity
+        )
+        rate_info = {"rates": rates, "count": count}
+        await rates_cache.aset(key, rate_info)
+    return rate_info
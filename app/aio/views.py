@@ -0,0 +1,35 @@
+import logging
+
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+
+from app.aio import service as async_service
+from app.instrumentation import timed
+from app.service import encode_rates
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGetRatesView(View):
+    """
+        Async `/rates/`, same parameters and response as `GetRatesView` apart from keyset
+        pagination and streaming. Served natively when running on `api.asgi`.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            await async_service.refresh()
+            params = async_service.validate_parameters(Request(request))
+            rate_info = await async_service.get_rates(**params)
+        except ValidationError as e:
+            return JsonResponse(e.detail, status=400)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            raise e
+
+        with timed('serialisation'):
+            content = encode_rates(rate_info["rates"])
+        return HttpResponse(content, content_type='application/json', headers={"max_count": rate_info["count"]})
@@ -0,0 +1,26 @@
+import logging
+
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+
+class RatesConfig(AppConfig):
+    name = 'app'
+
+    def ready(self):
+        from app.instrumentation import install_query_timer
+
+        connection_created.connect(install_query_timer, dispatch_uid='app.install_query_timer')
+
+        if settings.RATES_SNAPSHOT_PATH:
+            # Map the snapshot file, and seed the catalogue from it, before the first request.
+            from app.repository import memory_prices
+
+            try:
+                memory_prices.map_file()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Couldn't map the rates snapshot: {e}")
@@ -0,0 +1,4 @@
+"""
+Synthetic datasets and load tests of the rates API, see the `generate_dataset` and
+`benchmark_rates` management commands.
+"""
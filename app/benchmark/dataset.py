@@ -0,0 +1,157 @@
+import datetime
+import math
+import random
+import string
+from itertools import islice
+
+from django.db import transaction
+
+from app.queries import (
+    dataset_schema_queries, dataset_truncate_query, dataset_copy_regions_query, dataset_copy_ports_query,
+    dataset_copy_prices_query, dataset_analyze_query, dataset_prices_table_exists_query, dataset_has_prices_query
+)
+from app.repository import PriceRollup, Repository, catalogue, prices_version
+from app.service import price_csv_chunks
+
+
+def spell(index: int, length: int, alphabet: str) -> str:
+    """
+    Fixed length spelling of `index` in base `len(alphabet)`, e.g. `spell(27, 5, 'A..Z')` is `AAABB`.
+    """
+    letters = []
+    for _ in range(length):
+        index, remainder = divmod(index, len(alphabet))
+        letters.append(alphabet[remainder])
+    return ''.join(reversed(letters))
+
+
+def parse_count(value: str) -> int:
+    """
+    Parses counts like `500000`, `10M` or `1.5k`.
+    """
+    multipliers = {'k': 10 ** 3, 'm': 10 ** 6, 'g': 10 ** 9, 'b': 10 ** 9}
+    value = str(value).strip().lower().replace('_', '')
+    if value and value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+def make_regions(rnd: random.Random, top_regions: int = 8, depth: int = 3, fanout: int = 4) -> list:
+    """
+    Returns `(slug, name, parent_slug)` rows of a region forest: `top_regions` roots, then 1 to
+    `fanout` sub regions per region down to `depth` levels, like `china_main` > `china_east_main`.
+    """
+    regions, level, index = [], [None], 0
+    for _ in range(depth):
+        next_level = []
+        for parent_slug in level:
+            for _ in range(top_regions if parent_slug is None else rnd.randint(1, fanout)):
+                # Region slugs are lowercase letters and underscores only.
+                slug = f"region_{spell(index, 4, string.ascii_lowercase)}"
+                index += 1
+                regions.append((slug, slug.replace('_', ' ').title(), parent_slug))
+                next_level.append(slug)
+        level = next_level
+    return regions
+
+
+def make_ports(rnd: random.Random, regions: list, count: int = 1500) -> list:
+    """
+    Returns `(code, name, parent_slug)` rows of `count` ports spread over the regions,
+    mostly in the leaf regions as the deeper levels hold most regions.
+    """
+    slugs = [slug for slug, name, parent_slug in regions]
+    step = 7919  # Prime, spreads the codes over the code space.
+    return [
+        (code, code.title(), rnd.choice(slugs))
+        for code in (spell(index * step % 26 ** 5, 5, string.ascii_uppercase) for index in range(count))
+    ]
+
+
+def make_prices(
+    rnd: random.Random, ports: list, count: int, date_from: datetime.date, days: int = 365,
+    quotes_per_day: float = 3
+):
+    """
+    Yields at least `count` `(orig_code, dest_code, day, price)` rows, day after day like daily loads.
+
+    Lanes have a Zipf like popularity, the busiest are quoted many times a day while the long tail
+    is quoted some days only, and every lane has its own base price with a yearly seasonality
+    and a 10% noise on every quote.
+    """
+    codes = [code for code, name, parent_slug in ports]
+    lane_count = max(1, int(count / (days * quotes_per_day)))
+    weights = [1 / (rank ** 0.8) for rank in range(1, lane_count + 1)]
+    scale = count / (days * sum(weights))
+
+    lanes = []
+    for weight in weights:
+        orig_code, dest_code = rnd.sample(codes, 2)
+        lanes.append((orig_code, dest_code, weight * scale, rnd.randint(500, 4000), rnd.uniform(0, 2 * math.pi)))
+
+    def quote(lane, offset):
+        orig_code, dest_code, quotes, base_price, phase = lane
+        price = base_price * (1 + 0.15 * math.sin(2 * math.pi * offset / 365 + phase))
+        return orig_code, dest_code, (date_from + datetime.timedelta(days=offset)).isoformat(), int(price * rnd.uniform(0.9, 1.1))
+
+    generated = 0
+    for offset in range(days):
+        for lane in lanes:
+            quotes = lane[2]
+            for _ in range(int(quotes) + (rnd.random() < quotes % 1)):
+                generated += 1
+                yield quote(lane, offset)
+
+    # The quotes are drawn at random, top up the busiest lanes up to `count`.
+    while generated < count:
+        generated += 1
+        yield quote(lanes[rnd.randrange(min(len(lanes), 10))], rnd.randrange(days))
+
+
+def has_prices() -> bool:
+    return Repository.fetch_one(dataset_prices_table_exists_query) and Repository.fetch_one(dataset_has_prices_query)
+
+
+class Counted:
+    """
+        Iterates over rows while counting them.
+    """
+
+    def __init__(self, rows) -> None:
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+
+
+def generate(
+    prices: int, ports: int = 1500, top_regions: int = 8, depth: int = 3, fanout: int = 4,
+    date_from: datetime.date = datetime.date(2016, 1, 1), days: int = 365, quotes_per_day: float = 3,
+    seed: int = 42, reset: bool = False, chunk_size: int = 10000
+) -> dict:
+    """
+    Generates a dataset and loads it with `COPY` in one transaction, then analyzes the tables.
+    The same arguments always generate the same dataset. Returns the counts of loaded rows.
+    """
+    rnd = random.Random(seed)
+    regions = make_regions(rnd, top_regions, depth, fanout)
+    port_rows = make_ports(rnd, regions, ports)
+    price_rows = Counted(islice(make_prices(rnd, port_rows, prices, date_from, days, quotes_per_day), prices))
+
+    with transaction.atomic():
+        Repository.execute(*dataset_schema_queries)
+        if reset:
+            Repository.execute(dataset_truncate_query)
+        Repository.copy_from(dataset_copy_regions_query, price_csv_chunks(regions, chunk_size))
+        Repository.copy_from(dataset_copy_ports_query, price_csv_chunks(port_rows, chunk_size))
+        Repository.copy_from(dataset_copy_prices_query, price_csv_chunks(price_rows, chunk_size))
+        if PriceRollup.installed():
+            PriceRollup.refresh(full=True)
+    Repository.execute(dataset_analyze_query)
+
+    catalogue.invalidate()
+    prices_version.invalidate()
+    return {"regions": len(regions), "ports": len(port_rows), "prices": price_rows.count}
@@ -0,0 +1,46 @@
+import time
+
+from rest_framework.renderers import JSONRenderer
+
+from app import service
+from app.renderers import rows_renderer_classes
+
+
+def render_json(rows) -> bytes:
+    """
+    The default `/rates/` rendering, `RateSerializer` over the rate dicts and the JSON renderer.
+    """
+    from app.views import RateSerializer
+
+    rates = map(lambda data: {"day": data[0], "average_price": data[1]}, rows)
+    return JSONRenderer().render(RateSerializer(rates, many=True).data)
+
+
+def renderers() -> dict:
+    """
+    Rendering functions of every available format, keyed by the format.
+    """
+    return {
+        "json": render_json,
+        "json-fast": lambda rows: service.encode_rates(rows).encode(),
+        **{renderer_class.format: renderer_class().render_rows for renderer_class in rows_renderer_classes()}
+    }
+
+
+def measure(rows: list, repeat: int = 20) -> dict:
+    """
+    Payload size and best rendering time of `rows` in every format, relative to the JSON ones.
+    """
+    results = {}
+    for format, render in renderers().items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            payload = render(rows)
+            timings.append(time.perf_counter() - started)
+        results[format] = {"bytes": len(payload), "ms": min(timings) * 1000}
+
+    for result in results.values():
+        result["size_vs_json"] = result["bytes"] / results["json"]["bytes"] if results["json"]["bytes"] else None
+        result["time_vs_json"] = result["ms"] / results["json"]["ms"] if results["json"]["ms"] else None
+    return results
@@ -0,0 +1,175 @@
+import datetime
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.db import connection
+from django.test import Client
+
+from app.queries import catalogue_ports_query, catalogue_regions_query, prices_date_range_query
+from app.repository import Repository
+
+
+LANE_KINDS = ('port-port', 'port-region', 'region-region')
+
+# Days of the short and long ranges.
+RANGES = {'short': 7, 'long': 365}
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    Nearest rank percentile of sorted values.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))]
+
+
+def make_requests(
+    rnd: random.Random, count: int, date_from: datetime.date, date_to: datetime.date, ports: list = None,
+    regions: list = None
+) -> list:
+    """
+    Returns `count` `(kind, params)` requests spread evenly over the lane kinds and the range lengths,
+    e.g. `('port-region/short', {'origin': ..., ...})`. Ports and regions default to the catalogue tables.
+    """
+    if ports is None:
+        ports = [code for code, parent_slug in Repository.fetch_all(catalogue_ports_query)]
+    if regions is None:
+        regions = [slug for slug, parent_slug in Repository.fetch_all(catalogue_regions_query)]
+    endpoints = {'port': ports, 'region': regions}
+
+    requests = []
+    for index in range(count):
+        lane_kind = LANE_KINDS[index % len(LANE_KINDS)]
+        range_name = list(RANGES)[index // len(LANE_KINDS) % len(RANGES)]
+        origin_kind, destination_kind = lane_kind.split('-')
+        if rnd.random() < 0.5:
+            origin_kind, destination_kind = destination_kind, origin_kind
+
+        days = min(RANGES[range_name], (date_to - date_from).days + 1)
+        start = date_from + datetime.timedelta(days=rnd.randint(0, (date_to - date_from).days + 1 - days))
+        requests.append((f"{lane_kind}/{range_name}", {
+            'origin': rnd.choice(endpoints[origin_kind]),
+            'destination': rnd.choice(endpoints[destination_kind]),
+            'date_from': start.isoformat(),
+            'date_to': (start + datetime.timedelta(days=days - 1)).isoformat(),
+        }))
+    return requests
+
+
+class InProcessClient:
+    """
+        Drives the views through Django's test client, without the HTTP stack.
+        The database time is measured around every query executed by the request.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+
+    def _measure_db(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self._local.db_time += time.perf_counter() - started
+
+    def get(self, path: str, params: dict):
+        """
+        Returns `(status_code, db_seconds)`.
+        """
+        if not hasattr(self._local, 'client'):
+            self._local.client = Client()
+        self._local.db_time = 0.0
+        with connection.execute_wrapper(self._measure_db):
+            response = self._local.client.get(path, params)
+            # Consume streamed responses within the measure.
+            b''.join(response) if response.streaming else response.content
+        return response.status_code, self._local.db_time
+
+
+class HttpClient:
+    """
+        Drives a running server over HTTP. The database time is read from a `Server-Timing: db;dur=<ms>`
+        response header when the server sends one.
+    """
+
+    db_timing_pattern = re.compile(r'(?:^|,)\s*db;[^,]*dur=([0-9.]+)')
+
+    def __init__(self, base_url: str) -> None:
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self._session = requests.Session
+        self._local = threading.local()
+
+    def get(self, path: str, params: dict):
+        if not hasattr(self._local, 'session'):
+            self._local.session = self._session()
+        response = self._local.session.get(self.base_url + path, params=params)
+        match = self.db_timing_pattern.search(response.headers.get('Server-Timing', ''))
+        return response.status_code, float(match.group(1)) / 1000 if match else None
+
+
+def run(client, path: str, requests: list, concurrency: int = 1) -> dict:
+    """
+    Sends the requests to `path` from `concurrency` threads. Returns the results per request kind,
+    plus `all`, as `{kind: {"requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "db_ms"}}`,
+    `db_ms` being the mean database time per request, None when unknown.
+    """
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    pending = iter(requests)
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    request = next(pending, None)
+                if request is None:
+                    return
+                kind, params = request
+                started = time.perf_counter()
+                status_code, db_time = client.get(path, params)
+                latency = time.perf_counter() - started
+                with lock:
+                    samples[kind].append((latency, db_time, status_code))
+        finally:
+            if concurrency > 1:
+                connection.close()
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        worker()
+    elapsed = time.perf_counter() - started
+
+    samples['all'] = [sample for kind in list(samples) for sample in samples[kind]]
+    results = {}
+    for kind, kind_samples in sorted(samples.items()):
+        latencies = sorted(latency * 1000 for latency, db_time, status_code in kind_samples)
+        db_times = [db_time for latency, db_time, status_code in kind_samples if db_time is not None]
+        results[kind] = {
+            "requests": len(kind_samples),
+            "errors": sum(1 for latency, db_time, status_code in kind_samples if status_code != 200),
+            "rps": len(kind_samples) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "db_ms": sum(db_times) * 1000 / len(db_times) if db_times else None,
+        }
+    return results
+
+
+def data_range() -> tuple:
+    """
+    First and last day of the prices.
+    """
+    return tuple(Repository.fetch_all(prices_date_range_query)[0])
@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from app.repository import prices_version
+
+
+class LRUCacheBackend:
+    """
+        In-process LRU cache with a TTL, bounded to `MAX_ENTRIES` entries.
+    """
+
+    def __init__(self, MAX_ENTRIES: int = 5000, TIMEOUT: float = 300, **kwargs) -> None:
+        self.max_entries = MAX_ENTRIES
+        self.timeout = TIMEOUT
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoCacheBackend:
+    """
+        Stores the entries in one of Django's `CACHES`, e.g. a shared memcached/redis cache.
+    """
+
+    def __init__(self, CACHE_ALIAS: str = 'default', TIMEOUT: float = 300, **kwargs) -> None:
+        self.cache = caches[CACHE_ALIAS]
+        self.timeout = TIMEOUT
+
+    def get(self, key: str):
+        return self.cache.get(key)
+
+    def set(self, key: str, value):
+        self.cache.set(key, value, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class RatesCache:
+    """
+        Cache of the `/rates/` results, keyed on the normalised request parameters.
+
+        The keys also carry the prices data version and the catalogue version, so loading prices
+        or changing the region tree invalidates the entries without having to delete them. Without
+        the `data_version` table of `optimise_schema` the version never changes, the cache is then off.
+    """
+
+    def __init__(self) -> None:
+        self._backend = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def config(self) -> dict:
+        return getattr(settings, 'RATES_CACHE', {})
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Enabled in the settings and the prices data version polled, see `DataVersion.table_exists`.
+        """
+        return self.config.get('ENABLED', False) and prices_version.table_exists
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            backend_class = import_string(self.config.get('BACKEND', 'app.cache.LRUCacheBackend'))
+            self._backend = backend_class(**self.config.get('OPTIONS', {}))
+        return self._backend
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return 'rates:' + ':'.join('' if part is None else str(part) for part in parts)
+
+    def get(self, key: str):
+        """
+        Returns the cached value, None on a miss or when the cache is disabled.
+        """
+        if not self.enabled:
+            return None
+
+        value = self.backend.get(key)
+        with self._lock:
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return value
+
+    def set(self, key: str, value):
+        if self.enabled:
+            self.backend.set(key, value)
+
+    @property
+    def in_process(self) -> bool:
+        """
+        Whether the backend serves the entries from the process memory, without any I/O.
+        """
+        return isinstance(self.backend, LRUCacheBackend)
+
+    async def aget(self, key: str):
+        """
+        `get` from the event loop, the backends doing I/O, e.g. a database cache, run in a thread.
+        """
+        return self.get(key) if self.in_process else await sync_to_async(self.get)(key)
+
+    async def aset(self, key: str, value):
+        if self.in_process:
+            self.set(key, value)
+        else:
+            await sync_to_async(self.set)(key, value)
+
+    def get_or_set(self, key: str, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        stats = {"enabled": self.enabled, "hits": self.hits, "misses": self.misses}
+        if self.in_process:
+            stats["entries"] = len(self.backend)
+        return stats
+
+
+rates_cache = RatesCache()
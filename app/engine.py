@@ -0,0 +1,208 @@
+"""
+    In-memory rate engine, an alternative to aggregating the rates in Postgres (`RATES_ENGINE=memory`).
+
+    The per lane and day sums and counts of the prices are held in NumPy arrays sorted on a
+    `(lane, day)` key, a lane being a pair of integer-encoded port codes. The rows of a lane and
+    date range are found by binary search on the keys, region lanes gather the slices of all their
+    port pairs at once and reduce them per day, or bucket, with `bincount`.
+
+    A snapshot can be written to a file and memory-mapped read-only, so the worker processes of
+    a server share its pages instead of each loading its own copy, see `RatesSnapshot.write`.
+"""
+import json
+import mmap
+import os
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+from app.queries import Granularity
+from app.series import bucket_index, bucket_origin, bucket_starts, page_range
+
+
+# Day numbers are shifted by `DAY_OFFSET` into `[0, DAY_SPAN)` to be packed with the lane into one key.
+DAY_SPAN = 1 << 20
+DAY_OFFSET = 1 << 19
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+# Snapshot files start with the magic and the length of their JSON header, the arrays follow aligned.
+SNAPSHOT_MAGIC = b'RATESNP1'
+SNAPSHOT_ALIGNMENT = 64
+SNAPSHOT_ARRAYS = ('keys', 'days', 'sums', 'counts')
+
+
+def day_number(value) -> int:
+    return int((np.datetime64(value, 'D') - EPOCH).astype(np.int64))
+
+
+def round_average(sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    `sums / counts` rounded half away from zero in integer arithmetic, as `round()` does on numeric.
+    """
+    return np.sign(sums) * ((2 * np.abs(sums) + counts) // (2 * counts))
+
+
+class RatesSnapshot:
+    """
+        Immutable snapshot of the `(orig_code, dest_code, day number, sum_price, n_prices)` rows of
+        the prices, see `memory_engine_prices_query`. Sums are reduced as float64, so they are exact
+        as long as they stay below 2**53.
+    """
+
+    def __init__(self, codes, keys, days, sums, counts, version=None, metadata=None) -> None:
+        """
+        Takes the arrays already sorted on `keys`, see `build`.
+        """
+        self.version = version
+        self.metadata = metadata or {}
+        self.codes = {code: index for index, code in enumerate(codes)}
+        self.keys, self.days, self.sums, self.counts = keys, days, sums, counts
+
+    @classmethod
+    def build(cls, orig_codes, dest_codes, days, sums, counts, version=None, metadata=None) -> 'RatesSnapshot':
+        codes, inverse = np.unique(
+            np.concatenate([np.asarray(orig_codes, dtype=object), np.asarray(dest_codes, dtype=object)]).astype(str),
+            return_inverse=True
+        )
+        orig, dest = inverse[:len(orig_codes)].astype(np.int64), inverse[len(orig_codes):].astype(np.int64)
+
+        days = np.asarray(days, dtype=np.int64)
+        keys = (orig * len(codes) + dest) * DAY_SPAN + days + DAY_OFFSET
+        order = np.argsort(keys, kind='stable')
+        return cls(
+            codes.tolist(), keys[order], days[order].astype('datetime64[D]'),
+            np.asarray(sums, dtype=np.float64)[order], np.asarray(counts, dtype=np.float64)[order],
+            version, metadata
+        )
+
+    @classmethod
+    def from_rows(cls, batches, version=None, metadata=None) -> 'RatesSnapshot':
+        """
+        Builds a snapshot from batches of rows, e.g. the batches of `Repository.stream`.
+        """
+        columns = [[], [], [], [], []]
+        for rows in batches:
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+        return cls.build(*columns, version=version, metadata=metadata)
+
+    def write(self, path: str):
+        """
+        Writes the snapshot to `path`, atomically: readers see either the previous file or this one.
+        The `(version, updated_at)` version and the metadata, which must be JSON serialisable, are
+        stored in the header.
+        """
+        version, updated_at = self.version or (0, None)
+        arrays, offset = {}, 0
+        for name in SNAPSHOT_ARRAYS:
+            array = np.ascontiguousarray(getattr(self, name))
+            arrays[name] = {"dtype": array.dtype.str, "length": len(array), "offset": offset}
+            offset += -(-array.nbytes // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+        header = json.dumps({
+            "version": [version, updated_at.isoformat() if updated_at else None],
+            "metadata": self.metadata,
+            "codes": sorted(self.codes, key=self.codes.get),
+            "arrays": arrays,
+        }).encode()
+        data_offset = -(-(len(SNAPSHOT_MAGIC) + 8 + len(header)) // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as snapshot_file:
+                snapshot_file.write(SNAPSHOT_MAGIC + len(header).to_bytes(8, 'little') + header)
+                for name in SNAPSHOT_ARRAYS:
+                    snapshot_file.seek(data_offset + arrays[name]["offset"])
+                    snapshot_file.write(np.ascontiguousarray(getattr(self, name)).tobytes())
+                snapshot_file.truncate(data_offset + offset)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.chmod(temporary_path, 0o644)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    @classmethod
+    def open(cls, path: str) -> 'RatesSnapshot':
+        """
+        Maps a snapshot file read-only. The arrays are views of the mapping, whose pages are shared
+        by every process mapping the same file, it stays valid after the file is replaced.
+        """
+        with open(path, 'rb') as snapshot_file:
+            mapping = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapping[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a rates snapshot")
+
+        header_length = int.from_bytes(mapping[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 8], 'little')
+        header_end = len(SNAPSHOT_MAGIC) + 8 + header_length
+        header = json.loads(mapping[len(SNAPSHOT_MAGIC) + 8:header_end])
+        data_offset = -(-header_end // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+        arrays = {
+            name: np.frombuffer(
+                mapping, dtype=np.dtype(layout["dtype"]), count=layout["length"], offset=data_offset + layout["offset"]
+            ) for name, layout in header["arrays"].items()
+        }
+        version, updated_at = header["version"]
+        return cls(
+            header["codes"], **arrays, version=(version, datetime.fromisoformat(updated_at) if updated_at else None),
+            metadata=header["metadata"]
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lanes(self, source_codes, destination_codes) -> np.ndarray:
+        """
+        Keys of the port pairs of a lane, unknown ports are skipped.
+        """
+        origins = np.array([self.codes[code] for code in source_codes if code in self.codes], dtype=np.int64)
+        destinations = np.array([self.codes[code] for code in destination_codes if code in self.codes], dtype=np.int64)
+        return (origins[:, None] * len(self.codes) + destinations[None, :]).ravel()
+
+    def gather(self, source_codes, destination_codes, date_from=None, date_to=None) -> np.ndarray:
+        """
+        Index of the rows of every port pair of a lane within the dates.
+        """
+        lanes = self.lanes(source_codes, destination_codes) * DAY_SPAN
+        first = day_number(date_from) + DAY_OFFSET if date_from else 0
+        last = day_number(date_to) + DAY_OFFSET if date_to else DAY_SPAN - 1
+        starts = np.searchsorted(self.keys, lanes + first)
+        lengths = np.searchsorted(self.keys, lanes + last, side='right') - starts
+        # Concatenated ranges: every slice counts up from its start, shifted by where it lands in the output.
+        offsets = np.cumsum(lengths) - lengths
+        return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+    def sparse_rates(
+        self, source_codes, destination_codes, date_from=None, date_to=None, page: int = None,
+        page_size: int = None, descending: bool = False, granularity: Granularity = Granularity.DAY
+    ):
+        """
+        Same `(day, avg_price, n_prices)` rows of the page and first and last day of the series
+        as `RateQuery.sparse_query`, see `app.series.fill_dates`.
+        """
+        index = self.gather(source_codes, destination_codes, date_from, date_to)
+        if not len(index):
+            return [], None, None
+
+        days = self.days[index]
+        min_date, max_date = days.min().tolist(), days.max().tolist()
+        bounds = page_range(min_date, max_date, page, page_size, descending, granularity)
+        if bounds is None:
+            return [], min_date, max_date
+
+        origin = bucket_origin(min_date, granularity)
+        first, last = bucket_index(np.array(bounds, dtype='datetime64[D]'), origin, granularity)
+        buckets = bucket_index(days, origin, granularity) - first
+        keep = (buckets >= 0) & (buckets <= last - first)
+        sums = np.bincount(buckets[keep], weights=self.sums[index][keep], minlength=last - first + 1)
+        counts = np.bincount(buckets[keep], weights=self.counts[index][keep], minlength=last - first + 1)
+
+        present = np.flatnonzero(counts)
+        sums, counts = np.rint(sums[present]).astype(np.int64), counts[present].astype(np.int64)
+        return list(zip(
+            bucket_starts(present + first, origin, granularity).tolist(),
+            round_average(sums, counts).tolist(),
+            counts.tolist()
+        )), min_date, max_date
@@ -5,6 +5,17 @@ class ErrorReason:
     ENPOINTS_REQUIRED = 30
     INVALID_PAGE = 40
     INVALID_PAGE_SIZE = 50
+    INVALID_CURSOR = 60
+    INVALID_STREAM_FORMAT = 70
+    INVALID_LANES = 80
+    INVALID_PRICES = 90
+    INVALID_PRICES_FORMAT = 100
+    INVALID_GRANULARITY = 110
+    UNSUPPORTED_GRANULARITY = 120
+    INVALID_BY_DAY = 130
+    INVALID_BATCH_ID = 140
+    INVALID_MATRIX_RANGE = 150
+    DUPLICATE_LANE_KEY = 160
 
 
 error_messages = {
@@ -13,7 +24,18 @@ error_messages = {
     ErrorReason.ENPOINTS_REQUIRED: "Both orgin and destination are required to fetch rates",
     ErrorReason.INVALID_DATES: "Invalid dates: `date_from` should be less than `date_to`",
     ErrorReason.INVALID_PAGE: "Invalid page {page}",
-    ErrorReason.INVALID_PAGE_SIZE: "Invalid page size {page_size}"
+    ErrorReason.INVALID_PAGE_SIZE: "Invalid page size {page_size}",
+    ErrorReason.INVALID_CURSOR: "Invalid cursor {cursor}",
+    ErrorReason.INVALID_STREAM_FORMAT: "Invalid stream format {stream}, should be one of json, ndjson",
+    ErrorReason.INVALID_LANES: "`lanes` should be a list of 1 to {max_lanes} lanes",
+    ErrorReason.INVALID_PRICES: "Invalid prices, {error}",
+    ErrorReason.INVALID_PRICES_FORMAT: "Invalid prices format {format}, should be one of csv, ndjson",
+    ErrorReason.INVALID_GRANULARITY: "Invalid granularity {granularity}, should be one of day, week, month or a number of days like 14d",
+    ErrorReason.UNSUPPORTED_GRANULARITY: "Granularity {granularity} is only supported with page pagination, without `cursor` nor `stream`",
+    ErrorReason.INVALID_BY_DAY: "Invalid by_day {by_day}, should be true or false",
+    ErrorReason.INVALID_BATCH_ID: "Invalid batch_id {batch_id}, should be at most {max_length} characters",
+    ErrorReason.INVALID_MATRIX_RANGE: "`by_day` needs a `date_from` and a `date_to` at most {max_days} days apart",
+    ErrorReason.DUPLICATE_LANE_KEY: "Duplicate lane key {key}, every lane should have its own key"
 }
 
 
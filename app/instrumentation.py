@@ -0,0 +1,243 @@
+"""
+    Per-request timings: named spans (validation, region resolution, serialisation), every SQL
+    statement with its row count, and the total. `ServerTimingMiddleware` collects them for every
+    request, returns them in a `Server-Timing` header and logs them as structured fields.
+"""
+import contextvars
+import json
+import logging
+import re
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimings:
+    """
+        Timings of one request, in seconds.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.total = None
+        # Span name -> accumulated seconds, in order of first use.
+        self.spans = {}
+        # `(sql, seconds, rows)` of every statement.
+        self.queries = []
+        self.slow_queries = []
+
+    def add_span(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def add_query(self, sql: str, seconds: float, rows: int = None):
+        self.queries.append((sql, seconds, rows))
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    @property
+    def db_time(self) -> float:
+        return sum(seconds for sql, seconds, rows in self.queries)
+
+    def server_timing(self, max_queries: int = 20) -> str:
+        metrics = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.spans.items()]
+        metrics.append(f'db;dur={self.db_time * 1000:.2f};desc="{len(self.queries)} queries"')
+        metrics.extend(
+            f'sql-{index};dur={seconds * 1000:.2f}' + ('' if rows is None or rows < 0 else f';desc="{rows} rows"')
+            for index, (sql, seconds, rows) in enumerate(self.queries[:max_queries], 1)
+        )
+        metrics.append(f"total;dur={self.total * 1000:.2f}")
+        return ', '.join(metrics)
+
+    def log_fields(self) -> dict:
+        return {
+            "total_ms": round(self.total * 1000, 2),
+            "spans_ms": {name: round(seconds * 1000, 2) for name, seconds in self.spans.items()},
+            "db_ms": round(self.db_time * 1000, 2),
+            "queries": [
+                {"sql": ' '.join(sql.split())[:200], "ms": round(seconds * 1000, 2), "rows": rows}
+                for sql, seconds, rows in self.queries
+            ],
+            "slow_queries": len(self.slow_queries),
+        }
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def current():
+    """
+    Timings of the request being served, None outside of a request.
+    """
+    return _current.get()
+
+
+@contextmanager
+def timed(name: str):
+    """
+    Adds the time spent in the block to the `name` span of the current request.
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add_span(name, time.perf_counter() - started)
+
+
+def record_query(sql: str, seconds: float, rows: int = None):
+    """
+    Hook for the queries that don't go through Django's connection, e.g. the async pool.
+    """
+    timings = _current.get()
+    if timings is not None:
+        timings.add_query(sql, seconds, rows)
+        if is_slow(seconds):
+            logger.warning(f"Slow query {seconds * 1000:.1f}ms: {' '.join(sql.split())}")
+
+
+def is_slow(seconds: float) -> bool:
+    threshold = settings.SLOW_QUERY_THRESHOLD_MS
+    return bool(threshold) and seconds * 1000 >= threshold
+
+
+class QueryTimer:
+    """
+        Execute wrapper of the Django connections, records the statements run while serving a
+        request. A statement slower than `SLOW_QUERY_THRESHOLD_MS` is run again under
+        `EXPLAIN (ANALYZE, BUFFERS)`, in a rolled back savepoint, and its plan is logged.
+    """
+
+    EXPLAINABLE = ('select', 'with', 'execute')
+
+    def __init__(self) -> None:
+        self._explaining = contextvars.ContextVar('explaining', default=False)
+
+    def __call__(self, execute, sql, params, many, context):
+        timings = _current.get()
+        if timings is None or self._explaining.get():
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        seconds = time.perf_counter() - started
+        timings.add_query(self.statement_query(sql), seconds, getattr(context['cursor'], 'rowcount', None))
+
+        if is_slow(seconds) and not many and sql.lstrip().lower().startswith(self.EXPLAINABLE):
+            self.explain(timings, sql, params, seconds)
+        return result
+
+    @staticmethod
+    def statement_query(sql: str) -> str:
+        """
+        The query behind an `EXECUTE stmt_...` of the prepared statements, the statement itself otherwise.
+        """
+        match = re.match(r'EXECUTE (stmt_\w+)', sql)
+        if match:
+            from app.repository import prepared_statements
+
+            return prepared_statements.query_of(match.group(1)) or sql
+        return sql
+
+    def explain(self, timings: RequestTimings, sql: str, params, seconds: float):
+        from app.repository import Repository
+
+        token = self._explaining.set(True)
+        try:
+            with transaction.atomic():
+                plan = Repository.explain_analyze(sql, params, buffers=True)
+                transaction.set_rollback(True)
+        except Exception as e:
+            logger.warning(f"Couldn't explain slow query: {e}")
+            return
+        finally:
+            self._explaining.reset(token)
+
+        sql = self.statement_query(sql)
+        timings.slow_queries.append({"sql": sql, "ms": round(seconds * 1000, 2), "plan": plan})
+        logger.warning(
+            f"Slow query {seconds * 1000:.1f}ms: {' '.join(sql.split())} plan: {json.dumps(plan)}",
+            extra={"sql": sql, "params": params, "plan": plan}
+        )
+
+
+query_timer = QueryTimer()
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    `connection_created` receiver adding the query timer to every connection, including the
+    connections of the threads sync views run in under ASGI.
+    """
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """
+        Adds the rendering of the response data to the `serialisation` span.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('serialisation'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class ServerTimingMiddleware:
+    """
+        Times every request, see `RequestTimings`, and returns the timings in a `Server-Timing`
+        header when `SERVER_TIMING_ENABLED`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings: RequestTimings):
+        # Streamed bodies are produced after this point, their timings only cover the first bytes.
+        timings.finish()
+        if settings.SERVER_TIMING_ENABLED:
+            response['Server-Timing'] = timings.server_timing(settings.SERVER_TIMING_MAX_QUERIES)
+
+        fields = timings.log_fields()
+        logger.info(
+            f"{request.method} {request.path} {response.status_code} {fields['total_ms']}ms {json.dumps(fields)}",
+            extra={"method": request.method, "path": request.path, "status": response.status_code, "timings": fields}
+        )
+        return response
@@ -0,0 +1,48 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import service
+from app.benchmark import formats, workload
+from app.queries import catalogue_regions_query
+from app.repository import Repository
+
+
+COLUMNS = ('bytes', 'ms', 'size_vs_json', 'time_vs_json')
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders the whole daily series of a lane in every `/rates/` format and reports the payload sizes "
+        "and the serialisation times against the JSON ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--origin', help='Port or region, the first top level region by default.')
+        parser.add_argument('--destination', help='Port or region, the second top level region by default.')
+        parser.add_argument('--date-from', help='First day of the series, the first day of the prices by default.')
+        parser.add_argument('--date-to', help='Last day of the series, the last day of the prices by default.')
+        parser.add_argument('--repeat', type=int, default=20, help='Renderings per format, the best one is reported.')
+
+    def handle(self, *args, **options):
+        date_from, date_to = workload.data_range()
+        if date_from is None:
+            raise CommandError("There are no prices, generate a dataset with `manage.py generate_dataset` first.")
+        date_from = datetime.date.fromisoformat(options['date_from']) if options['date_from'] else date_from
+        date_to = datetime.date.fromisoformat(options['date_to']) if options['date_to'] else date_to
+
+        origin, destination = options['origin'], options['destination']
+        if not (origin and destination):
+            roots = [slug for slug, parent_slug in Repository.fetch_all(catalogue_regions_query) if parent_slug is None]
+            if len(roots) < 2:
+                raise CommandError("Pass --origin and --destination, there are fewer than 2 top level regions.")
+            origin, destination = origin or roots[0], destination or roots[1]
+
+        rows = service.get_rates_with_dates_filled(origin, destination, date_from, date_to, None, None)["rates"]
+        self.stdout.write(f"{origin} -> {destination}, {len(rows)} days")
+        self.stdout.write(f"{'format':<12}" + ''.join(f"{column:>14}" for column in COLUMNS))
+        for format, result in formats.measure(rows, options['repeat']).items():
+            self.stdout.write(
+                f"{format:<12}{result['bytes']:>14}{result['ms']:>14.3f}"
+                f"{result['size_vs_json']:>14.1%}{result['time_vs_json']:>14.1%}"
+            )
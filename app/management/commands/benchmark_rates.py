@@ -0,0 +1,100 @@
+import datetime
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from app.benchmark import workload
+from app.cache import rates_cache
+from app.repository import memory_prices
+
+
+COLUMNS = ('requests', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'db_ms')
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives the rates endpoints with a mixed workload of port/region lanes over short and long ranges, "
+        "and reports the latency percentiles, the throughput and the database time per lane kind."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=600, help='Requests per endpoint.')
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument(
+            '--path', action='append', dest='paths', metavar='PATH',
+            help='Endpoint to benchmark, /rates/ by default, can be repeated.'
+        )
+        parser.add_argument(
+            '--url', help='Base URL of a running server, e.g. http://localhost:8000. In process by default.'
+        )
+        parser.add_argument('--date-from', help='First day of the ranges, the first day of the prices by default.')
+        parser.add_argument('--date-to', help='Last day of the ranges, the last day of the prices by default.')
+        parser.add_argument(
+            '--engine', choices=('sql', 'memory'),
+            help='Rates engine of the in process runs, `RATES_ENGINE` by default. The memory snapshot is loaded first.'
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Same seed, same requests.')
+        parser.add_argument('--keep-cache', action='store_true', help="Don't clear the rates cache first.")
+        parser.add_argument('--output', metavar='PATH', help='Write the results as JSON, e.g. to use as a baseline.')
+        parser.add_argument('--baseline', metavar='PATH', help='JSON results of an earlier run to compare with.')
+
+    def handle(self, *args, **options):
+        date_from, date_to = workload.data_range()
+        if date_from is None:
+            raise CommandError("There are no prices, generate a dataset with `manage.py generate_dataset` first.")
+        date_from = datetime.date.fromisoformat(options['date_from']) if options['date_from'] else date_from
+        date_to = datetime.date.fromisoformat(options['date_to']) if options['date_to'] else date_to
+
+        requests = workload.make_requests(random.Random(options['seed']), options['requests'], date_from, date_to)
+        client = workload.HttpClient(options['url']) if options['url'] else workload.InProcessClient()
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        if options['engine'] and options['url']:
+            raise CommandError("--engine only applies to in process runs, set RATES_ENGINE on the server instead.")
+
+        results = {}
+        with override_settings(**({'RATES_ENGINE': options['engine']} if options['engine'] else {})):
+            if options['engine'] == 'memory':
+                started = time.perf_counter()
+                snapshot = memory_prices.snapshot()
+                self.stdout.write(
+                    f"Loaded {len(snapshot)} lane days in memory in {time.perf_counter() - started:.2f}s"
+                )
+
+            for path in options['paths'] or ['/rates/']:
+                if not options['keep_cache'] and not options['url']:
+                    rates_cache.clear()
+                results[path] = workload.run(client, path, requests, options['concurrency'])
+                self.report(path, results[path], baseline.get(path, {}))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    def report(self, path: str, results: dict, baseline: dict):
+        self.stdout.write(self.style.MIGRATE_HEADING(path))
+        self.stdout.write(f"{'kind':<28}" + ''.join(f"{column:>12}" for column in COLUMNS))
+        for kind, result in results.items():
+            self.stdout.write(f"{kind:<28}" + ''.join(self.format(result[column]) for column in COLUMNS))
+            if kind in baseline:
+                self.stdout.write(f"{'  vs baseline':<28}" + ''.join(
+                    self.format_change(result[column], baseline[kind].get(column)) for column in COLUMNS
+                ))
+
+    @staticmethod
+    def format(value) -> str:
+        if value is None:
+            return f"{'-':>12}"
+        return f"{value:>12}" if isinstance(value, int) else f"{value:>12.2f}"
+
+    @staticmethod
+    def format_change(value, baseline_value) -> str:
+        if not value or not baseline_value:
+            return f"{'':>12}"
+        return f"{(value - baseline_value) / baseline_value:>+12.1%}"
@@ -0,0 +1,72 @@
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+
+from app.engine import RatesSnapshot
+from app.repository import MemoryPrices, catalogue, prices_version
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the in-memory engine snapshot of the prices and the catalogue to a file the server workers "
+        "map read-only, see `RATES_SNAPSHOT_PATH`. The file is replaced atomically, the workers switch to it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Snapshot file, `RATES_SNAPSHOT_PATH` by default.')
+        parser.add_argument(
+            '--if-stale', action='store_true', help="Don't rebuild a file taken from the current prices and catalogue."
+        )
+        parser.add_argument(
+            '--watch', type=float, metavar='SECONDS',
+            help='Keep running, checking every SECONDS seconds and rebuilding the file once it is stale.'
+        )
+
+    def is_current(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        try:
+            return MemoryPrices.is_current(RatesSnapshot.open(path))
+        except ValueError:
+            return False
+
+    def build(self, path: str):
+        started = time.perf_counter()
+        snapshot = MemoryPrices.build()
+        snapshot.write(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(snapshot)} lane days of prices version {snapshot.version[0]} to {path} "
+            f"({os.path.getsize(path) / 2 ** 20:.1f} MiB) in {time.perf_counter() - started:.2f}s"
+        ))
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.RATES_SNAPSHOT_PATH
+        if not path:
+            raise CommandError("Pass --path or set RATES_SNAPSHOT_PATH.")
+
+        if not options['watch']:
+            if options['if_stale'] and self.is_current(path):
+                self.stdout.write(f"{path} is up to date.")
+            else:
+                self.build(path)
+            return
+
+        while True:
+            try:
+                if not self.is_current(path):
+                    self.build(path)
+            except Exception:
+                # The workers query the database meanwhile, the next check tries again.
+                logger.exception(f"Couldn't rebuild the rates snapshot {path}")
+                if connection.connection is not None and not connection.is_usable():
+                    connection.close()
+            time.sleep(options['watch'])
+            prices_version.invalidate()
+            catalogue.invalidate()
@@ -0,0 +1,43 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.benchmark import dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a synthetic dataset of regions, ports and prices at a configurable scale and loads it "
+        "with COPY. Load it before installing the rollup, the triggers slow large loads down."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prices', default='10M', help='Number of price rows, e.g. 10M or 500M.')
+        parser.add_argument('--ports', type=int, default=1500)
+        parser.add_argument('--top-regions', type=int, default=8, help='Number of root regions.')
+        parser.add_argument('--depth', type=int, default=3, help='Levels of the region tree.')
+        parser.add_argument('--fanout', type=int, default=4, help='Maximum number of sub regions per region.')
+        parser.add_argument('--date-from', type=datetime.date.fromisoformat, default=datetime.date(2016, 1, 1))
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--quotes-per-day', type=float, default=3, help='Mean number of quotes per lane and day.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--reset', action='store_true', help='Empty the prices, ports and regions tables first.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['reset'] and dataset.has_prices():
+            raise CommandError("The prices table isn't empty, pass --reset to replace its data.")
+
+        started = time.monotonic()
+        counts = dataset.generate(
+            prices=dataset.parse_count(options['prices']), ports=options['ports'],
+            top_regions=options['top_regions'], depth=options['depth'], fanout=options['fanout'],
+            date_from=options['date_from'], days=options['days'], quotes_per_day=options['quotes_per_day'],
+            seed=options['seed'], reset=options['reset'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {counts['regions']} regions, {counts['ports']} ports and {counts['prices']} prices "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,57 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from app import service
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk loads prices from a CSV or NDJSON file with COPY, appended to the prices, "
+        "and refreshes the touched days of the rollup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to load, `-` for stdin.')
+        parser.add_argument(
+            '--format', choices=service.PRICE_FORMATS,
+            help='Format of the file, guessed from its extension by default, csv for stdin.'
+        )
+        parser.add_argument(
+            '--batch-id',
+            help='Id of the batch, the file is skipped when a batch of that id was already loaded.'
+        )
+        parser.add_argument(
+            '--touched-output', metavar='PATH',
+            help='Write the touched orig_code,dest_code,day keys to this CSV file.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+
+        lines = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            result = service.ingest_prices(lines, format, options['batch_id'])
+        except ValidationError as e:
+            raise CommandError(e.detail['message'])
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+
+        if options['touched_output']:
+            with open(options['touched_output'], 'w', newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(('orig_code', 'dest_code', 'day'))
+                writer.writerows(result['touched'])
+
+        if result['duplicate']:
+            self.stdout.write(self.style.WARNING(
+                f"Batch {options['batch_id']} was already loaded, skipped its {result['received']} prices."
+            ))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {result['inserted']} of {result['received']} prices, touched {len(result['touched'])} lane days."
+        ))
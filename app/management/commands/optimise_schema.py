@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.repository import Prices, Repository, SchemaOptimisations
+
+
+# Standard lanes the EXPLAIN timings are reported for: port <-> port, port <-> region, region <-> region.
+DEFAULT_LANES = [
+    ('CNSGH', 'NLRTM'),
+    ('CNSGH', 'north_europe_main'),
+    ('china_east_main', 'NLRTM'),
+    ('china_main', 'northern_europe'),
+]
+
+
+class Command(BaseCommand):
+    help = "Applies the pending schema optimisation steps (indexes and keys) and analyzes the tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lane', action='append', dest='lanes', metavar='ORIGIN:DESTINATION',
+            help='Lane to report the EXPLAIN timings for, can be repeated.'
+        )
+        parser.add_argument('--date-from', default='2016-01-01')
+        parser.add_argument('--date-to', default='2016-01-31')
+        parser.add_argument(
+            '--no-explain', action='store_false', dest='explain',
+            help="Don't report the before/after EXPLAIN timings."
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true', help='Only list the pending steps.'
+        )
+
+    def parse_lanes(self, lanes):
+        if not lanes:
+            return DEFAULT_LANES
+        parsed = []
+        for lane in lanes:
+            origin, _, destination = lane.partition(':')
+            if not (origin and destination):
+                raise CommandError(f"Invalid lane {lane}, should be given as ORIGIN:DESTINATION")
+            parsed.append((origin, destination))
+        return parsed
+
+    def explain(self, lanes, date_from, date_to):
+        timings = {}
+        for origin, destination in lanes:
+            rate_query = Prices.rate_query(origin, destination, date_from, date_to)
+            plan = Repository.explain_analyze(*rate_query.sparse_query)
+            timings[(origin, destination)] = (plan['Planning Time'], plan['Execution Time'])
+        return timings
+
+    def handle(self, *args, **options):
+        pending = SchemaOptimisations.pending()
+        if options['dry_run']:
+            for version in pending:
+                self.stdout.write(version)
+            return
+
+        lanes = self.parse_lanes(options['lanes'])
+        if options['explain']:
+            before = self.explain(lanes, options['date_from'], options['date_to'])
+
+        applied = SchemaOptimisations.apply()
+        for version in applied:
+            self.stdout.write(self.style.SUCCESS(f"Applied {version}"))
+        if not applied:
+            self.stdout.write("Schema is up to date, analyzed the tables.")
+
+        if options['explain']:
+            after = self.explain(lanes, options['date_from'], options['date_to'])
+            self.stdout.write(f"{'lane':<40} {'before (plan/exec ms)':>24} {'after (plan/exec ms)':>24}")
+            for lane in lanes:
+                self.stdout.write(
+                    f"{' -> '.join(lane):<40} "
+                    f"{before[lane][0]:>11.2f}/{before[lane][1]:<12.2f} "
+                    f"{after[lane][0]:>11.2f}/{after[lane][1]:<12.2f}"
+                )
@@ -0,0 +1,51 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.repository import PricePartitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Converts `prices` to a table range partitioned by month, online: the writes only wait while a "
+        "month is copied. On a partitioned `prices`, creates the partitions of the coming months."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int, default=3, help='Partitions to create after the current month.'
+        )
+        parser.add_argument(
+            '--ensure', action='store_true',
+            help="Only create the coming months' partitions, e.g. from a daily cron, `prices` must be partitioned."
+        )
+        parser.add_argument(
+            '--drop-old', action='store_true', help='Drop the unpartitioned table once swapped out.'
+        )
+        parser.add_argument('--today', help='Current day the coming months are counted from, today by default.')
+
+    def handle(self, *args, **options):
+        today = datetime.date.fromisoformat(options['today']) if options['today'] else datetime.date.today()
+        partitioned = PricePartitions.is_partitioned()
+
+        if options['ensure'] or partitioned:
+            if not partitioned:
+                raise CommandError("`prices` isn't partitioned yet, run the command without --ensure first.")
+            created = PricePartitions.ensure(PricePartitions.future_months(today, options['months_ahead']))
+            for month in created:
+                self.stdout.write(self.style.SUCCESS(f"Created the partition of {month:%Y-%m}"))
+            if not created:
+                self.stdout.write("The partitions are up to date.")
+            return
+
+        months = PricePartitions.prepare(today, options['months_ahead'])
+        self.stdout.write(f"Created the partitioned copy, backfilling {len(months)} months")
+        for month in months:
+            PricePartitions.backfill(month)
+            self.stdout.write(f"  {month:%Y-%m}")
+
+        triggers = PricePartitions.swap(options['drop_old'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Swapped in the partitioned prices, {len(PricePartitions.partitions())} partitions, "
+            f"moved the triggers {', '.join(triggers) or '-'}"
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from app.repository import PriceRollup
+
+
+class Command(BaseCommand):
+    help = "Refreshes the `prices_daily` and `prices_monthly` rollups, recomputing only the lane days touched since the last refresh."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--install', action='store_true',
+            help='Create the rollup tables and the triggers on `prices`, then build the rollup.'
+        )
+        parser.add_argument(
+            '--full', action='store_true', help='Rebuild the whole rollup from `prices`.'
+        )
+
+    def handle(self, *args, **options):
+        if options['install']:
+            PriceRollup.install()
+            self.stdout.write(self.style.SUCCESS("Installed and built the prices_daily rollup."))
+            return
+
+        if options['full']:
+            PriceRollup.refresh(full=True)
+            self.stdout.write(self.style.SUCCESS("Rebuilt the prices_daily rollup."))
+            return
+
+        touched = PriceRollup.refresh()
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {touched} lane days of the prices_daily rollup."))
@@ -0,0 +1,18 @@
+import hmac
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class IngestTokenPermission(BasePermission):
+    """
+        Allows the requests bearing the `PRICES_INGEST_TOKEN` in an `Authorization: Bearer <token>` header,
+        and none while that setting is empty.
+    """
+
+    message = "A valid ingest token is required."
+
+    def has_permission(self, request, view):
+        token = settings.PRICES_INGEST_TOKEN
+        scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip().encode(), token.encode())
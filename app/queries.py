@@ -1,17 +1,20 @@
 import re
+from datetime import date, datetime, timedelta
 from string import Template
+from typing import NamedTuple
 
 
-# This query will be used if one of source/destination is a port
-port_query = lambda port_code: f"""
-select code from ports where ports.code = '{port_code}'
+# This query will be used if one of source/destination is a port, takes the port code as parameter
+port_query = """
+select code from ports where ports.code = %s
 """
 
 
-# This query will be used if one of source/destination is a region, to fetch all the port codes recursively
-region_query = lambda region_code: f"""
+# This query will be used if one of source/destination is a region, to fetch all the port codes recursively,
+# takes the region slug as parameter
+region_query = """
 with RECURSIVE children AS (
-    select slug, name, parent_slug from regions where slug  = '{region_code}'
+    select slug, name, parent_slug from regions where slug  = %s
     union
     select r.slug, r.name, r.parent_slug 
     from regions r inner join children as c 
@@ -22,70 +25,643 @@ join ports p on p.parent_slug = c.slug
 """
 
 
+# Queries used by the in-memory catalogue to load the port/region hierarchy.
+catalogue_regions_query = "select slug, parent_slug from regions"
+catalogue_ports_query = "select code, parent_slug from ports"
+# The flattened region tree, once `optimise_schema` installed `region_ports`.
+catalogue_region_ports_query = "select region_slug, port_code from region_ports"
+
+# Cheap fingerprint of the ports/regions tables, the catalogue reloads itself when it changes.
+catalogue_version_query = """
+select md5(coalesce(string_agg(entry, ',' order by entry), '')) from (
+    select 'r:' || slug || ':' || coalesce(parent_slug, '') as entry from regions
+    union all
+    select 'p:' || code || ':' || parent_slug as entry from ports
+) entries
+"""
+
+
+# Daily rollup of the prices per lane, `RateQuery` can aggregate from it instead of the raw rows.
+# Inserts/updates/deletes on `prices` enqueue the (orig_code, dest_code, day) keys they touched,
+# so a refresh only recomputes those keys.
+# `prices_monthly` is the same rollup per calendar month, `day` being the 1st of the month, it is
+# recomputed from `prices_daily` for the months of the touched keys.
+rollup_install_queries = [
+    """
+    create table if not exists prices_daily (
+        orig_code text not null,
+        dest_code text not null,
+        day date not null,
+        sum_price bigint not null,
+        n_prices integer not null,
+        primary key (orig_code, dest_code, day)
+    )
+    """,
+    """
+    create table if not exists prices_monthly (
+        orig_code text not null,
+        dest_code text not null,
+        day date not null,
+        sum_price bigint not null,
+        n_prices integer not null,
+        primary key (orig_code, dest_code, day)
+    )
+    """,
+    """
+    create table if not exists prices_daily_queue (
+        orig_code text not null,
+        dest_code text not null,
+        day date not null
+    )
+    """,
+    """
+    create or replace function prices_daily_enqueue() returns trigger as $$
+    begin
+        if TG_OP in ('INSERT', 'UPDATE') then
+            insert into prices_daily_queue select distinct orig_code, dest_code, day from new_rows;
+        end if;
+        if TG_OP in ('UPDATE', 'DELETE') then
+            insert into prices_daily_queue select distinct orig_code, dest_code, day from old_rows;
+        end if;
+        return null;
+    end
+    $$ language plpgsql
+    """,
+    """
+    create or replace function prices_daily_truncate() returns trigger as $$
+    begin
+        truncate prices_daily, prices_monthly, prices_daily_queue;
+        return null;
+    end
+    $$ language plpgsql
+    """,
+    "drop trigger if exists prices_daily_insert on prices",
+    "drop trigger if exists prices_daily_update on prices",
+    "drop trigger if exists prices_daily_delete on prices",
+    "drop trigger if exists prices_daily_truncate on prices",
+    """
+    create trigger prices_daily_insert after insert on prices
+    referencing new table as new_rows
+    for each statement execute procedure prices_daily_enqueue()
+    """,
+    """
+    create trigger prices_daily_update after update on prices
+    referencing old table as old_rows new table as new_rows
+    for each statement execute procedure prices_daily_enqueue()
+    """,
+    """
+    create trigger prices_daily_delete after delete on prices
+    referencing old table as old_rows
+    for each statement execute procedure prices_daily_enqueue()
+    """,
+    """
+    create trigger prices_daily_truncate after truncate on prices
+    for each statement execute procedure prices_daily_truncate()
+    """,
+]
+
+# Serialises concurrent refreshes of the rollup.
+rollup_lock_query = "select pg_advisory_xact_lock(hashtext('prices_daily'))"
+
+rollup_full_refresh_queries = [
+    "truncate prices_daily_queue",
+    "delete from prices_daily",
+    """
+    insert into prices_daily (orig_code, dest_code, day, sum_price, n_prices)
+    select orig_code, dest_code, day, sum(price), count(*) from prices
+    group by orig_code, dest_code, day
+    """,
+    "delete from prices_monthly",
+    """
+    insert into prices_monthly (orig_code, dest_code, day, sum_price, n_prices)
+    select orig_code, dest_code, date_trunc('month', day)::date, sum(sum_price), sum(n_prices) from prices_daily
+    group by orig_code, dest_code, date_trunc('month', day)::date
+    """,
+]
+
+rollup_incremental_refresh_queries = [
+    # Left over when the refresh ran inside an outer transaction.
+    "drop table if exists prices_daily_touched",
+    """
+    create temporary table prices_daily_touched on commit drop as
+    with dequeued as (
+        delete from prices_daily_queue returning orig_code, dest_code, day
+    )
+    select distinct orig_code, dest_code, day from dequeued
+    """,
+    """
+    delete from prices_daily d using prices_daily_touched t
+    where d.orig_code = t.orig_code and d.dest_code = t.dest_code and d.day = t.day
+    """,
+    """
+    insert into prices_daily (orig_code, dest_code, day, sum_price, n_prices)
+    select p.orig_code, p.dest_code, p.day, sum(p.price), count(*)
+    from prices p join prices_daily_touched t
+    on p.orig_code = t.orig_code and p.dest_code = t.dest_code and p.day = t.day
+    group by p.orig_code, p.dest_code, p.day
+    """,
+    "drop table if exists prices_monthly_touched",
+    """
+    create temporary table prices_monthly_touched on commit drop as
+    select distinct orig_code, dest_code, date_trunc('month', day)::date as day from prices_daily_touched
+    """,
+    """
+    delete from prices_monthly m using prices_monthly_touched t
+    where m.orig_code = t.orig_code and m.dest_code = t.dest_code and m.day = t.day
+    """,
+    """
+    insert into prices_monthly (orig_code, dest_code, day, sum_price, n_prices)
+    select d.orig_code, d.dest_code, t.day, sum(d.sum_price), sum(d.n_prices)
+    from prices_daily d join prices_monthly_touched t
+    on d.orig_code = t.orig_code and d.dest_code = t.dest_code
+    and d.day >= t.day and d.day < (t.day + interval '1 month')::date
+    group by d.orig_code, d.dest_code, t.day
+    """,
+]
+
+rollup_touched_count_query = "select count(*) from prices_daily_touched"
+
+rollup_installed_query = "select to_regclass('prices_daily_queue') is not null"
+
+
+# Bulk loading of prices, `COPY` into a staging table then append the batch to the prices.
+ingest_staging_queries = [
+    # Left over when the load ran inside an outer transaction.
+    "drop table if exists prices_staging",
+    """
+    create temporary table prices_staging (
+        orig_code text,
+        dest_code text,
+        day date,
+        price integer
+    ) on commit drop
+    """,
+]
+
+ingest_copy_query = "copy prices_staging (orig_code, dest_code, day, price) from stdin with (format csv)"
+
+ingest_filter_queries = [
+    "drop table if exists prices_ingested",
+    # Rows with a missing value or an unknown port are skipped, identical quotes are all kept.
+    """
+    create temporary table prices_ingested on commit drop as
+    select s.orig_code, s.dest_code, s.day, s.price
+    from prices_staging s
+    where s.orig_code is not null and s.dest_code is not null and s.day is not null and s.price is not null
+    and exists (select 1 from ports o where o.code = s.orig_code)
+    and exists (select 1 from ports d where d.code = s.dest_code)
+    """,
+]
+
+# Ids of the loaded batches, a batch loaded again under the same id is skipped as a whole.
+ingest_batches_install_query = """
+create table if not exists price_batches (
+    batch_id text primary key,
+    n_prices integer not null default 0,
+    loaded_at timestamptz not null default now()
+)
+"""
+
+# Waits for a concurrent load of the same batch, then returns no row once it committed.
+ingest_batch_claim_query = "insert into price_batches (batch_id) values (%s) on conflict do nothing returning batch_id"
+
+ingest_batch_record_query = "update price_batches set n_prices = %s where batch_id = %s returning batch_id"
+
+ingest_insert_query = """
+insert into prices (orig_code, dest_code, day, price)
+select orig_code, dest_code, day, price from prices_ingested
+"""
+
+ingest_counts_query = "select (select count(*) from prices_staging), (select count(*) from prices_ingested)"
+
+ingest_months_query = "select distinct date_trunc('month', day)::date from prices_ingested"
+
+ingest_touched_keys_query = "select distinct orig_code, dest_code, day from prices_ingested order by orig_code, dest_code, day"
+
+
+# Synthetic benchmark datasets, see `app.benchmark.dataset`. Same tables as `ratestask/rates.sql`.
+dataset_schema_queries = [
+    """
+    create table if not exists regions (
+        slug text not null,
+        name text not null,
+        parent_slug text
+    )
+    """,
+    """
+    create table if not exists ports (
+        code text not null,
+        name text not null,
+        parent_slug text not null
+    )
+    """,
+    """
+    create table if not exists prices (
+        orig_code text not null,
+        dest_code text not null,
+        day date not null,
+        price integer not null
+    )
+    """,
+]
+
+dataset_truncate_query = "truncate prices, ports, regions"
+
+dataset_prices_table_exists_query = "select to_regclass('prices') is not null"
+
+dataset_has_prices_query = "select exists (select 1 from prices)"
+
+dataset_copy_regions_query = "copy regions (slug, name, parent_slug) from stdin with (format csv)"
+
+dataset_copy_ports_query = "copy ports (code, name, parent_slug) from stdin with (format csv)"
+
+dataset_copy_prices_query = "copy prices (orig_code, dest_code, day, price) from stdin with (format csv)"
+
+dataset_analyze_query = "analyze regions, ports, prices"
+
+prices_date_range_query = "select min(day), max(day) from prices"
+
+
+# `(orig_code, dest_code, day number, sum_price, n_prices)` rows loaded by the in-memory engine, see
+# `app.engine`, the day number being the days since 1970-01-01, from the prices or the daily rollup.
+memory_engine_prices_query = """
+    select orig_code, dest_code, day - date '1970-01-01', sum(price), count(*)
+    from prices group by orig_code, dest_code, day
+"""
+
+memory_engine_rollup_query = "select orig_code, dest_code, day - date '1970-01-01', sum_price, n_prices from prices_daily"
+
+
+# Versioned schema optimisation steps, applied in order by `manage.py optimise_schema`.
+# Every step must be idempotent, the applied versions are recorded in `schema_optimisations`.
+schema_optimisation_install_query = """
+create table if not exists schema_optimisations (
+    version text primary key,
+    applied_at timestamptz not null default now()
+)
+"""
+schema_optimisation_applied_query = "select version from schema_optimisations"
+schema_optimisation_record_query = "insert into schema_optimisations (version) values (%s) on conflict do nothing"
+
+add_primary_key_query = lambda table, column: f"""
+do $$
+begin
+    if not exists (
+        select 1 from pg_constraint where conrelid = '{table}'::regclass and contype = 'p'
+    ) then
+        alter table {table} add constraint {table}_pkey primary key ({column});
+    end if;
+end
+$$
+"""
+
+schema_optimisation_steps = [
+    ("0001_prices_lane_day_index", [
+        # Covers the lane and date filter of `RateQuery`, and the price for index only scans.
+        "create index if not exists prices_orig_dest_day_idx on prices (orig_code, dest_code, day) include (price)",
+    ]),
+    ("0002_ports_regions_keys", [
+        add_primary_key_query('ports', 'code'),
+        add_primary_key_query('regions', 'slug'),
+    ]),
+    ("0003_parent_slug_indexes", [
+        "create index if not exists ports_parent_slug_idx on ports (parent_slug)",
+        "create index if not exists regions_parent_slug_idx on regions (parent_slug)",
+    ]),
+    ("0004_prices_data_version", [
+        # Version stamp of the prices, bumped by every statement writing to `prices`.
+        """
+        create table if not exists data_version (
+            name text primary key,
+            version bigint not null default 0,
+            updated_at timestamptz not null default now()
+        )
+        """,
+        "insert into data_version (name) values ('prices') on conflict do nothing",
+        """
+        create or replace function bump_prices_data_version() returns trigger as $$
+        begin
+            update data_version set version = version + 1, updated_at = now() where name = 'prices';
+            return null;
+        end
+        $$ language plpgsql
+        """,
+        "drop trigger if exists prices_data_version on prices",
+        """
+        create trigger prices_data_version after insert or update or delete or truncate on prices
+        for each statement execute procedure bump_prices_data_version()
+        """,
+    ]),
+    ("0005_region_closure", [
+        # `region_closure` holds every (ancestor, descendant) pair of the region tree, a region being its
+        # own descendant at depth 0, and `region_ports` the ports of every region and of its descendants.
+        # Both are rebuilt by statement triggers on `regions` and `ports`, which are tiny.
+        """
+        create table if not exists region_closure (
+            ancestor_slug text not null,
+            descendant_slug text not null,
+            depth integer not null,
+            primary key (ancestor_slug, descendant_slug)
+        )
+        """,
+        "create index if not exists region_closure_descendant_idx on region_closure (descendant_slug)",
+        """
+        create table if not exists region_ports (
+            region_slug text not null,
+            port_code text not null,
+            primary key (region_slug, port_code)
+        )
+        """,
+        "create index if not exists region_ports_port_code_idx on region_ports (port_code)",
+        """
+        create or replace function rebuild_region_closure() returns void as $$
+        begin
+            -- Concurrent rebuilds would insert the same keys.
+            perform pg_advisory_xact_lock(hashtext('region_closure'));
+            delete from region_closure;
+            insert into region_closure (ancestor_slug, descendant_slug, depth)
+            with recursive closure (ancestor_slug, descendant_slug, depth, path) as (
+                select slug, slug, 0, array[slug] from regions
+                union all
+                select c.ancestor_slug, r.slug, c.depth + 1, c.path || r.slug
+                from closure c join regions r on r.parent_slug = c.descendant_slug
+                -- Stops at cycles instead of recursing forever.
+                where not r.slug = any(c.path)
+            )
+            select ancestor_slug, descendant_slug, min(depth) from closure group by ancestor_slug, descendant_slug;
+            delete from region_ports;
+            insert into region_ports (region_slug, port_code)
+            select distinct c.ancestor_slug, p.code from region_closure c join ports p on p.parent_slug = c.descendant_slug;
+        end
+        $$ language plpgsql
+        """,
+        """
+        create or replace function region_closure_rebuild_trigger() returns trigger as $$
+        begin
+            perform rebuild_region_closure();
+            return null;
+        end
+        $$ language plpgsql
+        """,
+        "drop trigger if exists regions_region_closure on regions",
+        "drop trigger if exists ports_region_closure on ports",
+        """
+        create trigger regions_region_closure after insert or update or delete or truncate on regions
+        for each statement execute procedure region_closure_rebuild_trigger()
+        """,
+        """
+        create trigger ports_region_closure after insert or update or delete or truncate on ports
+        for each statement execute procedure region_closure_rebuild_trigger()
+        """,
+        "select rebuild_region_closure()",
+    ]),
+    ("0006_catalogue_data_version", [
+        # Version stamp of the catalogue, bumped by every statement writing to `regions` or `ports`.
+        "insert into data_version (name) values ('catalogue') on conflict do nothing",
+        """
+        create or replace function bump_catalogue_data_version() returns trigger as $$
+        begin
+            update data_version set version = version + 1, updated_at = now() where name = 'catalogue';
+            return null;
+        end
+        $$ language plpgsql
+        """,
+        "drop trigger if exists regions_data_version on regions",
+        "drop trigger if exists ports_data_version on ports",
+        """
+        create trigger regions_data_version after insert or update or delete or truncate on regions
+        for each statement execute procedure bump_catalogue_data_version()
+        """,
+        """
+        create trigger ports_data_version after insert or update or delete or truncate on ports
+        for each statement execute procedure bump_catalogue_data_version()
+        """,
+    ]),
+]
+
+# The region closure tables are created by `optimise_schema`, they may not exist yet.
+region_closure_installed_query = "select to_regclass('region_ports') is not null"
+region_closure_rebuild_query = "select rebuild_region_closure()"
+
+# The data version table is created by `optimise_schema`, it may not exist yet.
+data_version_table_exists_query = "select to_regclass('data_version') is not null"
+data_version_query = "select version, updated_at from data_version where name = %s"
+data_version_bump_query = "update data_version set version = version + 1, updated_at = now() where name = %s returning version"
+
+schema_analyze_queries = ["analyze prices", "analyze ports", "analyze regions"]
+
+
+# Range partitioning of `prices` by month, see `PricePartitions`. The partitions are named
+# `prices_pYYYY_MM`, the days without a partition go to `prices_default`.
+prices_partitioned_query = """
+select exists (select 1 from pg_partitioned_table where partrelid = to_regclass('prices'))
+"""
+
+# Partitions of a partitioned table.
+partitions_query = """
+select c.relname from pg_inherits i join pg_class c on c.oid = i.inhrelid
+where i.inhparent = to_regclass(%s) order by c.relname
+"""
+
+prices_months_query = "select distinct date_trunc('month', day)::date from prices order by 1"
+
+partition_name = lambda month: f"prices_p{month.year:04d}_{month.month:02d}"
+
+# A new month partition takes over the rows of its month from the default partition. It is filled
+# and checked before being attached, so attaching it doesn't scan it.
+create_month_partition_queries = lambda table, month, next_month: [
+    f"create table {partition_name(month)} (like {table} including defaults)",
+    f"""
+    alter table {partition_name(month)} add constraint {partition_name(month)}_range
+    check (day >= '{month.isoformat()}'::date and day < '{next_month.isoformat()}'::date)
+    """,
+    f"""
+    with moved as (
+        delete from {table}_default where day >= '{month.isoformat()}'::date and day < '{next_month.isoformat()}'::date
+        returning orig_code, dest_code, day, price
+    )
+    insert into {partition_name(month)} (orig_code, dest_code, day, price) select * from moved
+    """,
+    f"""
+    alter table {table} attach partition {partition_name(month)}
+    for values from ('{month.isoformat()}') to ('{next_month.isoformat()}')
+    """,
+    f"alter table {partition_name(month)} drop constraint {partition_name(month)}_range",
+]
+
+# Online conversion of the `prices` heap: a partitioned copy is created next to it and kept in sync
+# by triggers, backfilled one month at a time, then swapped in.
+partitioning_prepare_queries = [
+    "create table if not exists prices_partitioned (like prices including defaults) partition by range (day)",
+    "create table if not exists prices_partitioned_default partition of prices_partitioned default",
+    """
+    create index if not exists prices_partitioned_orig_dest_day_idx
+    on prices_partitioned (orig_code, dest_code, day) include (price)
+    """,
+    # Prices have no key, a deleted row is any one of its identical copies.
+    """
+    create or replace function prices_partitioning_forward() returns trigger as $$
+    begin
+        if TG_OP in ('UPDATE', 'DELETE') then
+            delete from prices_partitioned where (tableoid, ctid) = (
+                select tableoid, ctid from prices_partitioned
+                where orig_code = OLD.orig_code and dest_code = OLD.dest_code and day = OLD.day and price = OLD.price
+                limit 1
+            );
+        end if;
+        if TG_OP in ('INSERT', 'UPDATE') then
+            insert into prices_partitioned (orig_code, dest_code, day, price)
+            values (NEW.orig_code, NEW.dest_code, NEW.day, NEW.price);
+        end if;
+        return null;
+    end
+    $$ language plpgsql
+    """,
+    """
+    create or replace function prices_partitioning_truncate() returns trigger as $$
+    begin
+        truncate prices_partitioned;
+        return null;
+    end
+    $$ language plpgsql
+    """,
+    "drop trigger if exists prices_partitioning_forward on prices",
+    "drop trigger if exists prices_partitioning_truncate on prices",
+    """
+    create trigger prices_partitioning_forward after insert or update or delete on prices
+    for each row execute procedure prices_partitioning_forward()
+    """,
+    """
+    create trigger prices_partitioning_truncate after truncate on prices
+    for each statement execute procedure prices_partitioning_truncate()
+    """,
+]
+
+# Copies a month while the writes to `prices` wait, the rows the triggers forwarded for it are replaced.
+partitioning_backfill_queries = [
+    "lock table prices in share mode",
+    "delete from prices_partitioned where day >= %s and day < %s",
+    """
+    insert into prices_partitioned (orig_code, dest_code, day, price)
+    select orig_code, dest_code, day, price from prices where day >= %s and day < %s
+    """,
+]
+
+partitioning_lock_query = "lock table prices in access exclusive mode"
+
+# Foreign keys declared on a table, e.g. the references of `prices` to `ports` in `ratestask/rates.sql`,
+# which `like prices` doesn't copy. The keys a partition inherits from its table are left out.
+foreign_keys_query = """
+select conname, pg_get_constraintdef(oid) from pg_constraint
+where conrelid = to_regclass(%s) and contype = 'f' and conparentid = 0
+order by conname
+"""
+
+add_constraint_query = lambda table, name, definition: f"alter table {table} add constraint {name} {definition}"
+
+# Triggers of `prices` to move to the partitioned table, e.g. the rollup queue and the data version.
+prices_triggers_query = """
+select tgname, pg_get_triggerdef(oid) from pg_trigger
+where tgrelid = 'prices'::regclass and not tgisinternal and tgname not like 'prices_partitioning_%'
+order by tgname
+"""
+
+partitioning_swap_queries = [
+    "drop trigger prices_partitioning_forward on prices",
+    "drop trigger prices_partitioning_truncate on prices",
+    "drop function prices_partitioning_forward()",
+    "drop function prices_partitioning_truncate()",
+    "alter table prices rename to prices_unpartitioned",
+    "alter index if exists prices_orig_dest_day_idx rename to prices_unpartitioned_orig_dest_day_idx",
+    "alter table prices_partitioned rename to prices",
+    "alter table prices_partitioned_default rename to prices_default",
+    "alter index prices_partitioned_orig_dest_day_idx rename to prices_orig_dest_day_idx",
+]
+
+drop_trigger_query = lambda table, name: f"drop trigger {name} on {table}"
+
+partitioning_drop_old_query = "drop table prices_unpartitioned"
+
+partitioning_analyze_query = "analyze prices"
+
+
+class Granularity(NamedTuple):
+    """
+        Size of the buckets the rates are averaged over: `size` days, a week from Monday to Sunday
+        or a calendar month. A bucket is identified by its first day.
+    """
+    unit: str
+    size: int = 1
+
+    pattern = re.compile(r'(?:(day|week|month)|([1-9][0-9]{0,3})d?)')
+
+    @classmethod
+    def parse(cls, value: str):
+        """
+        Parses `day`, `week`, `month` or a number of days, e.g. `14d`, None when invalid.
+        """
+        match = cls.pattern.fullmatch(value or '')
+        if not match:
+            return None
+        return cls(match.group(1)) if match.group(1) else cls('day', int(match.group(2)))
+
+    def __str__(self) -> str:
+        return self.unit if self.unit != 'day' or self.size == 1 else f"{self.size}d"
+
+
+Granularity.DAY = Granularity('day')
+
+
 class RateQuery:
     """
         This class provides an abstraction over the rates query that will be used to fetch the prices,
         providing methods to manipulate the query according to filters, ordering and pagination.
 
-        It has two properties, 
-          - query: Outputs the final query to fetch the results.
-          - counter_query: Outputs the query to find the total_count.
+        It has four query properties,
+          - query: Outputs the final query to fetch the results, with the dates filled in SQL.
+          - sparse_query: Outputs the days with prices of the page, the dates are filled by the caller.
+          - cursor_query: Outputs the page of days after/before a cursor day, see `add_cursor`.
+          - bucket_query: Outputs the averages bucketed by week or month, see `add_granularity`.
+
+        Every property outputs a `(sql, params)` pair, all values are passed as bind parameters, so
+        the SQL text only depends on which filters are used and the query plan can be reused.
 
-        Example Usage:        
+        With `use_rollup=True` the daily averages are aggregated from the `prices_daily` rollup
+        instead of the raw `prices` rows.
+
+        Example Usage:
         ```
-            rate_query = RateQuery().add_source_destination_filter(
-                source="CNGGZ", destination="northern_europe"
+            rate_query = RateQuery().add_port_codes_filter(
+                catalogue.port_codes("CNGGZ"), catalogue.port_codes("northern_europe")
             ).add_dates_filter(
-                date_from="2016-01-1"
+                date_from="2016-01-01"
             ).add_pagination_params(
                 1, 20
             ).add_ordering(
                 'dd'
             )
+            sql, params = rate_query.sparse_query
         ```
-        
-        Example Query:
+
+        Example Query, of `sparse_query`:
         ```
-            with base as (                
-                select day, (
-                    case 
-                        when count(*) < 3 then null else round(avg(price))
-                    end
-                ) as avg_price from prices
-                WHERE orig_code in (
-                    with RECURSIVE children AS (
-                        select slug, name, parent_slug from regions where slug  = 'china_main'
-                        union
-                        select r.slug, r.name, r.parent_slug 
-                        from regions r inner join children as c 
-                        on r.parent_slug = c.slug 
-                    )
-                    select p.code from children c
-                    join ports p on p.parent_slug = c.slug
-                
-                )
-                and dest_code in (
-                    with RECURSIVE children AS (
-                        select slug, name, parent_slug from regions where slug  = 'northern_europe'
-                        union
-                        select r.slug, r.name, r.parent_slug 
-                        from regions r inner join children as c 
-                        on r.parent_slug = c.slug 
-                    )
-                    select p.code from children c
-                    join ports p on p.parent_slug = c.slug
-                
-                )
-                group by day
-            ),
-            min_max_dates as (
-                select max(day) as max_date, min(day) as min_date from base
+            with bounds as (
+                select min(day) as min_date, max(day) as max_date from prices
+                WHERE  orig_code = any(%s) and dest_code = any(%s) and day >= %s
             ),
-            date_range as (
-                SELECT date_trunc('day', dd):: date as dd
-                FROM generate_series((select min_date from min_max_dates)::timestamp , (select max_date from min_max_dates)::timestamp, '1 day'::interval) dd
+            base as (
+                select day, round(avg(price)) as avg_price, count(*) as n_prices from prices
+                WHERE  orig_code = any(%s) and dest_code = any(%s) and day >= %s
+                and day between (select min_date from bounds) + %s::int and (select min_date from bounds) + %s::int
+                group by day
             )
-            select dd, avg_price from base right join date_range on base.day = date_range.dd;
+            select base.day, base.avg_price, base.n_prices, bounds.min_date, bounds.max_date
+            from bounds left join base on true order by base.day;
+        ```
+
+        Example Params:
+        ```
+            [['CNGGZ'], ['DKFRC', 'NOMAY', ...], date(2016, 1, 1), ['CNGGZ'], ['DKFRC', 'NOMAY', ...], date(2016, 1, 1), 0, 19]
         ```
     """
 
@@ -100,16 +676,86 @@ class RateQuery:
     def is_region(cls, port_or_region: str):
         return re.match(cls.region_slug_pattern, port_or_region)
 
-    def __init__(self) -> None:
-        # Base query template, will be subsituted by filtering clause. 
-        self._base_query_template = Template(
-            f"""
-                with base as (                
+    # Aggregates over the raw prices.
+    prices_aggregate = """
                     select day, (
                         case 
                             when count(*) < 3 then null else round(avg(price))
                         end
-                    ) as avg_price from prices
+                    ) as avg_price from prices"""
+
+    # Same aggregate from the daily rollup, the average is rebuilt from sums and counts,
+    # which gives exactly the same result as `avg(price)` on the raw rows.
+    rollup_aggregate = """
+                    select day, (
+                        case 
+                            when sum(n_prices) < 3 then null else round(sum(sum_price)::numeric / sum(n_prices))
+                        end
+                    ) as avg_price from prices_daily"""
+
+    # Sparse aggregates, only the days with prices along with their number of prices. The days with
+    # fewer than 3 prices are nulled when the dates are filled, see `app.series`.
+    prices_sparse_aggregate = """
+                    select day, round(avg(price)) as avg_price, count(*) as n_prices from prices"""
+
+    rollup_sparse_aggregate = """
+                    select day, round(sum(sum_price)::numeric / sum(n_prices)) as avg_price,
+                    sum(n_prices) as n_prices from prices_daily"""
+
+    # Sparse aggregates over buckets of days, see `add_granularity`. The bucket averages are rebuilt
+    # from the sums and counts of their days, and the minimum number of prices applies to the bucket.
+    prices_bucket_aggregate = """
+                    select $bucket as day, round(avg(price)) as avg_price, count(*) as n_prices from prices"""
+
+    rollup_bucket_aggregate = """
+                    select $bucket as day, round(sum(sum_price)::numeric / sum(n_prices)) as avg_price,
+                    sum(n_prices) as n_prices from $table"""
+
+    # First day of the bucket of `{day}`, and first day of the bucket `%s` buckets after the bucket
+    # starting on `{start}`, per unit of `Granularity`. Day buckets start on the first day of the series.
+    granularity_buckets = {
+        'day': (
+            "(select min_date from bounds) + ({day} - (select min_date from bounds))"
+            " / (select size from granularity) * (select size from granularity)",
+            "{start} + %s::int * (select size from granularity)",
+        ),
+        'week': (
+            "date_trunc('week', {day})::date",
+            "{start} + %s::int * 7 * (select size from granularity)",
+        ),
+        'month': (
+            "date_trunc('month', {day})::date",
+            "({start} + make_interval(months => %s::int * (select size from granularity)))::date",
+        ),
+    }
+
+    # Days of a page of the dense series, counted from the first day, or from the last day when descending.
+    sparse_page_ranges = {
+        'ASC': "day between (select min_date from bounds) + %s::int and (select min_date from bounds) + %s::int",
+        'DESC': "day between (select max_date from bounds) - %s::int and (select max_date from bounds) - %s::int",
+    }
+
+    # Keyset pagination: the page starts after (`next`) or ends before (`previous`) the cursor day.
+    # A null cursor day gives the first page (`next`) or the last page (`previous`).
+    cursor_page_ranges = {
+        'next': """
+                    select greatest(min_date, cursor_day + 1) as from_date,
+                    least(max_date, greatest(min_date, cursor_day + 1) + page_size - 1) as to_date""",
+        'previous': """
+                    select greatest(min_date, least(max_date, cursor_day - 1) - page_size + 1) as from_date,
+                    least(max_date, cursor_day - 1) as to_date""",
+    }
+
+    def __init__(self, use_rollup: bool = False) -> None:
+        self._use_rollup = use_rollup
+        self._aggregate = self.rollup_aggregate if use_rollup else self.prices_aggregate
+        self._sparse_aggregate = self.rollup_sparse_aggregate if use_rollup else self.prices_sparse_aggregate
+        self._table = 'prices_daily' if use_rollup else 'prices'
+
+        # Base query template, will be subsituted by filtering clause. 
+        self._base_query_template = Template(
+            f"""
+                with base as ({self._aggregate}
                     $filter_clause
                     group by day
                 ),
@@ -129,17 +775,87 @@ class RateQuery:
             """
         )
 
-        # Counter query template, will be subsituted by ordering and pagination clauses.
-        self._count_query = "select count(*) from base right join date_range on base.day = date_range.dd";
+        # Cursor query template, only aggregates and generates the days of the requested page.
+        # Returns `(dd, avg_price, min_date, max_date)` rows, the bounds of the whole series tell
+        # whether there are more pages, a row with a null day carries them for an empty page.
+        self._cursor_query_template = Template(f"""
+                with cursor_params as (
+                    select %s::date as cursor_day, %s::int as page_size
+                ),
+                bounds as (
+                    select min(day) as min_date, max(day) as max_date from {self._table}
+                    $filter_clause
+                ),
+                page_range as ($page_range
+                    from bounds, cursor_params
+                ),
+                base as ({self._aggregate}
+                    $page_filter_clause
+                    group by day
+                ),
+                date_range as (
+                    SELECT date_trunc('day', dd):: date as dd
+                    FROM generate_series((select from_date from page_range)::timestamp , (select to_date from page_range)::timestamp, '1 day'::interval) dd
+                )
+                select page.dd, page.avg_price, bounds.min_date, bounds.max_date from bounds left join (
+                    select dd, avg_price from base right join date_range on base.day = date_range.dd
+                ) page on true order by page.dd;
+            """
+        )
+
+        # Sparse query template, only aggregates the days with prices of the requested page, without
+        # generating the days in between. Returns `(day, avg_price, n_prices, min_date, max_date)` rows,
+        # the bounds of the whole series give the total count, a row with a null day carries them
+        # for an empty page.
+        self._sparse_query_template = Template(f"""
+                with bounds as (
+                    select min(day) as min_date, max(day) as max_date from {self._table}
+                    $filter_clause
+                ),
+                base as ({self._sparse_aggregate}
+                    $page_filter_clause
+                    group by day
+                )
+                select base.day, base.avg_price, base.n_prices, bounds.min_date, bounds.max_date
+                from bounds left join base on true order by base.day;
+            """
+        )
+
+        # Bucketed sparse query template, same rows as the sparse query with a bucket, identified by its
+        # first day, in place of every day, see `add_granularity`. The page is cut on whole buckets.
+        self._bucket_query_template = Template("""
+                with granularity as (
+                    select %s::int as size
+                ),
+                bounds as (
+                    select min(day) as min_date, max(day) as max_date from $table
+                    $filter_clause
+                ),
+                buckets as (
+                    select $first_bucket as first_bucket, $last_bucket as last_bucket from bounds
+                ),
+                base as ($aggregate
+                    $page_filter_clause
+                    group by 1
+                )
+                select base.day, base.avg_price, base.n_prices, bounds.min_date, bounds.max_date
+                from bounds left join base on true order by base.day;
+            """
+        )
 
-        # Cached property for result query
+        # Cached property for result query and its parameters
         self._query = ''
+        self._params = []
         
         # Private properties will store filtering, ordering clauses that will be applied later.
+        # Filters are stored as (clause, params) pairs.
         self._filters = []
         self._ordering = []
         self._page = None
         self._page_size = None
+        self._cursor = None
+        self._dates = (None, None)
+        self._granularity = Granularity.DAY
 
     def _finalize(self):
         """
@@ -152,17 +868,20 @@ class RateQuery:
             ordering_clause=self.apply_ordering(),
             pagination_clause=self.apply_pagination()
         )
+        self._params = self.filter_params() + self.pagination_params()
 
         return self
 
     def apply_filters(self):
         filter_clause=''
-        filters = filter(lambda f: f, self._filters)
-        if filters:
-            filter_clause = 'WHERE  ' + '\nand\n'.join(filters)
+        if self._filters:
+            filter_clause = 'WHERE  ' + '\nand\n'.join(clause for clause, _ in self._filters)
         
         return filter_clause
 
+    def filter_params(self) -> list:
+        return [param for _, params in self._filters for param in params]
+
     def apply_ordering(self):
         ordering_clause = ''
         if self._ordering:
@@ -180,33 +899,79 @@ class RateQuery:
         if self._page or self._page_size:
             self._page = self._page or 1
             self._page_size = self._page_size or 10
-            pagination_clause = f'LIMIT {self._page_size} OFFSET {(self._page - 1) * self._page_size}'
+            pagination_clause = 'LIMIT %s OFFSET %s'
         return pagination_clause
 
+    def pagination_params(self) -> list:
+        if self._page or self._page_size:
+            return [self._page_size, (self._page - 1) * self._page_size]
+        return []
+
     def add_ordering(self, ordering: str, order: str='ASC'):
         self._ordering.append((ordering, order))
         return self
 
     def add_source_destination_filter(self, source: str, destination: str):
-        source_query = port_query(source) if self.is_port(source) else region_query(source)
-        destination_query = port_query(destination) if self.is_port(destination) else region_query(destination)
+        source_query = port_query if self.is_port(source) else region_query
+        destination_query = port_query if self.is_port(destination) else region_query
         
-        self._filters.append(f"orig_code in ( {source_query})")
+        self._filters.append((f"orig_code in ( {source_query})", [source]))
 
-        self._filters.append(f"""dest_code in (
+        self._filters.append((f"""dest_code in (
                 {destination_query}
-            )"""
+            )""", [destination])
         )
         return self
 
+    def add_port_codes_filter(self, source_codes, destination_codes):
+        """
+        Same as `add_source_destination_filter`, but takes the already resolved port codes
+        of the source and destination, so no region recursion is needed in the query.
+        """
+        # The codes are passed as arrays, so the query text doesn't depend on the number of codes.
+        self._filters.append(("orig_code = any(%s)", [sorted(source_codes)]))
+        self._filters.append(("dest_code = any(%s)", [sorted(destination_codes)]))
+        return self
+
+    @staticmethod
+    def as_date(value):
+        """
+        Dates are bound as `date` values, so they compare to `day` without any cast.
+        """
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, str):
+            return date.fromisoformat(value)
+        return value
+
     def add_dates_filter(self, date_from: str=None, date_to: str=None):
-        query_components = []
+        query_components, params = [], []
         if date_from:
-            query_components.append(f"day >= '{date_from}'")
+            query_components.append("day >= %s")
+            params.append(self.as_date(date_from))
         if date_to:
-            query_components.append(f"day <= '{date_to}'")
+            query_components.append("day <= %s")
+            params.append(self.as_date(date_to))
+
+        if query_components:
+            self._filters.append((" and ".join(query_components), params))
+        self._dates = (self.as_date(date_from) if date_from else None, self.as_date(date_to) if date_to else None)
+        return self
+
+    def add_granularity(self, granularity: Granularity = Granularity.DAY):
+        """
+        Averages the rates over buckets of days instead of every day, see `Granularity` and `sparse_query`.
+        """
+        self._granularity = granularity
+        return self
 
-        self._filters.append(" and ".join(query_components))
+    def add_cursor(self, cursor_day=None, direction: str = 'next'):
+        """
+        Switches to keyset pagination, see `cursor_query`.
+        """
+        if direction not in self.cursor_page_ranges:
+            raise ValueError(f"Invalid cursor direction {direction}")
+        self._cursor = (self.as_date(cursor_day) if cursor_day else None, direction)
         return self
 
     def add_pagination_params(self, page: int = 1, page_size: int = 10):
@@ -220,10 +985,255 @@ class RateQuery:
     @property
     def query(self):
         self._finalize()        
-        return self._query
+        return self._query, self._params
 
     @property
-    def counter_query(self):
-        return self._base_query_template.substitute(
-            filter_clause=self.apply_filters(), 
-        ) + self._count_query
\ No newline at end of file
+    def cursor_query(self):
+        """
+        Outputs a query returning `(dd, avg_price, min_date, max_date)` rows for the page of
+        `page_size` days after/before the cursor day, see `add_cursor`.
+        """
+        cursor_day, direction = self._cursor or (None, 'next')
+        filter_clause = self.apply_filters()
+        page_filter = "day between (select from_date from page_range) and (select to_date from page_range)"
+        query = self._cursor_query_template.substitute(
+            filter_clause=filter_clause,
+            page_range=self.cursor_page_ranges[direction],
+            page_filter_clause=(filter_clause + '\nand\n' if filter_clause else 'WHERE  ') + page_filter,
+        )
+        filter_params = self.filter_params()
+        return query, [cursor_day, self._page_size or 10] + filter_params + filter_params
+
+    @property
+    def descending(self) -> bool:
+        return any(order.upper() == 'DESC' for _, order in self._ordering)
+
+    @property
+    def sparse_query(self):
+        """
+        Outputs a query returning the sparse `(day, avg_price, n_prices, min_date, max_date)` rows
+        of the days with prices in the requested page, see `app.series.fill_dates` for the dense
+        series and `add_pagination_params`/`add_ordering` for the page.
+        """
+        if self._granularity != Granularity.DAY:
+            return self.bucket_query
+
+        filter_clause = self.apply_filters()
+        filter_params = self.filter_params()
+        page_filter_clause, page_params = filter_clause, []
+        if self.apply_pagination():
+            offset = (self._page - 1) * self._page_size
+            page_filter = self.sparse_page_ranges['DESC' if self.descending else 'ASC']
+            page_filter_clause = (filter_clause + '\nand\n' if filter_clause else 'WHERE  ') + page_filter
+            page_params = (
+                [offset + self._page_size - 1, offset] if self.descending else [offset, offset + self._page_size - 1]
+            )
+        query = self._sparse_query_template.substitute(
+            filter_clause=filter_clause,
+            page_filter_clause=page_filter_clause,
+        )
+        return query, filter_params + filter_params + page_params
+
+    @property
+    def bucket_table(self) -> str:
+        """
+        Coarsest level the buckets can be aggregated from: the monthly rollup for months when the
+        dates cover whole months, the daily rollup, or the raw prices.
+        """
+        if not self._use_rollup:
+            return 'prices'
+        date_from, date_to = self._dates
+        if self._granularity.unit == 'month' and (date_from is None or date_from.day == 1) and (
+            date_to is None or (date_to + timedelta(days=1)).day == 1
+        ):
+            return 'prices_monthly'
+        return 'prices_daily'
+
+    @property
+    def bucket_query(self):
+        """
+        Outputs the `sparse_query` of the buckets of days of `add_granularity`, returning
+        `(first day of the bucket, avg_price, n_prices, min_date, max_date)` rows.
+        """
+        bucket, shift = self.granularity_buckets[self._granularity.unit]
+        table = self.bucket_table
+        aggregate = Template(
+            self.rollup_bucket_aggregate if self._use_rollup else self.prices_bucket_aggregate
+        ).substitute(bucket=bucket.format(day='day'), table=table)
+
+        filter_clause = self.apply_filters()
+        filter_params = self.filter_params()
+        page_filter_clause, page_params = filter_clause, []
+        if self.apply_pagination():
+            offset = (self._page - 1) * self._page_size
+            start = "(select last_bucket from buckets)" if self.descending else "(select first_bucket from buckets)"
+            page_filter = f"day >= {shift.format(start=start)} and day < {shift.format(start=start)}"
+            page_filter_clause = (filter_clause + '\nand\n' if filter_clause else 'WHERE  ') + page_filter
+            page_params = (
+                [-(offset + self._page_size - 1), 1 - offset] if self.descending
+                else [offset, offset + self._page_size]
+            )
+        query = self._bucket_query_template.substitute(
+            table=table,
+            filter_clause=filter_clause,
+            first_bucket=bucket.format(day='min_date'),
+            last_bucket=bucket.format(day='max_date'),
+            aggregate=aggregate,
+            page_filter_clause=page_filter_clause,
+        )
+        return query, [self._granularity.size] + filter_params + filter_params + page_params
+
+
+class BatchRateQuery:
+    """
+        Rates of many lanes over the same date range in a single statement.
+
+        The lanes are passed as `(lane, port code)` arrays for the origins and the destinations,
+        unnested and joined against the prices, and the averages are grouped by lane and day.
+        Every lane gets its own dense date range, between its own min and max dates.
+
+        Example Usage:
+        ```
+            batch_query = BatchRateQuery().add_lanes([
+                ({'CNSGH'}, {'NLRTM', 'DEHAM'}), ({'CNNBO', 'CNYAT'}, {'NOOSL'})
+            ]).add_dates_filter(date_from="2016-01-01", date_to="2016-01-31")
+        ```
+
+        The query outputs `(lane, dd, avg_price)` rows, ordered by lane and day, `lane` being the
+        index of the lane in `add_lanes`.
+    """
+
+    prices_aggregate = """
+                    select o.lane, p.day, (
+                        case 
+                            when count(*) < 3 then null else round(avg(p.price))
+                        end
+                    ) as avg_price from prices p"""
+
+    rollup_aggregate = """
+                    select o.lane, p.day, (
+                        case 
+                            when sum(p.n_prices) < 3 then null else round(sum(p.sum_price)::numeric / sum(p.n_prices))
+                        end
+                    ) as avg_price from prices_daily p"""
+
+    def __init__(self, use_rollup: bool = False) -> None:
+        self._query_template = Template(f"""
+                with lane_origins as (
+                    select * from unnest(%s::int[], %s::text[]) as o(lane, code)
+                ),
+                lane_destinations as (
+                    select * from unnest(%s::int[], %s::text[]) as d(lane, code)
+                ),
+                base as ({self.rollup_aggregate if use_rollup else self.prices_aggregate}
+                    join lane_origins o on p.orig_code = o.code
+                    join lane_destinations d on p.dest_code = d.code and d.lane = o.lane
+                    $filter_clause
+                    group by o.lane, p.day
+                ),
+                date_range as (
+                    select lane, generate_series(min(day)::timestamp, max(day)::timestamp, '1 day'::interval)::date as dd
+                    from base group by lane
+                )
+                select date_range.lane, date_range.dd, base.avg_price from base right join date_range
+                on base.lane = date_range.lane and base.day = date_range.dd
+                order by date_range.lane, date_range.dd;
+            """
+        )
+        self._lanes = []
+        self._dates = []
+
+    def add_lanes(self, lanes):
+        """
+        Takes the `(source_codes, destination_codes)` port codes of every lane.
+        """
+        self._lanes.extend(lanes)
+        return self
+
+    def add_dates_filter(self, date_from: str=None, date_to: str=None):
+        if date_from:
+            self._dates.append(("p.day >= %s", RateQuery.as_date(date_from)))
+        if date_to:
+            self._dates.append(("p.day <= %s", RateQuery.as_date(date_to)))
+        return self
+
+    def lane_params(self) -> list:
+        origin_lanes, origin_codes, destination_lanes, destination_codes = [], [], [], []
+        for lane, (origins, destinations) in enumerate(self._lanes):
+            for code in sorted(origins):
+                origin_lanes.append(lane)
+                origin_codes.append(code)
+            for code in sorted(destinations):
+                destination_lanes.append(lane)
+                destination_codes.append(code)
+        return [origin_lanes, origin_codes, destination_lanes, destination_codes]
+
+    @property
+    def query(self):
+        filter_clause = ''
+        if self._dates:
+            filter_clause = 'WHERE  ' + ' and '.join(clause for clause, _ in self._dates)
+        query = self._query_template.substitute(filter_clause=filter_clause)
+        return query, self.lane_params() + [value for _, value in self._dates]
+
+
+class MatrixRateQuery:
+    """
+        Average price and number of prices of every port pair of a lane, in a single grouped scan,
+        for the whole date range or per day.
+
+        Example Usage:
+        ```
+            matrix_query = MatrixRateQuery(by_day=True).add_port_codes_filter(
+                {'CNNBO', 'CNYAT'}, {'NLRTM', 'DEHAM'}
+            ).add_dates_filter(date_from="2016-01-01", date_to="2016-01-31")
+        ```
+
+        The query outputs `(orig_code, dest_code, avg_price, n_prices)` rows, or `(orig_code, dest_code,
+        day, avg_price, n_prices)` rows per day, of the pairs with prices only, ordered by pair and day.
+        The average is null with fewer than 3 prices, like the rates.
+    """
+
+    prices_aggregate = """
+                    select $columns, (
+                        case
+                            when count(*) < 3 then null else round(avg(price))
+                        end
+                    ) as avg_price, count(*) as n_prices from prices"""
+
+    rollup_aggregate = """
+                    select $columns, (
+                        case
+                            when sum(n_prices) < 3 then null else round(sum(sum_price)::numeric / sum(n_prices))
+                        end
+                    ) as avg_price, sum(n_prices) as n_prices from prices_daily"""
+
+    def __init__(self, use_rollup: bool = False, by_day: bool = False) -> None:
+        columns = 'orig_code, dest_code, day' if by_day else 'orig_code, dest_code'
+        self._query_template = Template(
+            Template(self.rollup_aggregate if use_rollup else self.prices_aggregate).substitute(columns=columns) + f"""
+                    where orig_code = any(%s) and dest_code = any(%s)$date_filter
+                    group by {columns}
+                    order by {columns};
+            """
+        )
+        self._port_codes = ([], [])
+        self._dates = []
+
+    def add_port_codes_filter(self, source_codes, destination_codes):
+        self._port_codes = (sorted(source_codes), sorted(destination_codes))
+        return self
+
+    def add_dates_filter(self, date_from: str=None, date_to: str=None):
+        if date_from:
+            self._dates.append(("day >= %s", RateQuery.as_date(date_from)))
+        if date_to:
+            self._dates.append(("day <= %s", RateQuery.as_date(date_to)))
+        return self
+
+    @property
+    def query(self):
+        query = self._query_template.substitute(
+            date_filter=''.join(f" and {clause}" for clause, _ in self._dates)
+        )
+        return query, list(self._port_codes) + [value for _, value in self._dates]
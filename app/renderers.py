@@ -0,0 +1,130 @@
+"""
+    Compact `/rates/` formats, picked by content negotiation (`Accept` header or `?format=`).
+    They are rendered straight from the `(day, average_price)` rows of the service, without the
+    per-row dicts of `RateSerializer`. msgpack and Arrow are optional, their renderers are only
+    offered when the library is installed.
+"""
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from app.instrumentation import timed
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+
+class RowsRenderer(BaseRenderer):
+    """
+        Renders a list of `(day, average_price)` rows. Anything else, i.e. an error, is rendered
+        as JSON with a JSON content type.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, (list, tuple)):
+            response = (renderer_context or {}).get('response')
+            if response is not None:
+                response['Content-Type'] = 'application/json'
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+
+        with timed('serialisation'):
+            return self.render_rows(data)
+
+    def render_rows(self, rows) -> bytes:
+        raise NotImplementedError
+
+    @staticmethod
+    def columns(rows) -> dict:
+        return {
+            "days": [day.isoformat() for day, _ in rows],
+            "avg": [None if average_price is None else float(average_price) for _, average_price in rows],
+        }
+
+
+class ColumnarJSONRenderer(RowsRenderer):
+    """
+        `{"days": [...], "avg": [...]}`
+    """
+    media_type = 'application/vnd.rates.columnar+json'
+    format = 'columnar'
+    charset = None
+
+    def render_rows(self, rows) -> bytes:
+        return json.dumps(self.columns(rows), separators=(',', ':')).encode()
+
+
+class CSVRenderer(RowsRenderer):
+    """
+        `day,average_price` header and one line per day, an empty `average_price` for null.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render_rows(self, rows) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(('day', 'average_price'))
+        writer.writerows(
+            (day.isoformat(), '' if average_price is None else float(average_price))
+            for day, average_price in rows
+        )
+        return buffer.getvalue().encode(self.charset)
+
+
+class MsgpackRenderer(RowsRenderer):
+    """
+        The columnar `{"days": [...], "avg": [...]}` as msgpack.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render_rows(self, rows) -> bytes:
+        return msgpack.packb(self.columns(rows))
+
+
+class ArrowRenderer(RowsRenderer):
+    """
+        An Arrow IPC stream of a `day` (date32) and an `average_price` (float64) column.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+
+    def render_rows(self, rows) -> bytes:
+        table = pyarrow.table({
+            "day": pyarrow.array([day for day, _ in rows], type=pyarrow.date32()),
+            "average_price": pyarrow.array(
+                [None if average_price is None else float(average_price) for _, average_price in rows],
+                type=pyarrow.float64()
+            ),
+        })
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+def rows_renderer_classes() -> list:
+    """
+    The compact renderers whose library is installed.
+    """
+    renderers = [ColumnarJSONRenderer, CSVRenderer]
+    if msgpack is not None:
+        renderers.append(MsgpackRenderer)
+    if pyarrow is not None:
+        renderers.append(ArrowRenderer)
+    return renderers
@@ -1,69 +1,998 @@
-from django.db import connection
-from app.queries import RateQuery
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import ProgrammingError, connection, connections, transaction
+from app.instrumentation import timed
+from app.queries import (
+    BatchRateQuery, Granularity, MatrixRateQuery, RateQuery, catalogue_ports_query, catalogue_regions_query, catalogue_version_query,
+    catalogue_region_ports_query,
+    rollup_install_queries, rollup_lock_query, rollup_full_refresh_queries,
+    rollup_incremental_refresh_queries, rollup_touched_count_query, rollup_installed_query,
+    ingest_staging_queries, ingest_copy_query, ingest_filter_queries, ingest_batches_install_query,
+    ingest_batch_claim_query, ingest_batch_record_query, ingest_insert_query, ingest_counts_query, ingest_touched_keys_query,
+    schema_optimisation_install_query, schema_optimisation_applied_query,
+    schema_optimisation_record_query, schema_optimisation_steps, schema_analyze_queries,
+    data_version_table_exists_query, data_version_query, data_version_bump_query,
+    prices_partitioned_query, partitions_query, prices_months_query,
+    create_month_partition_queries, partitioning_prepare_queries, partitioning_backfill_queries,
+    partitioning_lock_query, foreign_keys_query, add_constraint_query, prices_triggers_query, partitioning_swap_queries, drop_trigger_query,
+    partitioning_drop_old_query, partitioning_analyze_query, ingest_months_query,
+    region_closure_installed_query, region_closure_rebuild_query,
+    memory_engine_prices_query, memory_engine_rollup_query
+)
+from app.engine import RatesSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+
+class PreparedStatements:
+    """
+        Per-connection cache of server side prepared statements.
+
+        A parameterized query (with `%s` placeholders) is prepared once per connection under a name
+        derived from its text, later executions only send `EXECUTE name (params)`, so Postgres parses
+        and plans every query shape once per connection instead of once per request.
+        Queries must not contain a literal `%`.
+    """
+
+    # Postgres error code for a missing prepared statement, e.g. after a `DISCARD ALL`
+    INVALID_STATEMENT_NAME = '26000'
+
+    def __init__(self) -> None:
+        # Raw DB-API connection -> names of the statements prepared on it.
+        self._prepared = weakref.WeakKeyDictionary()
+        # Statement name -> query, there is one per query shape.
+        self._queries = {}
+
+    @staticmethod
+    def statement_name(query: str) -> str:
+        return 'stmt_' + hashlib.md5(query.encode()).hexdigest()[:16]
+
+    def query_of(self, name: str):
+        """
+        The query prepared under a statement name, e.g. to log `EXECUTE stmt_...` statements.
+        """
+        return self._queries.get(name)
+
+    def _prepare(self, cursor, query: str, name: str):
+        parts = query.split('%s')
+        numbered = parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], start=1))
+        cursor.execute(f"PREPARE {name} AS {numbered}")
+
+    def execute(self, cursor, query: str, params):
+        raw_connection = cursor.db.connection
+        prepared = self._prepared.setdefault(raw_connection, set())
+        name = self.statement_name(query)
+        self._queries.setdefault(name, query)
+        if name not in prepared:
+            self._prepare(cursor, query, name)
+            prepared.add(name)
+
+        execute_query = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+        try:
+            cursor.execute(execute_query, params)
+        except ProgrammingError as e:
+            # psycopg2 and psycopg 3 name the SQLSTATE differently.
+            sqlstate = getattr(e.__cause__, 'pgcode', None) or getattr(e.__cause__, 'sqlstate', None)
+            if sqlstate != self.INVALID_STATEMENT_NAME:
+                raise
+            # The server forgot the statements of this connection, prepare again.
+            prepared.clear()
+            if connection.in_atomic_block:
+                raise
+            self._prepare(cursor, query, name)
+            prepared.add(name)
+            cursor.execute(execute_query, params)
+
+
+prepared_statements = PreparedStatements()
+
+
+class ChunksReader:
+    """
+        File-like `read` over an iterable of text chunks, for psycopg2's `copy_expert`.
+    """
+
+    def __init__(self, chunks) -> None:
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
 
 
 class Repository:
     @staticmethod
-    def fetch_all(query: str):        
-        with connection.cursor() as cursor:
+    def _execute(cursor, query: str, params=None):
+        """
+        Executes static queries as they are, and parameterized queries through the
+        prepared statement cache unless `PREPARED_STATEMENTS` is disabled.
+        """
+        if params is None:
             cursor.execute(query)
+        elif settings.PREPARED_STATEMENTS:
+            prepared_statements.execute(cursor, query, params)
+        else:
+            cursor.execute(query, params)
+
+    @staticmethod
+    def fetch_all(query: str, params=None):
+        with connection.cursor() as cursor:
+            Repository._execute(cursor, query, params)
             result = cursor.fetchall()
             return result
 
     @staticmethod
-    def fetch_one(query: str):
+    def fetch_one(query: str, params=None):
         with connection.cursor() as cursor:
-            cursor.execute(query)
+            Repository._execute(cursor, query, params)
             result = cursor.fetchone()
             return result[-1]
 
     @staticmethod
-    def exists(query: str):
+    def fetch_all_with_bounds(query: str, params=None):
+        """
+        Executes a query whose rows end with `(min_date, max_date)` columns, e.g. `RateQuery.cursor_query`,
+        and returns the rows without them along with the bounds.
+        A row with a null first column only carries the bounds and marks an empty page.
+        """
+        rows = Repository.fetch_all(query, params)
+        bounds = tuple(rows[0][-2:]) if rows else (None, None)
+        return [row[:-2] for row in rows if row[0] is not None], bounds
+
+    @staticmethod
+    def stream(query: str, params=None, batch_size: int = 2000):
+        """
+        Yields the rows of a query in batches of `batch_size` rows, read from a server side cursor,
+        so memory stays flat however many rows the query returns.
+        """
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    @staticmethod
+    def execute(*queries: str):
         with connection.cursor() as cursor:
-            cursor.execute(query)
+            for query in queries:
+                cursor.execute(query)
+
+    @staticmethod
+    def copy_from(query: str, chunks):
+        """
+        Runs a `COPY ... FROM STDIN` query fed with text chunks, e.g. CSV lines, as they are produced.
+        """
+        with connection.cursor() as cursor, connection.wrap_database_errors:
+            raw_cursor = cursor.cursor
+            if hasattr(raw_cursor, 'copy'):
+                # psycopg 3
+                with raw_cursor.copy(query) as copy:
+                    for chunk in chunks:
+                        copy.write(chunk)
+            else:
+                raw_cursor.copy_expert(query, ChunksReader(chunks))
+
+    @staticmethod
+    def explain_analyze(query: str, params=None, buffers: bool = False) -> dict:
+        """
+        Runs the query under `EXPLAIN (ANALYZE, FORMAT JSON)` and returns the top level plan,
+        including its `Planning Time` and `Execution Time` in ms. With `buffers` the plan nodes
+        also report their shared buffer hits and reads.
+        """
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if buffers else "ANALYZE, FORMAT JSON"
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN ({options}) {query}", params)
+            plan = cursor.fetchone()[0]
+            # psycopg2 may hand back the json as text, depending on the registered adapters
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return plan[0]
+
+    @staticmethod
+    def exists(query: str, params=None):
+        with connection.cursor() as cursor:
+            Repository._execute(cursor, query, params)
             result = cursor.fetchone()
             return result
 
 
+class DatabasePool:
+    """
+        Metrics and fork handling of the repository connection pool, Django's psycopg pool
+        configured from the `DB_POOL` setting.
+    """
+
+    @staticmethod
+    def pool(alias: str = 'default'):
+        """
+        The pool of the database, None when pooling is disabled.
+        """
+        return connections[alias].pool
+
+    @staticmethod
+    def stats(alias: str = 'default') -> dict:
+        pool = DatabasePool.pool(alias)
+        if pool is None:
+            return {"enabled": False}
+
+        stats = pool.get_stats()
+        size, available = stats.get('pool_size', 0), stats.get('pool_available', 0)
+        return {
+            "enabled": True,
+            "min_size": pool.min_size,
+            "max_size": pool.max_size,
+            "size": size,
+            "in_use": size - available,
+            "available": available,
+            # Connections opened above `min_size` under load.
+            "overflow": max(size - pool.min_size, 0),
+            "requests": stats.get('requests_num', 0),
+            "requests_waiting": stats.get('requests_waiting', 0),
+            "requests_queued": stats.get('requests_queued', 0),
+            "wait_ms": stats.get('requests_wait_ms', 0),
+            "timeouts": stats.get('requests_errors', 0),
+            "connections_lost": stats.get('connections_lost', 0),
+            "returns_bad": stats.get('returns_bad', 0),
+        }
+
+    @staticmethod
+    def discard_inherited(alias: str = 'default'):
+        """
+        Closes the connection and the pool a forked worker inherited from its parent, e.g. with
+        gunicorn's `--preload`. A preloading master doesn't serve requests, so this only ends sessions
+        nobody uses, and the worker opens its own pool on first use.
+        """
+        wrapper = connections[alias]
+        wrapper.close()
+        if wrapper.settings_dict['OPTIONS'].get('pool'):
+            wrapper.close_pool()
+
+
 class Port:
     @staticmethod
     def exists(port_code: str):
-        return Repository.exists(f"select * from ports where code='{port_code}'")
+        return Repository.exists("select 1 from ports where code = %s", [port_code])
     
 
 
 class Region:
     @staticmethod
     def exists(region_code: str):
-        return Repository.exists(f"select * from regions where slug='{region_code}'")
+        return Repository.exists("select 1 from regions where slug = %s", [region_code])
+
+
+class Catalogue:
+    """
+        Process-wide, in-memory view of the ports and the region hierarchy.
+
+        The `regions` and `ports` tables are tiny and rarely change, so instead of walking the
+        region tree with a recursive CTE on every request, the whole tree is loaded once and the
+        flattened set of port codes is precomputed for every region slug.
+
+        It is also the registry of known endpoints, `endpoint_kind` tells whether an endpoint is a
+        port, a region or unknown without querying the database.
+
+        Once `optimise_schema` installed the `region_ports` table of `RegionClosure`, the flattened
+        tree is read from it instead, so the catalogue and the SQL agree on the region of every port.
+
+        The catalogue checks a fingerprint of both tables at most every `CATALOGUE_REFRESH_INTERVAL`
+        seconds and reloads itself when it changed. `invalidate` forces a reload on next access.
+        Callers that can't query through Django's connection, e.g. the async path, check
+        `is_fresh` and feed it with `load`/`mark_checked`, then look up with `refresh=False`.
+    """
+
+    PORT = 'port'
+    REGION = 'region'
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = None
+        self._ports = frozenset()
+        self._region_ports = {}
+
+    @property
+    def refresh_interval(self) -> float:
+        return getattr(settings, 'CATALOGUE_REFRESH_INTERVAL', 60)
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+            self._checked_at = None
+
+    def is_fresh(self) -> bool:
+        return self._checked_at is not None and (
+            time.monotonic() - self._checked_at < self.refresh_interval
+        )
+
+    def needs_reload(self, version: str) -> bool:
+        return version != self._version
+
+    def mark_checked(self):
+        self._checked_at = time.monotonic()
+
+    def load(self, version: str, regions, ports, closure_rows=None):
+        """
+        Loads the catalogue from `(slug, parent_slug)` region rows and `(code, parent_slug)` port rows,
+        and the `(region_slug, port_code)` rows of `region_ports` when it is installed.
+        """
+        with self._lock:
+            self._load(regions, ports, closure_rows)
+            self._version = version
+            self.mark_checked()
+
+    def _refresh(self):
+        if self.is_fresh():
+            return
+
+        with self._lock:
+            if self.is_fresh():
+                return
+
+            version = Repository.fetch_one(catalogue_version_query)
+            if self.needs_reload(version):
+                self._load(
+                    Repository.fetch_all(catalogue_regions_query), Repository.fetch_all(catalogue_ports_query),
+                    Repository.fetch_all(catalogue_region_ports_query) if RegionClosure.installed() else None
+                )
+                self._version = version
+            self.mark_checked()
+
+    def _load(self, regions, ports, closure_rows=None):
+        children = {}
+        region_slugs = []
+        for slug, parent_slug in regions:
+            region_slugs.append(slug)
+            children.setdefault(parent_slug, []).append(slug)
+
+        own_ports = {}
+        for code, parent_slug in ports:
+            own_ports.setdefault(parent_slug, set()).add(code)
+
+        self._ports = frozenset(
+            code for codes in own_ports.values() for code in codes
+        )
+        if closure_rows is not None:
+            region_ports = {slug: set() for slug in region_slugs}
+            for region_slug, code in closure_rows:
+                region_ports.setdefault(region_slug, set()).add(code)
+            self._region_ports = {slug: frozenset(codes) for slug, codes in region_ports.items()}
+            return
+
+        region_ports = {}
+        for slug in region_slugs:
+            # Walk the subtree of every region, the tree has no fixed depth.
+            codes, seen, stack = set(), {slug}, [slug]
+            while stack:
+                current = stack.pop()
+                codes.update(own_ports.get(current, ()))
+                for child in children.get(current, ()):
+                    if child not in seen:
+                        seen.add(child)
+                        stack.append(child)
+            region_ports[slug] = frozenset(codes)
+
+        self._region_ports = region_ports
+
+    @property
+    def version(self) -> str:
+        return self.get_version()
+
+    def get_version(self, refresh: bool = True) -> str:
+        """
+        Fingerprint of the ports/regions tables the catalogue was loaded from.
+        """
+        if refresh:
+            self._refresh()
+        return self._version
+
+    def endpoint_kind(self, endpoint: str, refresh: bool = True):
+        """
+        Returns `Catalogue.PORT` or `Catalogue.REGION` for a known endpoint, None otherwise.
+        """
+        if refresh:
+            self._refresh()
+        if endpoint in self._ports:
+            return self.PORT
+        if endpoint in self._region_ports:
+            return self.REGION
+        return None
+
+    def port_codes(self, endpoint: str, refresh: bool = True) -> frozenset:
+        """
+        Returns the port codes an endpoint (port code or region slug) stands for.
+        """
+        if refresh:
+            self._refresh()
+        if RateQuery.is_port(endpoint):
+            return frozenset([endpoint]) & self._ports
+        return self._region_ports.get(endpoint, frozenset())
+
+
+catalogue = Catalogue()
+
+
+class DataVersion:
+    """
+        Version stamp of a dataset, e.g. the prices, read from the `data_version` table which
+        `optimise_schema` installs along with a trigger bumping it on every write to `prices`.
+
+        The stamp is polled at most every `DATA_VERSION_POLL_INTERVAL` seconds, caches keyed on it
+        are invalidated as soon as a new version is seen. Without the table the version stays 0.
+        Like the catalogue, the async path polls it itself through `is_fresh`/`update`.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._current = (0, None)
+        self._checked_at = None
+        self._table_exists = False
+
+    @property
+    def poll_interval(self) -> float:
+        return getattr(settings, 'DATA_VERSION_POLL_INTERVAL', 1)
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = None
+            self._table_exists = False
+
+    @property
+    def table_exists(self) -> bool:
+        return self._table_exists
+
+    def is_fresh(self) -> bool:
+        return self._checked_at is not None and time.monotonic() - self._checked_at < self.poll_interval
+
+    def update(self, table_exists: bool, row):
+        """
+        Records a poll, `row` being the `(version, updated_at)` row of the dataset if any.
+        """
+        self._table_exists = table_exists
+        self._current = tuple(row) if row else (0, None)
+        self._checked_at = time.monotonic()
+
+    def current(self, refresh: bool = True) -> tuple:
+        """
+        Returns `(version, updated_at)`.
+        """
+        with self._lock:
+            if not refresh or self.is_fresh():
+                return self._current
+
+            table_exists = self._table_exists or Repository.fetch_one(data_version_table_exists_query)
+            self.update(table_exists, Repository.exists(data_version_query, [self.name]) if table_exists else None)
+            return self._current
+
+    @property
+    def version(self) -> int:
+        return self.current()[0]
+
+    def bump(self):
+        """
+        Bumps the version explicitly, e.g. after writes the trigger doesn't see, when the table exists.
+        """
+        if Repository.fetch_one(data_version_table_exists_query):
+            Repository.fetch_all(data_version_bump_query, [self.name])
+        self.invalidate()
+
+
+prices_version = DataVersion('prices')
+catalogue_data_version = DataVersion('catalogue')
+
+
+class MemoryPrices:
+    """
+        Process wide `RatesSnapshot` of the in-memory engine, see `app.engine`.
+
+        The snapshot is loaded on first use, from the daily rollup when `RATES_USE_ROLLUP` is set so
+        it holds the same data as the queries, and reloaded once the prices data version changes.
+        Requests keep being served from the previous snapshot while a new one loads. Without the
+        `data_version` table of `optimise_schema` a new version would never be seen, there is then
+        no snapshot and the rates are queried from the database.
+
+        With `RATES_SNAPSHOT_PATH` set, the file written by `manage.py build_snapshot` is mapped
+        instead, so the worker processes share one copy of the snapshot, and mapped again once the
+        file is replaced. A missing file or a file older than the prices is not used, the rates are
+        then queried from the database until the file is rebuilt. Mapping the file also seeds the catalogue.
+    """
+
+    def __init__(self) -> None:
+        self._snapshot = None
+        self._mapped = None
+        self._mapped_at = None
+        self._load_lock = threading.Lock()
+        self._map_lock = threading.Lock()
+        self._warned = False
+
+    @property
+    def path(self) -> str:
+        return getattr(settings, 'RATES_SNAPSHOT_PATH', '')
+
+    @staticmethod
+    def build() -> RatesSnapshot:
+        """
+        Loads a snapshot from the database, along with the catalogue tables, `region_ports` included
+        when it is installed, see `Catalogue.load`.
+        """
+        version = prices_version.current()
+        query = memory_engine_rollup_query if settings.RATES_USE_ROLLUP else memory_engine_prices_query
+        metadata = {"catalogue": {
+            "version": Repository.fetch_one(catalogue_version_query),
+            "regions": Repository.fetch_all(catalogue_regions_query),
+            "ports": Repository.fetch_all(catalogue_ports_query),
+            "region_ports": Repository.fetch_all(catalogue_region_ports_query) if RegionClosure.installed() else None,
+        }}
+        return RatesSnapshot.from_rows(Repository.stream(query, batch_size=50000), version, metadata)
+
+    def load(self) -> RatesSnapshot:
+        with timed('engine_load'):
+            self._snapshot = self.build()
+        return self._snapshot
+
+    def map_file(self):
+        """
+        Returns the snapshot of the file, mapped again when the file was replaced since the last
+        check, at most every `DATA_VERSION_POLL_INTERVAL` seconds. None without a file.
+        """
+        if not self.path:
+            return None
+
+        with self._map_lock:
+            if self._mapped_at is not None and time.monotonic() - self._mapped_at < prices_version.poll_interval:
+                return self._mapped[1] if self._mapped else None
+            self._mapped_at = time.monotonic()
+
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._mapped = None
+                return None
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if self._mapped is None or self._mapped[0] != identity:
+                with timed('engine_map'):
+                    self._mapped = (identity, RatesSnapshot.open(self.path))
+                catalogue_tables = self._mapped[1].metadata.get('catalogue')
+                if catalogue_tables and catalogue.get_version(refresh=False) is None:
+                    catalogue.load(
+                        catalogue_tables['version'], catalogue_tables['regions'], catalogue_tables['ports'],
+                        catalogue_tables.get('region_ports')
+                    )
+            return self._mapped[1]
+
+    def snapshot(self):
+        """
+        Returns the current snapshot, None when the rates have to be queried from the database instead.
+        """
+        version = prices_version.current()
+        if not prices_version.table_exists:
+            if not self._warned:
+                self._warned = True
+                logger.warning("RATES_ENGINE=memory needs the data_version table of optimise_schema, querying the database.")
+            return None
+
+        if self.path:
+            # Rather than a copy per worker, the database serves the rates until the file is rebuilt.
+            mapped = self.map_file()
+            return mapped if mapped is not None and mapped.version == version else None
+
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        # A single thread reloads, the others keep the previous snapshot if there is one.
+        if not self._load_lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            if self._snapshot is not None and self._snapshot.version == prices_version.current():
+                return self._snapshot
+            return self.load()
+        finally:
+            self._load_lock.release()
+
+    @staticmethod
+    def is_current(snapshot: RatesSnapshot) -> bool:
+        """
+        Whether a snapshot, e.g. of the file, was taken from the current prices and catalogue.
+        """
+        catalogue_tables = snapshot.metadata.get('catalogue') or {}
+        return snapshot.version == prices_version.current() and (
+            catalogue_tables.get('version') == Repository.fetch_one(catalogue_version_query)
+        )
+
+    def invalidate(self):
+        with self._map_lock:
+            self._snapshot = None
+            self._mapped = self._mapped_at = None
+            self._warned = False
+
+
+memory_prices = MemoryPrices()
+
+
+class PriceRollup:
+    """
+        Maintains the `prices_daily` rollup of `(orig_code, dest_code, day, sum_price, n_prices)`, and the
+        `prices_monthly` rollup of the same per month.
+
+        Writes to `prices` enqueue the keys they touched through statement triggers, `refresh`
+        recomputes only those keys, `refresh(full=True)` rebuilds the whole rollup. A refresh that
+        changed the rollup bumps the prices data version, the rates read from it are cached on it.
+    """
+
+    @staticmethod
+    def install():
+        with transaction.atomic():
+            Repository.execute(*rollup_install_queries)
+            return PriceRollup.refresh(full=True)
+
+    @staticmethod
+    def refresh(full: bool = False) -> int:
+        """
+        Refreshes the rollup, returns the number of (lane, day) keys recomputed,
+        or -1 for a full rebuild.
+        """
+        with transaction.atomic():
+            Repository.execute(rollup_lock_query)
+            if full:
+                Repository.execute(*rollup_full_refresh_queries)
+                touched = -1
+            else:
+                Repository.execute(*rollup_incremental_refresh_queries)
+                touched = Repository.fetch_one(rollup_touched_count_query)
+            if touched:
+                prices_version.bump()
+            return touched
+
+
+    @staticmethod
+    def installed() -> bool:
+        return Repository.fetch_one(rollup_installed_query)
+
+
+class PriceIngestion:
+    """
+        Bulk loads prices: the rows are streamed with `COPY` into a staging table, then appended to the
+        prices in one transaction. A batch loaded under an id already loaded is skipped, so retrying a
+        load is harmless, the prices themselves are never deduplicated nor replaced.
+        The rollup queue and the data version are maintained by the triggers on `prices`, and the
+        month partitions of the batch are created first when `prices` is partitioned.
+    """
+
+    @staticmethod
+    def load(chunks, batch_id: str = None) -> dict:
+        """
+        Loads prices from CSV chunks of `orig_code,dest_code,day,price` rows.
+        Returns the counts of received and inserted rows, whether the batch was already loaded,
+        and the touched `(orig_code, dest_code, day)` keys.
+        """
+        with transaction.atomic():
+            Repository.execute(*ingest_staging_queries)
+            Repository.copy_from(ingest_copy_query, chunks)
+            Repository.execute(*ingest_filter_queries)
+            received, inserted = Repository.fetch_all(ingest_counts_query)[0]
+            if batch_id is not None:
+                Repository.execute(ingest_batches_install_query)
+                if not Repository.fetch_all(ingest_batch_claim_query, [batch_id]):
+                    return {"received": received, "inserted": 0, "duplicate": True, "touched": []}
+                Repository.fetch_all(ingest_batch_record_query, [inserted, batch_id])
+
+            if PricePartitions.is_partitioned():
+                PricePartitions.ensure(month for month, in Repository.fetch_all(ingest_months_query))
+            Repository.execute(ingest_insert_query)
+            return {
+                "received": received,
+                "inserted": inserted,
+                "duplicate": False,
+                "touched": Repository.fetch_all(ingest_touched_keys_query),
+            }
+
+
+class SchemaOptimisations:
+    """
+        Applies the versioned schema optimisation steps (indexes and keys) of `queries.py`.
+        Applied versions are recorded in `schema_optimisations`, so running it again only applies
+        the new steps, and every step is idempotent by itself.
+    """
+
+    @staticmethod
+    def applied() -> set:
+        with transaction.atomic():
+            Repository.execute(schema_optimisation_install_query)
+            return {version for version, in Repository.fetch_all(schema_optimisation_applied_query)}
+
+    @staticmethod
+    def pending() -> list:
+        applied = SchemaOptimisations.applied()
+        return [version for version, _ in schema_optimisation_steps if version not in applied]
+
+    @staticmethod
+    def apply() -> list:
+        """
+        Applies the pending steps, each in its own transaction, then analyzes the tables.
+        Returns the applied versions.
+        """
+        applied = SchemaOptimisations.applied()
+        newly_applied = []
+        for version, queries in schema_optimisation_steps:
+            if version in applied:
+                continue
+            with transaction.atomic():
+                Repository.execute(*queries)
+                with connection.cursor() as cursor:
+                    cursor.execute(schema_optimisation_record_query, [version])
+            newly_applied.append(version)
+
+        Repository.execute(*schema_analyze_queries)
+        return newly_applied
+
+
+class RegionClosure:
+    """
+        `region_closure` and `region_ports` tables of the region tree, installed by `optimise_schema`
+        and kept in sync with `regions` and `ports` by triggers, see `0005_region_closure`.
+    """
+
+    @staticmethod
+    def installed() -> bool:
+        return Repository.fetch_one(region_closure_installed_query)
+
+    @staticmethod
+    def rebuild():
+        """
+        Rebuilds both tables, e.g. after writes with the triggers disabled.
+        """
+        Repository.fetch_all(region_closure_rebuild_query)
+
+
+class PricePartitions:
+    """
+        Range partitioning of `prices` by month, so the date filters of `RateQuery` only scan the
+        partitions of their months.
+
+        The `prices` heap is converted without holding a lock for long: `prepare` creates a partitioned
+        copy that triggers keep in sync with the writes, `backfill` copies one month per transaction,
+        and `swap` renames the copy to `prices` and moves the triggers of `prices` over to it.
+        The foreign keys of `prices` are declared on the copy, so it enforces the same references.
+        `ensure` creates the missing month partitions, the days without one land in `prices_default`.
+    """
+
+    partition_pattern = re.compile(r'_p([0-9]{4})_([0-9]{2})$')
+
+    @staticmethod
+    def is_partitioned() -> bool:
+        return Repository.fetch_one(prices_partitioned_query)
+
+    @staticmethod
+    def month_of(day: date) -> date:
+        return day.replace(day=1)
+
+    @staticmethod
+    def next_month(month: date) -> date:
+        return (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+    @staticmethod
+    def future_months(today: date, months_ahead: int) -> list:
+        """
+        The month of `today` and the `months_ahead` months after it.
+        """
+        months = [PricePartitions.month_of(today)]
+        for _ in range(months_ahead):
+            months.append(PricePartitions.next_month(months[-1]))
+        return months
+
+    @staticmethod
+    def partitions(table: str = 'prices') -> list:
+        return [name for name, in Repository.fetch_all(partitions_query, [table])]
+
+    @staticmethod
+    def partition_months(table: str = 'prices') -> list:
+        months = []
+        for name in PricePartitions.partitions(table):
+            match = PricePartitions.partition_pattern.search(name)
+            if match:
+                months.append(date(int(match.group(1)), int(match.group(2)), 1))
+        return months
+
+    @staticmethod
+    def ensure(months, table: str = 'prices') -> list:
+        """
+        Creates the partitions of the months that have none, each in its own transaction, moving the
+        rows of the month out of the default partition. Returns the months created.
+        """
+        existing = set(PricePartitions.partition_months(table))
+        created = []
+        for month in sorted({PricePartitions.month_of(month) for month in months} - existing):
+            with transaction.atomic():
+                Repository.execute(*create_month_partition_queries(table, month, PricePartitions.next_month(month)))
+            created.append(month)
+        return created
+
+    @staticmethod
+    def prepare(today: date, months_ahead: int = 3) -> list:
+        """
+        Creates the partitioned copy of `prices` with the partitions of the months with prices and of
+        the coming months, and the triggers forwarding the writes to it. Returns the months to backfill.
+        """
+        with transaction.atomic():
+            Repository.execute(*partitioning_prepare_queries)
+            # Declared while the copy is empty, the backfilled and forwarded rows are then checked as they come.
+            PricePartitions.copy_foreign_keys()
+        months = [month for month, in Repository.fetch_all(prices_months_query)]
+        PricePartitions.ensure(months + PricePartitions.future_months(today, months_ahead), 'prices_partitioned')
+        return months
+
+    @staticmethod
+    def copy_foreign_keys(source: str = 'prices', target: str = 'prices_partitioned') -> list:
+        """
+        Declares the foreign keys of `source` missing on `target`. Returns their names.
+        """
+        existing = {name for name, _ in Repository.fetch_all(foreign_keys_query, [target])}
+        missing = [(name, definition) for name, definition in Repository.fetch_all(foreign_keys_query, [source]) if name not in existing]
+        Repository.execute(*[add_constraint_query(target, name, definition) for name, definition in missing])
+        return [name for name, _ in missing]
+
+    @staticmethod
+    def backfill(month: date):
+        """
+        Copies the prices of a month to the partitioned copy. The writes to `prices` wait meanwhile.
+        """
+        bounds = [month, PricePartitions.next_month(month)]
+        with transaction.atomic(), connection.cursor() as cursor:
+            for query, params in zip(partitioning_backfill_queries, [None, bounds, bounds]):
+                cursor.execute(query, params)
+
+    @staticmethod
+    def swap(drop_old: bool = False) -> list:
+        """
+        Swaps the partitioned copy in as `prices`, keeping the old table as `prices_unpartitioned`
+        unless `drop_old`. Returns the names of the triggers moved over.
+        """
+        with transaction.atomic():
+            Repository.execute(partitioning_lock_query)
+            # A copy prepared before `prices` got its foreign keys, they are checked under the lock then.
+            PricePartitions.copy_foreign_keys()
+            triggers = Repository.fetch_all(prices_triggers_query)
+            Repository.execute(*[drop_trigger_query('prices', name) for name, _ in triggers])
+            Repository.execute(*partitioning_swap_queries)
+            Repository.execute(*[definition for _, definition in triggers])
+            if drop_old:
+                Repository.execute(partitioning_drop_old_query)
+        Repository.execute(partitioning_analyze_query)
+        return [name for name, _ in triggers]
 
 
 class Prices:
     @staticmethod
-    def fetch_rates(origin: str, destination: str, date_from:str= None, date_to:str=None, page_size: int = 10, page: int = 1):
-        rate_query = RateQuery().add_source_destination_filter(
-            source=origin, destination=destination
+    def rate_query(
+        origin: str, destination: str, date_from:str= None, date_to:str=None, page_size: int = 10, page: int = 1,
+        refresh: bool = True, granularity: Granularity = Granularity.DAY
+    ):
+        with timed('region'):
+            source_codes, destination_codes = catalogue.port_codes(origin, refresh), catalogue.port_codes(destination, refresh)
+        return RateQuery(use_rollup=settings.RATES_USE_ROLLUP).add_port_codes_filter(
+            source_codes, destination_codes
         ).add_dates_filter(
             date_from=date_from, date_to=date_to
         ).add_pagination_params(
             page, page_size
+        ).add_granularity(
+            granularity
         ).add_ordering(
             'dd'
         )
+
+    @staticmethod
+    def fetch_sparse_rates(
+        origin: str, destination: str, date_from:str= None, date_to:str=None, page_size: int = 10, page: int = 1,
+        granularity: Granularity = Granularity.DAY
+    ):
+        """
+        Sparse `(day, avg_price, n_prices)` rows of the days, or buckets, with prices of the page, along
+        with the first and last day of the whole series, see `app.series.fill_dates`.
+        """
+        snapshot = memory_prices.snapshot() if settings.RATES_ENGINE == 'memory' else None
+        if snapshot is not None:
+            with timed('region'):
+                source_codes, destination_codes = catalogue.port_codes(origin), catalogue.port_codes(destination)
+            with timed('engine'):
+                rows, min_date, max_date = snapshot.sparse_rates(
+                    source_codes, destination_codes, RateQuery.as_date(date_from), RateQuery.as_date(date_to),
+                    page, page_size, granularity=granularity
+                )
+            return {"rows": rows, "min_date": min_date, "max_date": max_date}
+
+        rate_query = Prices.rate_query(
+            origin, destination, date_from, date_to, page_size, page, granularity=granularity
+        )
+        rows, (min_date, max_date) = Repository.fetch_all_with_bounds(*rate_query.sparse_query)
+        return {
+            "rows": rows,
+            "min_date": min_date,
+            "max_date": max_date
+        }
+
+    @staticmethod
+    def fetch_rates_by_cursor(
+        origin: str, destination: str, date_from:str= None, date_to:str=None, page_size: int = 10,
+        cursor_day=None, direction: str = 'next'
+    ):
+        """
+        Keyset paginated rates, the page holds the `page_size` days after (`next`) or before
+        (`previous`) the cursor day. Returns the rates along with the cursor days of the
+        next and previous pages, None when there is no such page.
+        """
+        rate_query = Prices.rate_query(
+            origin, destination, date_from, date_to, page_size
+        ).add_cursor(cursor_day, direction)
+        rates, (min_date, max_date) = Repository.fetch_all_with_bounds(*rate_query.cursor_query)
         return {
-            "rates": Repository.fetch_all(
-                rate_query.query
-            ),
-            "count": Prices.count(
-                origin, destination, date_from, date_to
-            )
+            "rates": rates,
+            "next": rates[-1][0] if rates and rates[-1][0] < max_date else None,
+            "previous": rates[0][0] if rates and rates[0][0] > min_date else None
         }
 
     @staticmethod
-    def count(origin: str, destination: str, date_from:str= None, date_to:str=None):
-        rate_query = RateQuery().add_source_destination_filter(
-            source=origin, destination=destination
+    def fetch_lane_rates(lanes: list, date_from:str= None, date_to:str=None):
+        """
+        Rates of many `(origin, destination)` lanes in one query, returns the list of
+        `(day, avg_price)` rows of every lane, in the order of the lanes.
+        """
+        with timed('region'):
+            lane_codes = [
+                (catalogue.port_codes(origin), catalogue.port_codes(destination)) for origin, destination in lanes
+            ]
+        batch_query = BatchRateQuery(use_rollup=settings.RATES_USE_ROLLUP).add_lanes(lane_codes).add_dates_filter(
+            date_from=date_from, date_to=date_to
+        )
+        rates = [[] for _ in lanes]
+        for lane, day, avg_price in Repository.fetch_all(*batch_query.query):
+            rates[lane].append((day, avg_price))
+        return rates
+
+    @staticmethod
+    def fetch_rate_matrix(origin: str, destination: str, date_from:str= None, date_to:str=None, by_day: bool = False):
+        """
+        `(orig_code, dest_code, avg_price, n_prices)` rows of every port pair of a lane with prices,
+        with a `day` after the codes when `by_day`, see `MatrixRateQuery`.
+        """
+        with timed('region'):
+            source_codes, destination_codes = catalogue.port_codes(origin), catalogue.port_codes(destination)
+        matrix_query = MatrixRateQuery(use_rollup=settings.RATES_USE_ROLLUP, by_day=by_day).add_port_codes_filter(
+            source_codes, destination_codes
         ).add_dates_filter(
             date_from=date_from, date_to=date_to
         )
-        return Repository.fetch_one(rate_query.counter_query)
+        return Repository.fetch_all(*matrix_query.query)
+
+    @staticmethod
+    def stream_rates(origin: str, destination: str, date_from:str= None, date_to:str=None, batch_size: int = 2000):
+        """
+        Yields batches of the sparse `(day, avg_price, n_prices, min_date, max_date)` rows of the whole,
+        unpaginated, date range, in ascending order, see `app.series.fill_batches`.
+        """
+        rate_query = Prices.rate_query(origin, destination, date_from, date_to, page_size=None, page=None)
+        yield from Repository.stream(*rate_query.sparse_query, batch_size=batch_size)
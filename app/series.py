@@ -0,0 +1,122 @@
+"""
+    Dense rate series, filled in from the sparse aggregated days or buckets of days of `RateQuery.sparse_query`.
+"""
+from datetime import timedelta
+
+import numpy as np
+
+from app.queries import Granularity
+
+
+# A day, or a bucket of days, with fewer prices than this gets a null average.
+MIN_PRICES = 3
+
+
+def bucket_origin(min_date, granularity: Granularity = Granularity.DAY):
+    """
+    Start of the first bucket of a series starting on `min_date`, in the unit the buckets are counted in.
+    Day buckets start on the first day, weeks on Monday and months on the 1st.
+    """
+    if granularity.unit == 'month':
+        return np.datetime64(min_date, 'M')
+    if granularity.unit == 'week':
+        return np.datetime64(min_date - timedelta(days=min_date.weekday()), 'D')
+    return np.datetime64(min_date, 'D')
+
+
+def bucket_step(granularity: Granularity = Granularity.DAY) -> int:
+    return 7 * granularity.size if granularity.unit == 'week' else granularity.size
+
+
+def bucket_index(days: np.ndarray, origin, granularity: Granularity = Granularity.DAY) -> np.ndarray:
+    """
+    Index in the series of the buckets of `days`.
+    """
+    return (days.astype(origin.dtype) - origin).astype(np.int64) // bucket_step(granularity)
+
+
+def bucket_starts(index: np.ndarray, origin, granularity: Granularity = Granularity.DAY) -> np.ndarray:
+    """
+    First days of the buckets of `index`.
+    """
+    return (origin + index * bucket_step(granularity)).astype('datetime64[D]')
+
+
+def page_range(
+    min_date, max_date, page: int = None, page_size: int = None, descending: bool = False,
+    granularity: Granularity = Granularity.DAY
+):
+    """
+    Returns the first days of the first and last buckets of a page of the dense series from `min_date`
+    to `max_date`, with the same defaults as `RateQuery.apply_pagination`, None when the page is past the end.
+    """
+    origin = bucket_origin(min_date, granularity)
+    count = int(bucket_index(np.array([max_date], dtype='datetime64[D]'), origin, granularity)[0]) + 1
+    first, last = 0, count - 1
+    if page or page_size:
+        page, page_size = page or 1, page_size or 10
+        offset = (page - 1) * page_size
+        if offset >= count:
+            return None
+        if descending:
+            first, last = max(0, count - offset - page_size), count - 1 - offset
+        else:
+            first, last = offset, min(count - 1, offset + page_size - 1)
+
+    starts = bucket_starts(np.array([first, last]), origin, granularity).tolist()
+    return starts[0], starts[1]
+
+
+def fill_dates(
+    rows, min_date, max_date, page: int = None, page_size: int = None, descending: bool = False,
+    granularity: Granularity = Granularity.DAY
+):
+    """
+    Fills the days, or buckets, missing from the sparse `(day, avg_price, n_prices)` rows of a page.
+    Returns the `(day, avg_price)` rows of every day of the page, in order, the average being None for
+    the days without prices or with fewer than `MIN_PRICES` prices, along with the number of days of
+    the whole series. A bucket is returned as its first day, see `Granularity`.
+    """
+    if min_date is None:
+        return [], 0
+
+    origin = bucket_origin(min_date, granularity)
+    count = int(bucket_index(np.array([max_date], dtype='datetime64[D]'), origin, granularity)[0]) + 1
+    bounds = page_range(min_date, max_date, page, page_size, descending, granularity)
+    if bounds is None:
+        return [], count
+
+    first, last = bucket_index(np.array(bounds, dtype='datetime64[D]'), origin, granularity)
+    days = bucket_starts(np.arange(first, last + 1), origin, granularity)
+    prices = np.full(len(days), np.nan)
+    if rows:
+        sparse_days, sparse_prices, n_prices = zip(*rows)
+        index = bucket_index(np.array(sparse_days, dtype='datetime64[D]'), origin, granularity) - first
+        keep = (index >= 0) & (index < len(days)) & (np.array(n_prices, dtype=np.int64) >= MIN_PRICES)
+        prices[index[keep]] = np.array(sparse_prices, dtype=np.float64)[keep]
+
+    if descending:
+        days, prices = days[::-1], prices[::-1]
+    averages = prices.astype(object)
+    averages[np.isnan(prices)] = None
+    return list(zip(days.tolist(), averages.tolist())), count
+
+
+def fill_batches(batches):
+    """
+    Same as `fill_dates` over batches of the ascending sparse `(day, avg_price, n_prices, min_date, max_date)`
+    rows of a whole series, e.g. read from a server side cursor. Yields the dense `(day, avg_price)` rows
+    batch by batch, only holding one batch at a time.
+    """
+    next_day = max_date = None
+    for rows in batches:
+        sparse = [row[:3] for row in rows if row[0] is not None]
+        if not sparse:
+            continue
+        first_day = rows[0][3] if next_day is None else next_day
+        max_date, last_day = rows[0][4], sparse[-1][0]
+        yield fill_dates(sparse, first_day, last_day)[0]
+        next_day = last_day + timedelta(days=1)
+
+    if next_day is not None and next_day <= max_date:
+        yield fill_dates([], next_day, max_date)[0]
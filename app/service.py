@@ -1,9 +1,23 @@
-from datetime import datetime
+import base64
+import binascii
+import csv
+import hashlib
+from datetime import date, datetime
+import io
+import json
 import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DataError
 from rest_framework.exceptions import ValidationError
 
-from app.repository import Port, Prices, Region
+from app.cache import rates_cache
+from app.queries import Granularity
+from app.repository import (
+    DatabasePool, PriceIngestion, PriceRollup, Prices, catalogue, catalogue_data_version, prices_version
+)
 from app.exception import get_message as _, error_messages, ErrorReason
+from app.series import fill_batches, fill_dates
 
 
 logger = logging.getLogger(__name__)
@@ -12,22 +26,21 @@ logger = logging.getLogger(__name__)
 def validate_date_format(date_str: str) -> datetime:
     try:
         return datetime.strptime(date_str, '%Y-%m-%d')
-    except ValueError as e:
+    except (ValueError, TypeError) as e:
         raise ValidationError(
             {"message": _(error_messages[ErrorReason.INVALID_DATE_FORMAT]), "code": ErrorReason.INVALID_DATE_FORMAT}   
         )
 
 
-def check_endpoint_exists(endpoint: str):
-    exists = Port.exists(endpoint) or Region.exists(endpoint)
-    if not exists:
+def check_endpoint_exists(endpoint: str, refresh: bool = True):
+    if not catalogue.endpoint_kind(endpoint, refresh):
         raise ValidationError(
             {"message": _(error_messages[ErrorReason.ENDPOINT_NOT_FOUND], endpoint=endpoint), "code": ErrorReason.ENDPOINT_NOT_FOUND}
         )
     return endpoint
 
 
-def validate_endpoints(request):
+def validate_endpoints(request, refresh: bool = True):
     origin = request.query_params.get('origin', None)
     destination = request.query_params.get('destination', None)
     if not (origin and destination):
@@ -35,16 +48,23 @@ def validate_endpoints(request):
             {"message": _(error_messages[ErrorReason.ENPOINTS_REQUIRED]), "code": ErrorReason.ENPOINTS_REQUIRED}
         )
 
-    return check_endpoint_exists(origin), check_endpoint_exists(destination)
+    return check_endpoint_exists(origin, refresh), check_endpoint_exists(destination, refresh)
 
 
 def validate_dates(request):
-    date_from = request.query_params.get('date_from', None)
-    date_to = request.query_params.get('date_to', None)
-    if 'date_from' in request.query_params:
+    return validate_date_range(request.query_params)
+
+
+def validate_date_range(params):
+    """
+    Validates the `date_from`/`date_to` of query parameters or of a request body.
+    """
+    date_from = params.get('date_from', None)
+    date_to = params.get('date_to', None)
+    if 'date_from' in params:
         date_from = validate_date_format(date_from)
     
-    if 'date_to' in request.query_params:
+    if 'date_to' in params:
         date_to = validate_date_format(date_to)
 
     if (date_from and date_to) and date_from > date_to:
@@ -74,22 +94,463 @@ def validate_pagination(request):
     return page, page_size
 
 
+def normalise_date(value):
+    return value.date().isoformat() if isinstance(value, datetime) else value
+
+
+def rates_cache_key(
+    origin: str, destination: str, date_from:str = None, date_to:str = None, page_size: int = 10, page: int = 1,
+    refresh: bool = True, granularity: Granularity = Granularity.DAY
+) -> str:
+    # Same defaults as `RateQuery.apply_pagination`, no page nor page size means no pagination.
+    if page or page_size:
+        page, page_size = page or 1, page_size or 10
+
+    return rates_cache.make_key(
+        prices_version.current(refresh)[0], catalogue.get_version(refresh),
+        origin, destination, normalise_date(date_from), normalise_date(date_to), page, page_size, granularity
+    )
+
+
+def rates_validators(params: dict, stream: str = None, media_type: str = None):
+    """
+    `(etag, last_modified)` validators of a `/rates/` response, derived from the prices data version,
+    the catalogue version, the normalised parameters and the media type, so they are computed without
+    querying the prices. None without a data version to derive them from, see `DataVersion`.
+    `last_modified` is the last change of the prices or of the catalogue, None when the catalogue
+    changes aren't recorded (`0006_catalogue_data_version`), the ETag being the only validator then.
+    """
+    version, updated_at = prices_version.current()
+    if updated_at is None:
+        return None
+    catalogue_stamp, catalogue_updated_at = catalogue_data_version.current()
+    last_modified = max(updated_at, catalogue_updated_at) if catalogue_updated_at else None
+
+    page, page_size = params.get('page'), params.get('page_size')
+    if params.get('cursor') is None and (page or page_size):
+        page, page_size = page or 1, page_size or 10
+    key = rates_cache.make_key(
+        version, catalogue_stamp, catalogue.version, params['origin'], params['destination'], normalise_date(params.get('date_from')),
+        normalise_date(params.get('date_to')), page, page_size, params.get('cursor'), params.get('granularity'),
+        stream, media_type
+    )
+    return f'"{hashlib.md5(key.encode()).hexdigest()}"', last_modified
+
+
+def validate_granularity(request):
+    """
+    Returns the `Granularity` of the `granularity` parameter, a day by default.
+    """
+    granularity = request.query_params.get('granularity', None)
+    if granularity is None:
+        return Granularity.DAY
+    parsed = Granularity.parse(granularity)
+    if parsed is None:
+        raise ValidationError(
+            {"message": _(error_messages[ErrorReason.INVALID_GRANULARITY], granularity=granularity), "code": ErrorReason.INVALID_GRANULARITY}
+        )
+    return parsed
+
+
+def check_granularity_supported(granularity: Granularity, cursor=None, stream: str = None):
+    """
+    Buckets other than days are only served by the page paginated rates.
+    """
+    if granularity != Granularity.DAY and (cursor is not None or stream):
+        raise ValidationError(
+            {"message": _(error_messages[ErrorReason.UNSUPPORTED_GRANULARITY], granularity=granularity), "code": ErrorReason.UNSUPPORTED_GRANULARITY}
+        )
+
+
+def encode_cursor(direction: str, cursor_day: date) -> str:
+    """
+    Opaque cursor pointing before/after a day, e.g. `next:2016-01-10` base64 encoded.
+    """
+    return base64.urlsafe_b64encode(f"{direction}:{cursor_day.isoformat()}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """
+    Returns the `(direction, cursor_day)` of a cursor, an empty cursor stands for the first page.
+    """
+    if not cursor:
+        return 'next', None
+    try:
+        direction, separator, cursor_day = base64.urlsafe_b64decode(cursor.encode()).decode().partition(':')
+        if not separator or direction not in ('next', 'previous'):
+            raise ValueError(direction)
+        return direction, date.fromisoformat(cursor_day)
+    except (ValueError, binascii.Error):
+        raise ValidationError(
+            {"message": _(error_messages[ErrorReason.INVALID_CURSOR], cursor=cursor), "code": ErrorReason.INVALID_CURSOR}
+        )
+
+
+def validate_cursor(request):
+    """
+    Keyset pagination is used when the `cursor` parameter is given, even empty for the first page.
+    """
+    if 'cursor' not in request.query_params:
+        return None
+    return decode_cursor(request.query_params['cursor'])
+
+
+STREAM_FORMATS = ('json', 'ndjson')
+
+
+def validate_stream(request):
+    """
+    Returns the streaming format asked with the `stream` parameter, None to not stream.
+    """
+    stream = request.query_params.get('stream', None)
+    if stream is not None and stream not in STREAM_FORMATS:
+        raise ValidationError(
+            {"message": _(error_messages[ErrorReason.INVALID_STREAM_FORMAT], stream=stream), "code": ErrorReason.INVALID_STREAM_FORMAT}
+        )
+    return stream
+
+
+# JSON of a rate, as `RateSerializer` and the compact JSON renderer write it.
+RATE_JSON = '{"day":"%s","average_price":%s}'
+
+
+def encode_rate(row) -> str:
+    # Same representation as `RateSerializer`, a date string and a float, `repr` is how json writes floats.
+    day, average_price = row
+    return RATE_JSON % (day.isoformat(), 'null' if average_price is None else repr(float(average_price)))
+
+
+def encode_rates(rows) -> str:
+    """
+    JSON array of the `(day, average_price)` rows, byte for byte the `RateSerializer(many=True)` response
+    without building the per-row dicts and running the serializer fields.
+    """
+    return '[' + ','.join(map(encode_rate, rows)) + ']'
+
+
+def stream_rates(
+    origin: str, destination: str, date_from:str = None, date_to:str = None, stream: str = 'json'
+):
+    """
+    Yields the rates of the whole date range encoded as a JSON array, or as NDJSON, piece by piece.
+    The days without prices are filled in batch by batch, as for the pages, see `app.series`.
+    """
+    batches = fill_batches(Prices.stream_rates(
+        origin, destination, date_from, date_to, batch_size=settings.RATES_STREAM_BATCH_SIZE
+    ))
+    if stream == 'ndjson':
+        for rows in batches:
+            yield ''.join(encode_rate(row) + '\n' for row in rows)
+        return
+
+    yield '['
+    separator = ''
+    for rows in batches:
+        yield separator + ','.join(encode_rate(row) for row in rows)
+        separator = ','
+    yield ']'
+
+
+async def aiterate(iterator):
+    """
+    Async iterator over a sync one, e.g. `stream_rates`, for the streaming responses served by `api.asgi`,
+    which would otherwise read a sync iterator whole before sending it. Every item is read in the thread
+    of the request, so a server side cursor stays on the connection it was opened on.
+    """
+    iterator = iter(iterator)
+    done = object()
+    try:
+        while True:
+            item = await sync_to_async(next, thread_sensitive=True)(iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        if hasattr(iterator, 'close'):
+            await sync_to_async(iterator.close, thread_sensitive=True)()
+
+
 def get_rates(
-    origin: str, destination: str, date_from:str = None, date_to:str = None, page_size: int = 10, page: int = 1
+    origin: str, destination: str, date_from:str = None, date_to:str = None, page_size: int = 10, page: int = 1,
+    granularity: Granularity = Granularity.DAY
 ):    
-    rate_info = Prices.fetch_rates(origin, destination, date_from, date_to, page_size, page)
+    rate_info = rates_cache.get_or_set(
+        rates_cache_key(origin, destination, date_from, date_to, page_size, page, granularity=granularity),
+        lambda: get_rates_with_dates_filled(origin, destination, date_from, date_to, page_size, page, granularity)
+    )
     return {
         "rates": map(
             lambda data: {"day": data[0], "average_price": data[1]},
             rate_info["rates"]
         ),
+        "rows": rate_info["rates"],
         "count": rate_info["count"]
     }
     
 
 
+def get_rates_by_cursor(
+    origin: str, destination: str, date_from:str = None, date_to:str = None, page_size: int = 10,
+    cursor: tuple = ('next', None)
+):
+    direction, cursor_day = cursor
+    page_size = page_size or 10
+    rate_info = rates_cache.get_or_set(
+        rates_cache.make_key(
+            prices_version.version, catalogue.version, 'cursor', direction, cursor_day,
+            origin, destination, normalise_date(date_from), normalise_date(date_to), page_size
+        ),
+        lambda: Prices.fetch_rates_by_cursor(
+            origin, destination, date_from, date_to, page_size, cursor_day, direction
+        )
+    )
+    return {
+        "rates": map(
+            lambda data: {"day": data[0], "average_price": data[1]},
+            rate_info["rates"]
+        ),
+        "rows": rate_info["rates"],
+        "next": encode_cursor('next', rate_info["next"]) if rate_info["next"] else None,
+        "previous": encode_cursor('previous', rate_info["previous"]) if rate_info["previous"] else None
+    }
+
+
+def validate_batch(data):
+    """
+    Validates a batch of lanes, `{"date_from": ..., "date_to": ..., "lanes": [{"origin": ..., "destination": ..., "key": ...}]}`.
+    Returns the lanes as `(key, origin, destination, error)`, an invalid lane carries its error instead
+    of failing the whole batch, along with the dates. The results are keyed by lane, two lanes with the
+    same key fail the whole batch.
+    """
+    lanes = data.get('lanes', None) if isinstance(data, dict) else None
+    if not (isinstance(lanes, list) and 0 < len(lanes) <= settings.RATES_BATCH_MAX_LANES):
+        raise ValidationError(
+            {"message": _(error_messages[ErrorReason.INVALID_LANES], max_lanes=settings.RATES_BATCH_MAX_LANES), "code": ErrorReason.INVALID_LANES}
+        )
+
+    date_from, date_to = validate_date_range(data)
+
+    validated, keys = [], set()
+    for lane in lanes:
+        lane = lane if isinstance(lane, dict) else {}
+        origin, destination = lane.get('origin', None), lane.get('destination', None)
+        key = str(lane.get('key', None) or f"{origin}:{destination}")
+        if key in keys:
+            raise ValidationError(
+                {"message": _(error_messages[ErrorReason.DUPLICATE_LANE_KEY], key=key), "code": ErrorReason.DUPLICATE_LANE_KEY}
+            )
+        keys.add(key)
+        error = None
+        try:
+            if not (isinstance(origin, str) and isinstance(destination, str) and origin and destination):
+                raise ValidationError(
+                    {"message": _(error_messages[ErrorReason.ENPOINTS_REQUIRED]), "code": ErrorReason.ENPOINTS_REQUIRED}
+                )
+            check_endpoint_exists(origin)
+            check_endpoint_exists(destination)
+        except ValidationError as e:
+            error = e.detail
+        validated.append((key, origin, destination, error))
+
+    return validated, date_from, date_to
+
+
+def get_batch_rates(lanes: list, date_from:str = None, date_to:str = None):
+    """
+    Rates of all the valid lanes, fetched with a single query. Returns the rates or the error
+    of every lane, keyed by the lane keys.
+    """
+    valid_lanes = [(key, origin, destination) for key, origin, destination, error in lanes if not error]
+    lane_rates = Prices.fetch_lane_rates(
+        [(origin, destination) for key, origin, destination in valid_lanes], date_from, date_to
+    ) if valid_lanes else []
+
+    result = {key: {"error": error} for key, origin, destination, error in lanes if error}
+    for (key, origin, destination), rates in zip(valid_lanes, lane_rates):
+        result[key] = {
+            "rates": [{"day": day, "average_price": average_price} for day, average_price in rates]
+        }
+    return result
+
+
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def validate_by_day(request) -> bool:
+    by_day = request.query_params.get('by_day', 'false')
+    if by_day.lower() not in BOOLEANS:
+        raise ValidationError(
+            {"message": _(error_messages[ErrorReason.INVALID_BY_DAY], by_day=by_day), "code": ErrorReason.INVALID_BY_DAY}
+        )
+    return BOOLEANS[by_day.lower()]
+
+
+def validate_matrix_range(date_from, date_to, by_day: bool):
+    """
+    A row per pair and day is only returned over a bounded date range, of `RATES_MATRIX_MAX_DAYS` days.
+    """
+    max_days = settings.RATES_MATRIX_MAX_DAYS
+    if by_day and (not date_from or not date_to or (date_to - date_from).days + 1 > max_days):
+        raise ValidationError({
+            "message": _(error_messages[ErrorReason.INVALID_MATRIX_RANGE], max_days=max_days),
+            "code": ErrorReason.INVALID_MATRIX_RANGE
+        })
+
+
+def get_rate_matrix(origin: str, destination: str, date_from:str = None, date_to:str = None, by_day: bool = False):
+    """
+    Average price and number of prices of every port pair of a lane with prices, as columns
+    `{"orig_code": [...], "dest_code": [...], ("day": [...],) "average_price": [...], "count": [...]}`.
+    """
+    return rates_cache.get_or_set(
+        rates_cache.make_key(
+            prices_version.version, catalogue.version, 'matrix', by_day,
+            origin, destination, normalise_date(date_from), normalise_date(date_to)
+        ),
+        lambda: matrix_columns(Prices.fetch_rate_matrix(origin, destination, date_from, date_to, by_day), by_day)
+    )
+
+
+def matrix_columns(rows, by_day: bool = False) -> dict:
+    names = ('orig_code', 'dest_code', 'day', 'average_price', 'count') if by_day else (
+        'orig_code', 'dest_code', 'average_price', 'count'
+    )
+    columns = {name: list(values) for name, values in zip(names, zip(*rows))} if rows else {name: [] for name in names}
+    if by_day:
+        columns["day"] = [day.isoformat() for day in columns["day"]]
+    columns["average_price"] = [
+        None if average_price is None else float(average_price) for average_price in columns["average_price"]
+    ]
+    return columns
+
+
+PRICE_FORMATS = ('csv', 'ndjson')
+PRICE_COLUMNS = ('orig_code', 'dest_code', 'day', 'price')
+BATCH_ID_MAX_LENGTH = 200
+
+
+def invalid_prices(error):
+    return ValidationError(
+        {"message": _(error_messages[ErrorReason.INVALID_PRICES], error=error), "code": ErrorReason.INVALID_PRICES}
+    )
+
+
+def validate_prices_format(format: str):
+    if format not in PRICE_FORMATS:
+        raise ValidationError(
+            {"message": _(error_messages[ErrorReason.INVALID_PRICES_FORMAT], format=format), "code": ErrorReason.INVALID_PRICES_FORMAT}
+        )
+    return format
+
+
+def validate_batch_id(batch_id: str):
+    """
+    Returns the id of a batch of prices, None when there is none.
+    """
+    batch_id = (batch_id or '').strip()
+    if len(batch_id) > BATCH_ID_MAX_LENGTH:
+        raise ValidationError({
+            "message": _(error_messages[ErrorReason.INVALID_BATCH_ID], batch_id=batch_id, max_length=BATCH_ID_MAX_LENGTH),
+            "code": ErrorReason.INVALID_BATCH_ID
+        })
+    return batch_id or None
+
+
+def parse_price_rows(lines, format: str = 'csv'):
+    """
+    Yields `(orig_code, dest_code, day, price)` rows from text lines, either CSV, with an optional
+    `orig_code,dest_code,day,price` header in any column order, or NDJSON objects with those keys.
+    The values themselves are checked by Postgres while loading.
+    """
+    if format == 'ndjson':
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise invalid_prices(f"line {line_number}, {e}")
+            if not isinstance(row, dict):
+                raise invalid_prices(f"line {line_number}, expected a JSON object")
+            yield tuple(row.get(column) for column in PRICE_COLUMNS)
+        return
+
+    reader = csv.reader(lines)
+    columns = None
+    for row in reader:
+        if not row:
+            continue
+        if columns is None:
+            header = [value.strip().lower() for value in row]
+            if set(PRICE_COLUMNS) <= set(header):
+                columns = [header.index(column) for column in PRICE_COLUMNS]
+                continue
+            columns = list(range(len(PRICE_COLUMNS)))
+        if len(row) <= max(columns):
+            raise invalid_prices(f"line {reader.line_num}, expected {len(PRICE_COLUMNS)} columns, got {len(row)}")
+        yield tuple(row[index] for index in columns)
+
+
+def price_csv_chunks(rows, chunk_size: int):
+    """
+    Encodes rows as CSV text, `chunk_size` rows at a time, missing values are loaded as nulls.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ingest_prices(lines, format: str = 'csv', batch_id: str = None):
+    """
+    Bulk loads prices, see `PriceIngestion.load`, then refreshes the touched days of the rollup
+    when it is installed. Returns the load counts and the touched `(orig_code, dest_code, day)` keys.
+    """
+    rows = parse_price_rows(lines, validate_prices_format(format))
+    batch_id = validate_batch_id(batch_id)
+    try:
+        result = PriceIngestion.load(price_csv_chunks(rows, settings.PRICES_INGEST_CHUNK_SIZE), batch_id)
+    except DataError as e:
+        # First line of the Postgres error along with its context, e.g. `COPY prices_staging, line 3, column day`
+        lines = str(e).strip().splitlines()
+        raise invalid_prices('; '.join(
+            lines[:1] + [line.partition(':')[2].strip() for line in lines if line.startswith('CONTEXT:')]
+        ))
+
+    prices_version.invalidate()
+    if result["touched"] and PriceRollup.installed():
+        PriceRollup.refresh()
+    return result
+
+
+def get_rates_cache_stats():
+    return rates_cache.stats()
+
+
+def get_database_pool_stats():
+    return DatabasePool.stats()
+
+
 def get_rates_with_dates_filled(
-    rigin: str, destination: str, date_from:str = None, date_to:str = None, page_size: int = 10, page: int = 1
+    origin: str, destination: str, date_from:str = None, date_to:str = None, page_size: int = 10, page: int = 1,
+    granularity: Granularity = Granularity.DAY
 ):
-    pass
+    """
+    Rates of every day, or bucket of days, of the page, filled in from the days with prices the database
+    returns. Returns the `(day, average_price)` rows along with the number of days of the whole series.
+    """
+    sparse = Prices.fetch_sparse_rates(origin, destination, date_from, date_to, page_size, page, granularity)
+    rates, count = fill_dates(
+        sparse["rows"], sparse["min_date"], sparse["max_date"], page, page_size, granularity=granularity
+    )
+    return {
+        "rates": rates,
+        "count": count
+    }
 
@@ -0,0 +1,106 @@
+"""
+    Schema and catalogue data shared by the test cases, mirroring `ratestask/rates.sql`.
+"""
+from django.db import connection
+from django.test import TestCase
+
+from app.cache import rates_cache
+from app.repository import catalogue, catalogue_data_version, prices_version
+
+
+def create_tables(cursor):
+    # Create regions table
+    cursor.execute("""
+        CREATE TABLE regions (
+            slug text NOT NULL,
+            name text NOT NULL,
+            parent_slug text
+        );
+    """)
+
+    # Create ports table
+    cursor.execute("""
+        CREATE TABLE ports (
+            code text NOT NULL,
+            name text NOT NULL,
+            parent_slug text NOT NULL
+        );
+    """)
+
+    # Create prices table
+    cursor.execute("""
+        CREATE TABLE prices (
+            orig_code text NOT NULL,
+            dest_code text NOT NULL,
+            day date NOT NULL,
+            price integer NOT NULL
+        );
+    """)
+
+
+def add_keys(cursor):
+    # Primary and foreign keys of `ratestask/rates.sql`, after the catalogue and prices are inserted.
+    cursor.execute("ALTER TABLE ONLY regions ADD CONSTRAINT regions_pkey PRIMARY KEY (slug)")
+    cursor.execute("ALTER TABLE ONLY ports ADD CONSTRAINT ports_pkey PRIMARY KEY (code)")
+    cursor.execute("ALTER TABLE ONLY ports ADD CONSTRAINT ports_parent_slug_fkey FOREIGN KEY (parent_slug) REFERENCES regions(slug)")
+    cursor.execute("ALTER TABLE ONLY prices ADD CONSTRAINT prices_dest_code_fkey FOREIGN KEY (dest_code) REFERENCES ports(code)")
+    cursor.execute("ALTER TABLE ONLY prices ADD CONSTRAINT prices_orig_code_fkey FOREIGN KEY (orig_code) REFERENCES ports(code)")
+
+
+def insert_catalogue(cursor):
+    cursor.execute(
+        """
+            INSERT INTO public.regions (slug,"name",parent_slug) VALUES
+            ('china_main','China Main',NULL),
+            ('northern_europe','Northern Europe',NULL),
+            ('scandinavia','Scandinavia','northern_europe'),
+            ('north_europe_sub','North Europe Sub','northern_europe'),
+            ('stockholm_area','Stockholm Area','scandinavia'),
+            ('kattegat','Kattegat','scandinavia'),
+            ('china_east_main','China East Main','china_main'),
+            ('china_south_main','China South Main','china_main');
+        """
+    )
+
+    cursor.execute(
+        """
+        INSERT INTO public.ports (code,"name",parent_slug) VALUES
+        ('SENRK','Norrköping','stockholm_area'),
+        ('SESOE','Södertälje','stockholm_area'),
+        ('SEMMA','Malmö','kattegat'),
+        ('DKFRC','Fredericia','kattegat'),
+        ('NOMAY','Måløy','scandinavia'),
+        ('FRANT','Antibes','north_europe_sub'),
+        ('CNCWN','Chiwan','china_south_main'),
+        ('CNSNZ','Shenzhen','china_south_main'),
+        ('CNYAT','Yantai','china_east_main'),
+        ('CNNBO','Ningbo','china_east_main');
+        """
+    )
+
+
+def reset_caches():
+    # The catalogue, the data versions and the rates cache are process-wide, they outlive a test.
+    catalogue.invalidate()
+    prices_version.invalidate()
+    catalogue_data_version.invalidate()
+    rates_cache.clear()
+
+
+class RatesTestCase(TestCase):
+    """
+        Creates the tables with the catalogue once per test case, subclasses insert their prices
+        after `super().setUpTestData()`. The process-wide caches are reset before every test.
+    """
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            create_tables(cursor)
+            insert_catalogue(cursor)
+
+    def setUp(self) -> None:
+        super().setUp()
+        reset_caches()
@@ -0,0 +1,67 @@
+import json
+
+from django.db import connection
+from django.test import TransactionTestCase
+
+from app.aio.repository import async_pool
+from app.cache import rates_cache
+from app.exception import ErrorReason
+from app.tests.fixtures import create_tables, insert_catalogue, reset_caches
+
+
+class AsyncRatesTestCase(TransactionTestCase):
+    """
+        The async pool has its own connections which can't see the data of a test transaction,
+        so the tables are committed and dropped after every test.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        with connection.cursor() as cursor:
+            create_tables(cursor)
+            insert_catalogue(cursor)
+            cursor.execute(
+                """
+                    INSERT INTO public.prices (orig_code,dest_code,"day",price) VALUES
+                    ('SENRK','CNNBO','2016-01-01',1244),
+                    ('SENRK','CNNBO','2016-01-01',1044),
+                    ('SESOE','CNYAT','2016-01-02',1500),
+                    ('SEMMA','CNSNZ','2016-01-03',1000),
+                    ('SEMMA','CNSNZ','2016-01-05',1100);
+                """
+            )
+        reset_caches()
+
+    def tearDown(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS prices, ports, regions")
+        reset_caches()
+        super().tearDown()
+
+    async def test_matches_sync_rates(self):
+        try:
+            for params in [
+                {'origin': 'scandinavia', 'destination': 'china_main', 'date_from': '2016-01-01', 'date_to': '2016-01-05'},
+                {'origin': 'scandinavia', 'destination': 'china_main', 'date_from': '2016-01-01', 'date_to': '2016-01-05', 'page_size': 2, 'page': 2},
+                {'origin': 'SENRK', 'destination': 'CNNBO'},
+            ]:
+                rates_cache.clear()
+                response = await self.async_client.get('/async/rates/', params)
+                expected = await self.async_client.get('/rates/', params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), json.loads(expected.content))
+                self.assertEqual(response.headers['max_count'], expected.headers['max_count'])
+                self.assertRegex(response.headers['Server-Timing'], r'validation;dur=.*db;dur=.*sql-1;dur=.*total;dur=')
+        finally:
+            await async_pool.close()
+
+    async def test_unknown_endpoint(self):
+        try:
+            response = await self.async_client.get(
+                '/async/rates/', {'origin': 'atlantis', 'destination': 'china_main'}
+            )
+        finally:
+            await async_pool.close()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['code'], str(ErrorReason.ENDPOINT_NOT_FOUND))
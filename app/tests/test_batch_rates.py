@@ -0,0 +1,94 @@
+import json
+import random
+
+from django.test import override_settings
+from django.db import connection
+
+from app import service as rate_service
+from app.exception import ErrorReason
+from app.tests.fixtures import RatesTestCase
+
+
+LANES = [
+    {'origin': 'SENRK', 'destination': 'CNNBO'},
+    {'origin': 'scandinavia', 'destination': 'china_main', 'key': 'scandinavia-china'},
+    {'origin': 'china_main', 'destination': 'SENRK'},
+    {'origin': 'stockholm_area', 'destination': 'china_east_main'},
+]
+
+
+@override_settings(RATES_CACHE={'ENABLED': False})
+class BatchRatesTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            rnd = random.Random(10)
+            cursor.executemany(
+                "INSERT INTO prices VALUES (%s, %s, %s, %s)",
+                [
+                    (
+                        rnd.choice(['SENRK', 'SESOE', 'SEMMA']), rnd.choice(['CNNBO', 'CNYAT']),
+                        f"2016-01-{rnd.randint(1, 15):02d}", rnd.randint(900, 1500)
+                    )
+                    for _ in range(200)
+                ] + [('CNNBO', 'SENRK', '2016-01-03', 1000)]
+            )
+
+    def post(self, payload):
+        return self.client.post('/rates/batch', json.dumps(payload), content_type='application/json')
+
+    def test_lanes_match_single_lane_rates(self):
+        response = self.post({'date_from': '2016-01-02', 'date_to': '2016-01-12', 'lanes': LANES})
+        self.assertEqual(response.status_code, 200)
+
+        result = response.json()
+        self.assertEqual(
+            list(result), ['SENRK:CNNBO', 'scandinavia-china', 'china_main:SENRK', 'stockholm_area:china_east_main']
+        )
+        for lane, key in zip(LANES, result):
+            single = self.client.get('/rates/', {
+                'origin': lane['origin'], 'destination': lane['destination'],
+                'date_from': '2016-01-02', 'date_to': '2016-01-12'
+            })
+            self.assertEqual(result[key]['rates'], single.json())
+        self.assertEqual(result['china_main:SENRK']['rates'], [{'day': '2016-01-03', 'average_price': None}])
+
+    def test_lanes_are_fetched_with_one_query(self):
+        lanes, date_from, date_to = rate_service.validate_batch({'lanes': LANES})
+        with self.assertNumQueries(1):
+            rate_service.get_batch_rates(lanes, date_from, date_to)
+
+    def test_lane_errors_are_reported_inline(self):
+        response = self.post({'lanes': [
+            {'origin': 'SENRK', 'destination': 'atlantis'},
+            {'origin': 'SENRK'},
+            {'origin': 'SENRK', 'destination': 'CNNBO'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+
+        result = response.json()
+        self.assertEqual(result['SENRK:atlantis'], {'error': {'message': "Endpoint atlantis doesn't exist.", 'code': '10'}})
+        self.assertEqual(result['SENRK:None']['error']['code'], '30')
+        self.assertTrue(result['SENRK:CNNBO']['rates'])
+
+    @override_settings(RATES_BATCH_MAX_LANES=2)
+    def test_invalid_batches(self):
+        self.assertEqual(self.post({'lanes': LANES}).status_code, 400)
+        self.assertEqual(self.post({'lanes': []}).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+
+    def test_duplicate_lane_keys_are_rejected(self):
+        for lanes, key in [
+            ([{'origin': 'SENRK', 'destination': 'CNNBO', 'key': 'a'}, {'origin': 'SESOE', 'destination': 'CNNBO', 'key': 'a'}], 'a'),
+            ([{'origin': 'SENRK', 'destination': 'CNNBO'}, {'origin': 'SENRK', 'destination': 'CNNBO'}], 'SENRK:CNNBO'),
+            ([{'origin': 'SENRK', 'destination': 'CNNBO'}, {'origin': 'SESOE', 'destination': 'CNNBO', 'key': 'SENRK:CNNBO'}], 'SENRK:CNNBO'),
+        ]:
+            response = self.post({'lanes': lanes})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {
+                'message': f"Duplicate lane key {key}, every lane should have its own key", 'code': str(ErrorReason.DUPLICATE_LANE_KEY)
+            })
+        self.assertEqual(self.post({'lanes': LANES[:1], 'date_from': '2016-13-01'}).status_code, 400)
@@ -0,0 +1,84 @@
+import datetime
+import json
+import os
+import random
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from app.benchmark import dataset, workload
+from app.queries import RateQuery
+from app.repository import Repository, catalogue, prices_version
+
+
+class BenchmarkTestCase(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        catalogue.invalidate()
+        prices_version.invalidate()
+
+    def generate(self, *args):
+        out = StringIO()
+        call_command(
+            'generate_dataset', '--prices', '3k', '--ports', '60', '--days', '30', '--top-regions', '3', *args,
+            stdout=out
+        )
+        return out.getvalue()
+
+    def test_generates_a_reproducible_dataset(self):
+        self.assertIn("60 ports and 3000 prices", self.generate())
+        checksum = Repository.fetch_all("select count(*), sum(price), count(distinct (orig_code, dest_code)) from prices")
+
+        with self.assertRaisesMessage(Exception, "pass --reset"):
+            self.generate()
+
+        self.generate('--reset')
+        self.assertEqual(
+            Repository.fetch_all("select count(*), sum(price), count(distinct (orig_code, dest_code)) from prices"),
+            checksum
+        )
+        self.assertEqual(
+            Repository.fetch_all("select min(day)::text, max(day)::text from prices"), [('2016-01-01', '2016-01-30')]
+        )
+
+        regions = Repository.fetch_all("select slug, parent_slug from regions")
+        self.assertTrue(all(RateQuery.is_region(slug) for slug, parent_slug in regions))
+        self.assertEqual(len([slug for slug, parent_slug in regions if parent_slug is None]), 3)
+        self.assertTrue(all(RateQuery.is_port(code) for code, in Repository.fetch_all("select code from ports")))
+        self.assertEqual(Repository.fetch_one("select count(distinct code) from ports"), 60)
+
+    def test_workload_mixes_lane_kinds_and_ranges(self):
+        requests = workload.make_requests(
+            random.Random(1), 12, datetime.date(2016, 1, 1), datetime.date(2016, 12, 31),
+            ports=['SENRK', 'CNNBO'], regions=['china_main', 'scandinavia']
+        )
+        self.assertEqual(
+            sorted({kind for kind, params in requests}),
+            sorted(f"{lane_kind}/{range_name}" for lane_kind in workload.LANE_KINDS for range_name in workload.RANGES)
+        )
+        for kind, params in requests:
+            days = (datetime.date.fromisoformat(params['date_to']) - datetime.date.fromisoformat(params['date_from'])).days + 1
+            self.assertEqual(days, workload.RANGES[kind.split('/')[1]])
+            if kind.startswith('region-region'):
+                self.assertFalse(RateQuery.is_port(params['origin']) or RateQuery.is_port(params['destination']))
+
+    def test_benchmark_reports_every_lane_kind(self):
+        self.generate()
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            out = StringIO()
+            call_command('benchmark_rates', '--requests', '12', '--output', output, stdout=out)
+            call_command('benchmark_rates', '--requests', '12', '--baseline', output, stdout=out)
+            with open(output) as results_file:
+                results = json.load(results_file)['/rates/']
+
+        self.assertIn('vs baseline', out.getvalue())
+        self.assertEqual(results['all']['requests'], 12)
+        self.assertEqual(results['all']['errors'], 0)
+        self.assertEqual(len(results), 7)
+        for result in results.values():
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['db_ms'], 0)
@@ -0,0 +1,157 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.exceptions import SynchronousOnlyOperation
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.db import connection
+from django.utils.asyncio import async_unsafe
+
+from app import service as rate_service
+from app.cache import LRUCacheBackend, RatesCache, rates_cache
+from app.repository import prices_version
+from app.tests.fixtures import RatesTestCase
+
+
+class LRUCacheBackendTestCase(SimpleTestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCacheBackend(MAX_ENTRIES=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire(self):
+        cache = LRUCacheBackend(TIMEOUT=10)
+        with mock.patch('app.cache.time.monotonic', return_value=100):
+            cache.set('a', 1)
+        with mock.patch('app.cache.time.monotonic', return_value=109):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('app.cache.time.monotonic', return_value=111):
+            self.assertIsNone(cache.get('a'))
+
+
+class BlockingCacheBackend:
+    """
+        A backend doing I/O, like a database cache, that must not be called from the event loop.
+    """
+
+    def __init__(self) -> None:
+        self.entries = {}
+
+    @async_unsafe
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    @async_unsafe
+    def set(self, key: str, value):
+        self.entries[key] = value
+
+
+class AsyncRatesCacheTestCase(SimpleTestCase):
+
+    async def test_backends_doing_io_run_in_a_thread(self):
+        cache = RatesCache()
+        cache._backend = BlockingCacheBackend()
+        with mock.patch.object(RatesCache, 'enabled', True):
+            await cache.aset('a', 1)
+            self.assertEqual(await cache.aget('a'), 1)
+            with self.assertRaises(SynchronousOnlyOperation):
+                cache.get('a')
+
+    async def test_in_process_backend_is_called_directly(self):
+        cache = RatesCache()
+        cache._backend = LRUCacheBackend()
+        with mock.patch.object(RatesCache, 'enabled', True), mock.patch('app.cache.sync_to_async') as sync_to_async:
+            await cache.aset('a', 1)
+            self.assertEqual(await cache.aget('a'), 1)
+        sync_to_async.assert_not_called()
+
+
+@override_settings(DATA_VERSION_POLL_INTERVAL=0)
+class RatesCacheTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                    INSERT INTO public.prices (orig_code,dest_code,"day",price) VALUES
+                    ('SENRK','CNNBO','2016-01-01',1244),
+                    ('SENRK','CNNBO','2016-01-01',1044),
+                    ('SENRK','CNNBO','2016-01-01',944);
+                """
+            )
+
+    def setUp(self) -> None:
+        super().setUp()
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+
+    def test_equivalent_requests_hit_the_cache(self):
+        first = rate_service.get_rates('SENRK', 'CNNBO', datetime.datetime(2016, 1, 1), None, None, 1)
+        with self.assertNumQueries(1):
+            # Only the data version is read.
+            second = rate_service.get_rates('SENRK', 'CNNBO', '2016-01-01', None, 10, 1)
+
+        # Without pagination parameters the whole series is returned, that's another entry.
+        rate_service.get_rates('SENRK', 'CNNBO', '2016-01-01', None, None, None)
+
+        self.assertEqual(list(first['rates']), list(second['rates']))
+        self.assertEqual(rates_cache.stats()['hits'], 1)
+        self.assertEqual(rates_cache.stats()['misses'], 2)
+
+    def test_loading_prices_invalidates_the_cache(self):
+        r = rate_service.get_rates('SENRK', 'CNNBO')
+        self.assertEqual(list(r['rates']), [{'day': datetime.date(2016, 1, 1), 'average_price': 1077.0}])
+
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-01-01', 1900)")
+
+        r = rate_service.get_rates('SENRK', 'CNNBO')
+        self.assertEqual(list(r['rates']), [{'day': datetime.date(2016, 1, 1), 'average_price': 1283.0}])
+        self.assertEqual(rates_cache.stats()['misses'], 2)
+
+    @override_settings(RATES_CACHE={'ENABLED': False})
+    def test_disabled_cache(self):
+        rate_service.get_rates('SENRK', 'CNNBO')
+        rate_service.get_rates('SENRK', 'CNNBO')
+        self.assertEqual(rates_cache.stats()['hits'], 0)
+
+    def test_disabled_without_data_version(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER prices_data_version ON prices")
+            cursor.execute("DROP TABLE data_version")
+        prices_version.invalidate()
+
+        rate_service.get_rates('SENRK', 'CNNBO')
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-01-01', 1900)")
+        r = rate_service.get_rates('SENRK', 'CNNBO')
+        self.assertEqual(list(r['rates']), [{'day': datetime.date(2016, 1, 1), 'average_price': 1283.0}])
+        self.assertEqual(rates_cache.stats(), {"enabled": False, "hits": 0, "misses": 0, "entries": 0})
+
+    @override_settings(RATES_USE_ROLLUP=True)
+    def test_rollup_refresh_invalidates_the_cache(self):
+        call_command('refresh_rollup', '--install', stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-01-01', 1900)")
+        # Cached from the rollup before it is refreshed.
+        r = rate_service.get_rates('SENRK', 'CNNBO')
+        self.assertEqual(list(r['rates']), [{'day': datetime.date(2016, 1, 1), 'average_price': 1077.0}])
+
+        version = prices_version.version
+        call_command('refresh_rollup', stdout=StringIO())
+        self.assertGreater(prices_version.version, version)
+        r = rate_service.get_rates('SENRK', 'CNNBO')
+        self.assertEqual(list(r['rates']), [{'day': datetime.date(2016, 1, 1), 'average_price': 1283.0}])
+
+        # Nothing to refresh, the version stays.
+        version = prices_version.version
+        call_command('refresh_rollup', stdout=StringIO())
+        self.assertEqual(prices_version.version, version)
@@ -0,0 +1,57 @@
+from django.db import connection
+from rest_framework.exceptions import ValidationError
+
+from app import service as rate_service
+from app.exception import ErrorReason
+from app.repository import Catalogue, catalogue
+from app.tests.fixtures import RatesTestCase
+
+
+class CatalogueTestCase(RatesTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.catalogue = Catalogue()
+
+    def test_region_resolves_to_ports_of_whole_subtree(self):
+        self.assertEqual(
+            self.catalogue.port_codes('northern_europe'),
+            {'SENRK', 'SESOE', 'SEMMA', 'DKFRC', 'NOMAY', 'FRANT'}
+        )
+        self.assertEqual(self.catalogue.port_codes('stockholm_area'), {'SENRK', 'SESOE'})
+
+    def test_port_resolves_to_itself_only_if_it_exists(self):
+        self.assertEqual(self.catalogue.port_codes('CNNBO'), {'CNNBO'})
+        self.assertEqual(self.catalogue.port_codes('XXXXX'), set())
+        self.assertEqual(self.catalogue.port_codes('unknown_region'), set())
+
+    def test_reloads_when_tables_change(self):
+        self.assertEqual(self.catalogue.port_codes('kattegat'), {'SEMMA', 'DKFRC'})
+
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO ports VALUES ('SEGOT', 'Göteborg', 'kattegat')")
+
+        # Still served from memory until the refresh interval elapses or it is invalidated.
+        self.assertEqual(self.catalogue.port_codes('kattegat'), {'SEMMA', 'DKFRC'})
+
+        self.catalogue.invalidate()
+        self.assertEqual(self.catalogue.port_codes('kattegat'), {'SEMMA', 'DKFRC', 'SEGOT'})
+        self.assertIn('SEGOT', self.catalogue.port_codes('northern_europe'))
+
+    def test_endpoint_kind(self):
+        self.assertEqual(self.catalogue.endpoint_kind('SENRK'), Catalogue.PORT)
+        self.assertEqual(self.catalogue.endpoint_kind('scandinavia'), Catalogue.REGION)
+        self.assertIsNone(self.catalogue.endpoint_kind('XXXXX'))
+        self.assertIsNone(self.catalogue.endpoint_kind('SENRKX'))
+
+    def test_endpoint_validation_is_served_from_memory(self):
+        catalogue.invalidate()
+        rate_service.check_endpoint_exists('SENRK')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(rate_service.check_endpoint_exists('china_main'), 'china_main')
+            with self.assertRaises(ValidationError) as raised:
+                rate_service.check_endpoint_exists('atlantis')
+
+        self.assertEqual(raised.exception.detail['code'], str(ErrorReason.ENDPOINT_NOT_FOUND))
+        self.assertEqual(raised.exception.detail['message'], "Endpoint atlantis doesn't exist.")
@@ -0,0 +1,123 @@
+import datetime
+import re
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date, parse_http_date
+
+from app.repository import prices_version
+from app.tests.fixtures import RatesTestCase
+
+
+PARAMS = {'origin': 'scandinavia', 'destination': 'china_main', 'date_from': '2016-01-01', 'date_to': '2016-01-10'}
+
+# Statements reading the prices or their rollups, the data version poll only reads `data_version`.
+PRICES_QUERY = re.compile(r'\b(from|join)\s+prices', re.IGNORECASE)
+
+
+@override_settings(DATA_VERSION_POLL_INTERVAL=0, PREPARED_STATEMENTS=False)
+class ConditionalGetTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+        with connection.cursor() as cursor:
+            cursor.executemany("INSERT INTO prices VALUES (%s, %s, %s, %s)", [
+                ('SENRK', 'CNNBO', datetime.date(2016, 1, day), 1000 + day) for day in range(1, 6) for _ in range(3)
+            ])
+
+    def test_no_validators_without_data_version(self):
+        response = self.client.get('/rates/', PARAMS)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.client.get('/rates/', PARAMS, HTTP_IF_NONE_MATCH='*').status_code, 200)
+
+    def test_not_modified(self):
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+        response = self.client.get('/rates/', PARAMS)
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertRegex(etag, r'^"[0-9a-f]{32}"$')
+        self.assertEqual(parse_http_date(last_modified), int(prices_version.current()[1].timestamp()))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.client.get('/rates/', PARAMS, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual((not_modified['ETag'], not_modified['Last-Modified']), (etag, last_modified))
+        self.assertEqual([query['sql'] for query in queries if PRICES_QUERY.search(query['sql'])], [])
+
+        self.assertEqual(self.client.get('/rates/', PARAMS, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        earlier = http_date(parse_http_date(last_modified) - 60)
+        self.assertEqual(self.client.get('/rates/', PARAMS, HTTP_IF_MODIFIED_SINCE=earlier).status_code, 200)
+        self.assertEqual(self.client.get('/rates/', PARAMS, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_etag_depends_on_the_parameters_and_the_media_type(self):
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+        etag = self.client.get('/rates/', PARAMS)['ETag']
+        self.assertEqual(self.client.get('/rates/', {**PARAMS, 'date_to': '2016-01-10'})['ETag'], etag)
+        for params in (
+            {**PARAMS, 'page': 2}, {**PARAMS, 'granularity': 'week'}, {**PARAMS, 'cursor': ''},
+            {**PARAMS, 'stream': 'ndjson'}, {**PARAMS, 'format': 'csv'}, {**PARAMS, 'origin': 'SENRK'},
+        ):
+            response = self.client.get('/rates/', params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, params)
+            self.assertNotEqual(response['ETag'], etag, params)
+        # No page is the first page.
+        self.assertEqual(self.client.get('/rates/', {**PARAMS, 'page': 2})['ETag'], self.client.get('/rates/', {**PARAMS, 'page': 2, 'page_size': 10})['ETag'])
+
+    def test_new_prices_change_the_etag(self):
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+        response = self.client.get('/rates/', PARAMS)
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-01-06', 900), ('SENRK', 'CNNBO', '2016-01-06', 900), ('SENRK', 'CNNBO', '2016-01-06', 900)")
+        modified = self.client.get('/rates/', PARAMS, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified['ETag'], response['ETag'])
+        self.assertEqual(modified.json()[5], {'day': '2016-01-06', 'average_price': 900.0})
+
+    def test_catalogue_changes_change_the_validators(self):
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE data_version SET updated_at = updated_at - interval '1 hour'")
+        response = self.client.get('/rates/', PARAMS)
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE regions SET parent_slug = NULL WHERE slug = 'stockholm_area'")
+
+        # Seen before the catalogue itself is refreshed.
+        for headers in ({'HTTP_IF_NONE_MATCH': response['ETag']}, {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}):
+            modified = self.client.get('/rates/', PARAMS, **headers)
+            self.assertEqual(modified.status_code, 200, headers)
+            self.assertNotEqual(modified['ETag'], response['ETag'])
+            self.assertGreater(parse_http_date(modified['Last-Modified']), parse_http_date(response['Last-Modified']))
+
+    def test_if_modified_since_ignored_without_catalogue_data_version(self):
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM data_version WHERE name = 'catalogue'")
+        response = self.client.get('/rates/', PARAMS)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.client.get('/rates/', PARAMS, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(
+            self.client.get('/rates/', PARAMS, HTTP_IF_MODIFIED_SINCE=http_date(4102444800)).status_code, 200
+        )
+
+    @override_settings(RATES_USE_ROLLUP=True)
+    def test_rollup_refresh_changes_the_etag(self):
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+        call_command('refresh_rollup', '--install', stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-01-06', 900), ('SENRK', 'CNNBO', '2016-01-06', 900), ('SENRK', 'CNNBO', '2016-01-06', 900)")
+        # The new prices aren't in the rollup yet.
+        response = self.client.get('/rates/', PARAMS)
+        self.assertEqual(len(response.json()), 5)
+
+        call_command('refresh_rollup', stdout=StringIO())
+        modified = self.client.get('/rates/', PARAMS, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(modified.status_code, 200)
+        self.assertEqual(modified.json()[5], {'day': '2016-01-06', 'average_price': 900.0})
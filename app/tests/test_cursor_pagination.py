@@ -0,0 +1,84 @@
+import datetime
+
+from django.db import connection
+from rest_framework.exceptions import ValidationError
+
+from app import service as rate_service
+from app.tests.fixtures import RatesTestCase
+
+
+class CursorPaginationTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            # Prices on 2016-01-01 .. 2016-01-12, except the 6th and 7th.
+            cursor.executemany(
+                "INSERT INTO prices VALUES ('SENRK', 'CNNBO', %s, %s)",
+                [
+                    (datetime.date(2016, 1, day), 1000 + day)
+                    for day in range(1, 13) if day not in (6, 7) for _ in range(3)
+                ]
+            )
+
+    def fetch(self, cursor: str = '', **kwargs):
+        r = rate_service.get_rates_by_cursor(
+            'stockholm_area', 'china_main', page_size=5, cursor=rate_service.decode_cursor(cursor), **kwargs
+        )
+        return [rate['day'].day for rate in r['rates']], r['next'], r['previous']
+
+    def test_walks_forward_and_backward(self):
+        days, next_cursor, previous_cursor = self.fetch()
+        self.assertEqual((days, previous_cursor), ([1, 2, 3, 4, 5], None))
+
+        days, next_cursor, previous_cursor = self.fetch(next_cursor)
+        self.assertEqual(days, [6, 7, 8, 9, 10])
+
+        days, last_next_cursor, last_previous_cursor = self.fetch(next_cursor)
+        self.assertEqual((days, last_next_cursor), ([11, 12], None))
+
+        days, _, _ = self.fetch(last_previous_cursor)
+        self.assertEqual(days, [6, 7, 8, 9, 10])
+
+        days, _, previous_cursor = self.fetch(previous_cursor)
+        self.assertEqual((days, previous_cursor), ([1, 2, 3, 4, 5], None))
+
+    def test_gap_days_are_null_and_match_page_mode(self):
+        r = rate_service.get_rates_by_cursor(
+            'SENRK', 'CNNBO', page_size=5, cursor=('next', datetime.date(2016, 1, 5))
+        )
+        by_page = rate_service.get_rates('SENRK', 'CNNBO', page_size=5, page=2)
+        self.assertEqual(list(r['rates']), list(by_page['rates']))
+
+    def test_dates_filter_bounds_the_series(self):
+        days, next_cursor, previous_cursor = self.fetch(date_from='2016-01-03', date_to='2016-01-09')
+        self.assertEqual(days, [3, 4, 5, 6, 7])
+        days, next_cursor, _ = self.fetch(next_cursor, date_from='2016-01-03', date_to='2016-01-09')
+        self.assertEqual((days, next_cursor), ([8, 9], None))
+
+    def test_empty_lane(self):
+        r = rate_service.get_rates_by_cursor('SENRK', 'CNYAT', cursor=('next', None))
+        self.assertEqual((list(r['rates']), r['next'], r['previous']), ([], None, None))
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', rate_service.encode_cursor('sideways', datetime.date(2016, 1, 1))):
+            with self.assertRaises(ValidationError):
+                rate_service.decode_cursor(cursor)
+
+    def test_view_returns_cursors(self):
+        response = self.client.get('/rates/', {
+            'origin': 'SENRK', 'destination': 'CNNBO', 'cursor': '', 'page_size': 4
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [rate['day'] for rate in response.json()['results']],
+            ['2016-01-01', '2016-01-02', '2016-01-03', '2016-01-04']
+        )
+        self.assertIsNone(response.json()['previous'])
+
+        response = self.client.get('/rates/', {
+            'origin': 'SENRK', 'destination': 'CNNBO', 'cursor': response.json()['next'], 'page_size': 4
+        })
+        self.assertEqual(response.json()['results'][0], {'day': '2016-01-05', 'average_price': 1005.0})
@@ -0,0 +1,49 @@
+from unittest import mock, skipIf
+
+from django.db import connection
+from django.test import SimpleTestCase
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import ConnectionPool
+
+from app.repository import DatabasePool
+
+
+class DatabasePoolTestCase(SimpleTestCase):
+
+    def make_pool(self, **kwargs):
+        settings_dict = connection.settings_dict
+        pool = ConnectionPool(
+            make_conninfo(
+                dbname=settings_dict['NAME'], user=settings_dict['USER'], password=settings_dict['PASSWORD'],
+                host=settings_dict['HOST'], port=settings_dict['PORT'],
+            ),
+            check=ConnectionPool.check_connection, open=False, **kwargs
+        )
+        pool.open(wait=True)
+        self.addCleanup(pool.close)
+        return pool
+
+    @skipIf(connection.settings_dict['OPTIONS'].get('pool'), 'DB_POOL is enabled')
+    def test_disabled_without_pool_option(self):
+        self.assertEqual(DatabasePool.stats(), {"enabled": False})
+
+    def test_reports_usage_and_overflow(self):
+        pool = self.make_pool(min_size=1, max_size=3)
+        with mock.patch.object(DatabasePool, 'pool', return_value=pool):
+            with pool.connection(), pool.connection():
+                stats = DatabasePool.stats()
+                self.assertEqual((stats["in_use"], stats["overflow"]), (2, 1))
+                self.assertEqual((stats["min_size"], stats["max_size"]), (1, 3))
+
+            stats = DatabasePool.stats()
+            self.assertTrue(stats["enabled"])
+            self.assertEqual(stats["in_use"], 0)
+            self.assertEqual(stats["requests"], 2)
+
+    def test_closes_inherited_connection_and_pool(self):
+        for options, pool_closed in [({'pool': {'min_size': 1}}, True), ({}, False)]:
+            wrapper = mock.Mock(settings_dict={'OPTIONS': options})
+            with mock.patch('app.repository.connections', {'default': wrapper}):
+                DatabasePool.discard_inherited()
+            wrapper.close.assert_called_once_with()
+            self.assertEqual(wrapper.close_pool.called, pool_closed)
@@ -0,0 +1,70 @@
+import datetime
+import random
+from decimal import Decimal
+
+from django.test import SimpleTestCase, override_settings
+from django.db import connection
+
+from app import service
+from app.benchmark.formats import render_json
+from app.tests.fixtures import RatesTestCase
+
+
+class EncodeRatesTestCase(SimpleTestCase):
+
+    def test_matches_the_serializer_output(self):
+        rnd = random.Random(18)
+        rows = [
+            (
+                datetime.date(2016, 1, 1) + datetime.timedelta(days=day),
+                rnd.choice([None, rnd.randint(0, 10 ** 6), Decimal(rnd.randint(0, 10 ** 6)), rnd.random() * 10 ** 4])
+            )
+            for day in range(400)
+        ]
+        self.assertEqual(service.encode_rates(rows).encode(), render_json(rows))
+        self.assertEqual(service.encode_rates([]).encode(), render_json([]))
+        self.assertEqual(
+            service.encode_rates([(datetime.date(2016, 1, 1), 1463), (datetime.date(2016, 1, 2), None)]),
+            '[{"day":"2016-01-01","average_price":1463.0},{"day":"2016-01-02","average_price":null}]'
+        )
+
+
+class FastJSONViewTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO prices VALUES (%s, 'CNNBO', %s, %s)",
+                [
+                    (origin, datetime.date(2016, 1, day), 1000 + day * 7 + n)
+                    for origin in ('SENRK', 'SESOE') for day in range(1, 13) if day % 4 for n in range(2)
+                ]
+            )
+
+    def assertSameResponses(self, params: dict):
+        expected = self.client.get('/rates/', params)
+        with override_settings(RATES_FAST_JSON=True):
+            response = self.client.get('/rates/', params)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['Content-Type'], expected['Content-Type'])
+        self.assertEqual(response.get('max_count'), expected.get('max_count'))
+
+    def test_same_responses_as_the_serializer(self):
+        for params in [
+            {'origin': 'stockholm_area', 'destination': 'china_main'},
+            {'origin': 'SENRK', 'destination': 'CNNBO', 'page': 2, 'page_size': 5},
+            {'origin': 'stockholm_area', 'destination': 'CNNBO', 'page_size': 5, 'cursor': ''},
+            {'origin': 'stockholm_area', 'destination': 'CNNBO', 'date_from': '2016-02-01'},
+            {'origin': 'atlantis', 'destination': 'CNNBO'},
+        ]:
+            with self.subTest(**params):
+                self.assertSameResponses(params)
+
+    @override_settings(RATES_FAST_JSON=True)
+    def test_other_formats_are_still_negotiated(self):
+        response = self.client.get('/rates/', {'origin': 'SENRK', 'destination': 'CNNBO', 'format': 'api'})
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
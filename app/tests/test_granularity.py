@@ -0,0 +1,215 @@
+import datetime
+import random
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.db import connection
+
+from app import service as rate_service
+from app.exception import ErrorReason
+from app.queries import Granularity, RateQuery
+from app.repository import Repository, catalogue
+from app.series import fill_dates
+from app.tests.fixtures import RatesTestCase
+
+
+ORIGINS, DESTINATIONS = ['SENRK', 'SESOE', 'SEMMA'], ['CNNBO', 'CNYAT']
+
+
+def day(month: int, number: int) -> datetime.date:
+    return datetime.date(2016, month, number)
+
+
+class GranularityTestCase(SimpleTestCase):
+
+    def test_parse(self):
+        self.assertEqual(Granularity.parse('day'), Granularity.DAY)
+        self.assertEqual(Granularity.parse('1d'), Granularity.DAY)
+        self.assertEqual(Granularity.parse('week'), Granularity('week'))
+        self.assertEqual(Granularity.parse('month'), Granularity('month'))
+        self.assertEqual(Granularity.parse('14d'), Granularity('day', 14))
+        self.assertEqual(Granularity.parse('14'), Granularity('day', 14))
+        for invalid in ('', '0d', '-3d', 'year', 'weeks', '14 d', '99999d'):
+            self.assertIsNone(Granularity.parse(invalid), invalid)
+        self.assertEqual([str(Granularity.parse(value)) for value in ('day', '14', 'week')], ['day', '14d', 'week'])
+
+    def test_fills_buckets(self):
+        # Weeks start on Monday, 2016-01-04 and 2016-01-11 are Mondays.
+        rows = [(day(1, 4), 1000, 3), (day(1, 18), 1100, 2), (day(1, 25), 1200, 9)]
+        self.assertEqual(
+            fill_dates(rows, day(1, 6), day(1, 26), granularity=Granularity('week')),
+            ([(day(1, 4), 1000.0), (day(1, 11), None), (day(1, 18), None), (day(1, 25), 1200.0)], 4)
+        )
+        self.assertEqual(
+            fill_dates(rows, day(1, 6), day(1, 26), 2, 3, descending=True, granularity=Granularity('week')),
+            ([(day(1, 4), 1000.0)], 4)
+        )
+
+        rows = [(day(1, 1), 1000, 30), (day(3, 1), 1100, 3)]
+        self.assertEqual(
+            fill_dates(rows, day(1, 20), day(3, 2), granularity=Granularity('month')),
+            ([(day(1, 1), 1000.0), (day(2, 1), None), (day(3, 1), 1100.0)], 3)
+        )
+
+        # 10 day buckets counted from the first day.
+        rows = [(day(1, 3), 1000, 3), (day(1, 23), 1100, 4)]
+        self.assertEqual(
+            fill_dates(rows, day(1, 3), day(1, 23), 2, 2, granularity=Granularity('day', 10)),
+            ([(day(1, 23), 1100.0)], 3)
+        )
+
+
+class BucketedRatesTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        rnd = random.Random(19)
+        start = datetime.date(2016, 1, 1)
+        # Sparse and irregular prices over 4 months, so that buckets have from 0 to many prices.
+        cls.prices = [
+            (rnd.choice(ORIGINS), rnd.choice(DESTINATIONS), start + datetime.timedelta(days=rnd.randint(3, 110)), rnd.randint(900, 1500))
+            for _ in range(140)
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany("INSERT INTO prices VALUES (%s, %s, %s, %s)", cls.prices)
+
+    @staticmethod
+    def bucket(value: datetime.date, granularity: Granularity, first_day: datetime.date) -> datetime.date:
+        if granularity.unit == 'month':
+            return value.replace(day=1)
+        if granularity.unit == 'week':
+            return value - datetime.timedelta(days=value.weekday())
+        return first_day + datetime.timedelta(days=(value - first_day).days // granularity.size * granularity.size)
+
+    def expected(self, origins, destinations, date_from, date_to, granularity: Granularity):
+        """
+        The bucket averages computed from the raw prices.
+        """
+        prices = [
+            (price_day, price) for orig_code, dest_code, price_day, price in self.prices
+            if orig_code in origins and dest_code in destinations and date_from <= price_day <= date_to
+        ]
+        first_day, last_day = min(price_day for price_day, _ in prices), max(price_day for price_day, _ in prices)
+        buckets = defaultdict(list)
+        for price_day, price in prices:
+            buckets[self.bucket(price_day, granularity, first_day)].append(price)
+
+        rates, bucket_day = [], self.bucket(first_day, granularity, first_day)
+        while bucket_day <= last_day:
+            bucket_prices = buckets.get(bucket_day, [])
+            rates.append((bucket_day, float(
+                (Decimal(sum(bucket_prices)) / len(bucket_prices)).quantize(Decimal(1), ROUND_HALF_UP)
+            ) if len(bucket_prices) >= 3 else None))
+            bucket_day = (
+                (bucket_day + datetime.timedelta(days=32)).replace(day=1) if granularity.unit == 'month'
+                else bucket_day + datetime.timedelta(days=7 * granularity.size if granularity.unit == 'week' else granularity.size)
+            )
+        return rates
+
+    def fetch(self, origin, destination, date_from, date_to, granularity, page=None, page_size=None, order='ASC'):
+        rate_query = RateQuery(use_rollup=self.use_rollup).add_port_codes_filter(
+            catalogue.port_codes(origin), catalogue.port_codes(destination)
+        ).add_dates_filter(date_from, date_to).add_pagination_params(page, page_size).add_granularity(
+            granularity
+        ).add_ordering('dd', order)
+        rows, (min_date, max_date) = Repository.fetch_all_with_bounds(*rate_query.sparse_query)
+        return fill_dates(rows, min_date, max_date, page, page_size, rate_query.descending, granularity), rate_query
+
+    use_rollup = False
+
+    def assertBucketsMatchRawPrices(self, date_from=day(1, 1), date_to=day(4, 30)):
+        for origin, destination in [('SENRK', 'CNNBO'), ('stockholm_area', 'china_main'), ('scandinavia', 'CNYAT')]:
+            origins, destinations = catalogue.port_codes(origin), catalogue.port_codes(destination)
+            for granularity in (Granularity.DAY, Granularity('week'), Granularity('month'), Granularity('day', 10)):
+                expected = self.expected(origins, destinations, date_from, date_to, granularity)
+                (rates, count), _ = self.fetch(origin, destination, date_from, date_to, granularity)
+                self.assertEqual((rates, count), (expected, len(expected)), (origin, destination, granularity))
+
+                for page, page_size in [(1, 2), (2, 2), (3, 5), (40, 5)]:
+                    offset = (page - 1) * page_size
+                    self.assertEqual(
+                        self.fetch(origin, destination, date_from, date_to, granularity, page, page_size)[0],
+                        (expected[offset:offset + page_size], len(expected))
+                    )
+                    self.assertEqual(
+                        self.fetch(origin, destination, date_from, date_to, granularity, page, page_size, 'DESC')[0],
+                        (expected[::-1][offset:offset + page_size], len(expected))
+                    )
+
+    def test_buckets_match_raw_prices(self):
+        self.assertBucketsMatchRawPrices()
+        self.assertBucketsMatchRawPrices(day(1, 20), day(3, 9))
+
+    def test_buckets_from_rollup_match_raw_prices(self):
+        call_command('refresh_rollup', '--install', stdout=StringIO())
+        self.use_rollup = True
+        self.assertBucketsMatchRawPrices()
+        self.assertBucketsMatchRawPrices(day(1, 20), day(3, 9))
+
+    def test_months_read_the_monthly_rollup_when_dates_cover_whole_months(self):
+        call_command('refresh_rollup', '--install', stdout=StringIO())
+        self.use_rollup = True
+        month = Granularity('month')
+        self.assertEqual(self.fetch('SENRK', 'CNNBO', day(1, 1), day(3, 31), month)[1].bucket_table, 'prices_monthly')
+        self.assertEqual(self.fetch('SENRK', 'CNNBO', None, day(2, 29), month)[1].bucket_table, 'prices_monthly')
+        self.assertEqual(self.fetch('SENRK', 'CNNBO', day(1, 2), day(3, 31), month)[1].bucket_table, 'prices_daily')
+        self.assertEqual(self.fetch('SENRK', 'CNNBO', None, None, Granularity('week'))[1].bucket_table, 'prices_daily')
+
+        # Incremental refreshes keep the monthly rollup in line with the prices.
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM prices WHERE day between '2016-02-01' and '2016-02-10'")
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-03-31', 100), ('SENRK', 'CNNBO', '2016-03-31', 200)")
+            self.prices = [
+                price for price in Repository.fetch_all("select orig_code, dest_code, day, price from prices")
+            ]
+        call_command('refresh_rollup', stdout=StringIO())
+        self.assertBucketsMatchRawPrices()
+        self.assertEqual(
+            Repository.fetch_all("select sum(sum_price), sum(n_prices) from prices_monthly"),
+            Repository.fetch_all("select sum(price), count(*) from prices")
+        )
+
+    def test_rates_view(self):
+        response = self.client.get('/rates/', {
+            'origin': 'stockholm_area', 'destination': 'china_main', 'granularity': 'month', 'page_size': 2, 'page': 2
+        })
+        expected = self.expected(
+            catalogue.port_codes('stockholm_area'), catalogue.port_codes('china_main'), day(1, 1), day(12, 31),
+            Granularity('month')
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['max_count'], str(len(expected)))
+        self.assertEqual(
+            [(rate['day'], rate['average_price']) for rate in response.json()],
+            [(bucket_day.isoformat(), average_price) for bucket_day, average_price in expected[2:4]]
+        )
+
+        daily = self.client.get('/rates/', {'origin': 'stockholm_area', 'destination': 'china_main'})
+        self.assertNotEqual(daily.json(), response.json())
+
+    def test_invalid_granularity(self):
+        params = {'origin': 'SENRK', 'destination': 'CNNBO'}
+        response = self.client.get('/rates/', {**params, 'granularity': 'year'})
+        self.assertEqual((response.status_code, response.json()['code']), (400, str(ErrorReason.INVALID_GRANULARITY)))
+
+        for unsupported in ({'cursor': ''}, {'stream': 'json'}):
+            response = self.client.get('/rates/', {**params, 'granularity': 'week', **unsupported})
+            self.assertEqual(
+                (response.status_code, response.json()['code']), (400, str(ErrorReason.UNSUPPORTED_GRANULARITY))
+            )
+        self.assertEqual(self.client.get('/rates/', {**params, 'granularity': 'day', 'cursor': ''}).status_code, 200)
+
+    @override_settings(RATES_CACHE={'ENABLED': True})
+    def test_granularity_is_part_of_the_cache_key(self):
+        self.assertNotEqual(
+            rate_service.rates_cache_key('SENRK', 'CNNBO'),
+            rate_service.rates_cache_key('SENRK', 'CNNBO', granularity=Granularity('week'))
+        )
+        daily = rate_service.get_rates('SENRK', 'CNNBO', page_size=None, page=None)["count"]
+        weekly = rate_service.get_rates('SENRK', 'CNNBO', page_size=None, page=None, granularity=Granularity('week'))["count"]
+        self.assertGreater(daily, weekly)
@@ -0,0 +1,66 @@
+import re
+
+from django.test import override_settings
+from django.db import connection
+
+from app.tests.fixtures import RatesTestCase
+
+
+@override_settings(RATES_CACHE={'ENABLED': False})
+class ServerTimingTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                    INSERT INTO public.prices (orig_code,dest_code,"day",price) VALUES
+                    ('SENRK','CNNBO','2016-01-01',1244),
+                    ('SESOE','CNNBO','2016-01-01',1044),
+                    ('SENRK','CNYAT','2016-01-02',944);
+                """
+            )
+
+    def metrics(self, response) -> dict:
+        return {
+            name: (float(duration), description)
+            for name, duration, description in re.findall(
+                r'([\w-]+);dur=([0-9.]+)(?:;desc="([^"]*)")?', response['Server-Timing']
+            )
+        }
+
+    def test_server_timing_header(self):
+        with self.assertLogs('app.instrumentation', 'INFO') as logs:
+            response = self.client.get('/rates/', {'origin': 'stockholm_area', 'destination': 'china_main'})
+        self.assertEqual(response.status_code, 200)
+
+        metrics = self.metrics(response)
+        for name in ('validation', 'region', 'serialisation', 'db', 'total', 'sql-1'):
+            self.assertIn(name, metrics)
+        self.assertLessEqual(metrics['db'][0], metrics['total'][0])
+        # The rates query returns the two days, along with the total count.
+        self.assertIn('2 rows', [description for duration, description in metrics.values()])
+
+        record = logs.records[-1]
+        self.assertEqual((record.method, record.path, record.status), ('GET', '/rates/', 200))
+        self.assertEqual(len(record.timings['queries']), int(metrics['db'][1].split()[0]))
+        self.assertIn('orig_code = any', ' '.join(query['sql'] for query in record.timings['queries']))
+
+    @override_settings(SERVER_TIMING_ENABLED=False)
+    def test_header_can_be_disabled(self):
+        response = self.client.get('/rates/', {'origin': 'SENRK', 'destination': 'CNNBO'})
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0.001)
+    def test_slow_queries_are_explained(self):
+        with self.assertLogs('app.instrumentation', 'WARNING') as logs:
+            response = self.client.get('/rates/', {'origin': 'SENRK', 'destination': 'CNNBO'})
+
+        self.assertEqual(response.json(), [{"day": "2016-01-01", "average_price": None}])
+        plans = [record.plan for record in logs.records if hasattr(record, 'plan')]
+        self.assertTrue(plans)
+        self.assertTrue(any('Shared Hit Blocks' in plan['Plan'] for plan in plans))
+        # The EXPLAIN runs aren't counted as statements of the request.
+        self.assertNotIn('EXPLAIN', response['Server-Timing'])
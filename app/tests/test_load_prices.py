@@ -0,0 +1,152 @@
+import datetime
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.db import connection
+
+from app import service as rate_service
+from app.exception import ErrorReason
+from app.repository import ChunksReader, Repository, prices_version
+from app.tests.fixtures import RatesTestCase
+
+
+@override_settings(PRICES_INGEST_CHUNK_SIZE=2)
+class LoadPricesTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                    INSERT INTO public.prices (orig_code,dest_code,"day",price) VALUES
+                    ('SENRK','CNNBO','2016-01-01',1244),
+                    ('SENRK','CNNBO','2016-01-02',1044);
+                """
+            )
+
+    def prices(self):
+        return Repository.fetch_all(
+            "select orig_code, dest_code, day::text, price from prices order by orig_code, dest_code, day, price"
+        )
+
+    def load_file(self, content: str, suffix: str = '.csv', batch_id: str = None):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        touched_output = file.name + '.touched'
+        self.addCleanup(lambda: os.path.exists(touched_output) and os.remove(touched_output))
+
+        out = StringIO()
+        options = ['--batch-id', batch_id] if batch_id else []
+        call_command('load_prices', file.name, '--touched-output', touched_output, *options, stdout=out)
+        with open(touched_output) as touched:
+            return out.getvalue(), touched.read().splitlines()
+
+    def test_loads_csv_appending_every_quote(self):
+        output, touched = self.load_file(
+            "day,orig_code,dest_code,price\n"
+            "2016-01-01,SENRK,CNNBO,1500\n"
+            "2016-01-01,SENRK,CNNBO,1500\n"
+            "2016-01-01,SENRK,CNNBO,1600\n"
+            "2016-01-03,SESOE,CNYAT,900\n"
+            "2016-01-03,XXXXX,CNYAT,900\n"
+        )
+
+        self.assertIn("Loaded 4 of 5 prices, touched 2 lane days.", output)
+        self.assertEqual(touched, ['orig_code,dest_code,day', 'SENRK,CNNBO,2016-01-01', 'SESOE,CNYAT,2016-01-03'])
+        # Identical quotes and the earlier quotes of the same lane days are all kept.
+        self.assertEqual(self.prices(), [
+            ('SENRK', 'CNNBO', '2016-01-01', 1244),
+            ('SENRK', 'CNNBO', '2016-01-01', 1500),
+            ('SENRK', 'CNNBO', '2016-01-01', 1500),
+            ('SENRK', 'CNNBO', '2016-01-01', 1600),
+            ('SENRK', 'CNNBO', '2016-01-02', 1044),
+            ('SESOE', 'CNYAT', '2016-01-03', 900),
+        ])
+
+    def test_batch_loaded_once(self):
+        body = "SENRK,CNNBO,2016-01-01,1500\nSENRK,CNNBO,2016-01-01,1500\n"
+        output, _ = self.load_file(body, batch_id='2016-01-01T00')
+        self.assertIn("Loaded 2 of 2 prices", output)
+        prices = self.prices()
+
+        # A retry of the same batch changes nothing, another batch with the same quotes is loaded.
+        output, touched = self.load_file(body, batch_id='2016-01-01T00')
+        self.assertIn("Batch 2016-01-01T00 was already loaded, skipped its 2 prices.", output)
+        self.assertEqual(touched, ['orig_code,dest_code,day'])
+        self.assertEqual(self.prices(), prices)
+        self.load_file(body, batch_id='2016-01-01T01')
+        self.assertEqual(len(self.prices()), len(prices) + 2)
+        self.assertEqual(
+            Repository.fetch_all("select batch_id, n_prices from price_batches order by batch_id"),
+            [('2016-01-01T00', 2), ('2016-01-01T01', 2)]
+        )
+
+    def test_refreshes_rollup_and_data_version(self):
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+        call_command('refresh_rollup', '--install', stdout=StringIO())
+        version = prices_version.version
+
+        result = rate_service.ingest_prices(
+            ['{"orig_code": "SENRK", "dest_code": "CNNBO", "day": "2016-01-02", "price": 2000}\n', '\n'],
+            'ndjson'
+        )
+
+        self.assertEqual(result["touched"], [('SENRK', 'CNNBO', datetime.date(2016, 1, 2))])
+        self.assertGreater(prices_version.version, version)
+        self.assertEqual(
+            Repository.fetch_all("select day::text, sum_price, n_prices from prices_daily order by day"),
+            [('2016-01-01', 1244, 1), ('2016-01-02', 3044, 2)]
+        )
+
+    @override_settings(PRICES_INGEST_TOKEN='secret')
+    def test_ingest_endpoint(self):
+        body = '{"orig_code": "SEMMA", "dest_code": "CNSNZ", "day": "2016-01-05", "price": 1100}\n'
+        response = self.client.post(
+            '/prices/ingest?batch_id=b1', body, content_type='application/x-ndjson', HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "received": 1, "inserted": 1, "duplicate": False,
+            "touched": [{"orig_code": "SEMMA", "dest_code": "CNSNZ", "day": "2016-01-05"}]
+        })
+        response = self.client.post(
+            '/prices/ingest?batch_id=b1', body, content_type='application/x-ndjson', HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.json(), {"received": 1, "inserted": 0, "duplicate": True, "touched": []})
+
+    def test_ingest_endpoint_requires_the_token(self):
+        prices = self.prices()
+        body = 'SEMMA,CNSNZ,2016-01-05,1100\n'
+        for token, headers in [
+            ('', {}), ('', {'HTTP_AUTHORIZATION': 'Bearer '}),
+            ('secret', {}), ('secret', {'HTTP_AUTHORIZATION': 'Bearer other'}), ('secret', {'HTTP_AUTHORIZATION': 'Basic secret'}),
+        ]:
+            with override_settings(PRICES_INGEST_TOKEN=token):
+                response = self.client.post('/prices/ingest', body, content_type='text/csv', **headers)
+            self.assertEqual(response.status_code, 403, (token, headers))
+        self.assertEqual(self.prices(), prices)
+
+    @override_settings(PRICES_INGEST_TOKEN='secret')
+    def test_invalid_prices_are_rejected_as_a_whole(self):
+        prices = self.prices()
+        for body, content_type, code in [
+            ("SENRK,CNNBO,2016-01-40,1000\n", 'text/csv', ErrorReason.INVALID_PRICES),
+            ("SENRK,CNNBO,2016-01-04\n", 'text/csv', ErrorReason.INVALID_PRICES),
+            ("[1, 2]\n", 'application/x-ndjson', ErrorReason.INVALID_PRICES),
+            ("{}", 'application/json', ErrorReason.INVALID_PRICES_FORMAT),
+        ]:
+            response = self.client.post('/prices/ingest', body, content_type=content_type, HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['code'], str(code))
+        self.assertEqual(self.prices(), prices)
+
+    def test_chunks_reader(self):
+        reader = ChunksReader(['ab', 'cde', '', 'f'])
+        self.assertEqual([reader.read(4), reader.read(4), reader.read(4)], ['abcd', 'ef', ''])
+        self.assertEqual(ChunksReader(['ab', 'c']).read(), 'abc')
@@ -0,0 +1,247 @@
+import datetime
+import os
+import random
+import tempfile
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, override_settings
+
+from app.cache import rates_cache
+from app.engine import RatesSnapshot, round_average
+from app.queries import Granularity
+from app.repository import MemoryPrices, Prices, catalogue, memory_prices, prices_version
+from app.series import fill_dates
+from app.tests.fixtures import RatesTestCase
+
+
+ORIGINS, DESTINATIONS = ['SENRK', 'SESOE', 'SEMMA', 'NOMAY'], ['CNNBO', 'CNYAT', 'CNSNZ']
+
+LANES = [
+    ('SENRK', 'CNNBO'), ('CNNBO', 'SENRK'), ('SENRK', 'china_east_main'), ('stockholm_area', 'CNYAT'),
+    ('scandinavia', 'china_main'), ('northern_europe', 'china_south_main'), ('SENRK', 'FRANT'),
+]
+
+GRANULARITIES = [Granularity.DAY, Granularity('week'), Granularity('month'), Granularity('day', 10)]
+
+
+def day(month: int, number: int) -> datetime.date:
+    return datetime.date(2016, month, number)
+
+
+class RatesSnapshotTestCase(SimpleTestCase):
+
+    def test_round_average(self):
+        sums, counts = np.array([5, 7, 8, -5, -7, 0, 10]), np.array([2, 2, 3, 2, 2, 4, 4])
+        # 2.5, 3.5, 2.67, -2.5, -3.5, 0, 2.5
+        self.assertEqual(round_average(sums, counts).tolist(), [3, 4, 3, -3, -4, 0, 3])
+
+    def test_sparse_rates(self):
+        snapshot = RatesSnapshot.from_rows([
+            [('A', 'B', 16802, 3000, 3), ('A', 'C', 16802, 40, 1)],
+            [('A', 'B', 16801, 2005, 2), ('D', 'B', 16804, 900, 3), ('B', 'A', 16802, 7, 1)],
+        ])
+        self.assertEqual(len(snapshot), 5)
+        self.assertEqual(snapshot.sparse_rates(['A'], ['B']), (
+            [(day(1, 1), 1003, 2), (day(1, 2), 1000, 3)], day(1, 1), day(1, 2)
+        ))
+        self.assertEqual(snapshot.sparse_rates(['A', 'D', 'X'], ['B', 'C']), (
+            [(day(1, 1), 1003, 2), (day(1, 2), 760, 4), (day(1, 4), 300, 3)], day(1, 1), day(1, 4)
+        ))
+        self.assertEqual(
+            snapshot.sparse_rates(['A', 'D'], ['B'], date_from=day(1, 2), page=1, page_size=1),
+            ([(day(1, 2), 1000, 3)], day(1, 2), day(1, 4))
+        )
+        self.assertEqual(
+            snapshot.sparse_rates(['A', 'D'], ['B'], granularity=Granularity('day', 2)),
+            ([(day(1, 1), 1001, 5), (day(1, 3), 300, 3)], day(1, 1), day(1, 4))
+        )
+        self.assertEqual(snapshot.sparse_rates(['A'], ['B'], page=2, page_size=2), ([], day(1, 1), day(1, 2)))
+        self.assertEqual(snapshot.sparse_rates(['A'], ['D']), ([], None, None))
+        self.assertEqual(snapshot.sparse_rates(['X'], ['B']), ([], None, None))
+        self.assertEqual(snapshot.sparse_rates(['A'], ['B'], date_from=day(1, 3)), ([], None, None))
+        self.assertEqual(RatesSnapshot.from_rows([]).sparse_rates(['A'], ['B']), ([], None, None))
+
+    def test_snapshot_file(self):
+        snapshot = RatesSnapshot.from_rows(
+            [[('A', 'B', 16802, 3000, 3), ('A', 'C', 16802, 40, 1), ('A', 'B', 16801, 2005, 2)]],
+            (7, datetime.datetime(2016, 1, 3, tzinfo=datetime.timezone.utc)), {"catalogue": {"version": "v1"}}
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rates.snap')
+            snapshot.write(path)
+            mapped = RatesSnapshot.open(path)
+            self.assertEqual((mapped.version, mapped.metadata, mapped.codes), (snapshot.version, snapshot.metadata, snapshot.codes))
+            for name in ('keys', 'days', 'sums', 'counts'):
+                np.testing.assert_array_equal(getattr(mapped, name), getattr(snapshot, name))
+                self.assertFalse(getattr(mapped, name).flags.writeable)
+            self.assertEqual(mapped.sparse_rates(['A'], ['B', 'C']), snapshot.sparse_rates(['A'], ['B', 'C']))
+
+            # Replacing the file leaves the mapped snapshot intact.
+            RatesSnapshot.from_rows([]).write(path)
+            self.assertEqual(len(RatesSnapshot.open(path)), 0)
+            self.assertEqual(mapped.sparse_rates(['A'], ['B'])[0], [(day(1, 1), 1003, 2), (day(1, 2), 1000, 3)])
+            self.assertEqual(os.listdir(directory), ['rates.snap'])
+
+            with open(path, 'wb') as snapshot_file:
+                snapshot_file.write(b'not a snapshot')
+            with self.assertRaises(ValueError):
+                RatesSnapshot.open(path)
+
+
+@override_settings(DATA_VERSION_POLL_INTERVAL=0)
+class MemoryEngineTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        rnd = random.Random(21)
+        start = datetime.date(2016, 1, 1)
+        # Sparse prices with a few repeated lane days, so averages hit halves and days have 1 to many prices.
+        prices = [
+            (rnd.choice(ORIGINS), rnd.choice(DESTINATIONS), start + datetime.timedelta(days=rnd.randint(0, 120)), rnd.randint(900, 1500))
+            for _ in range(400)
+        ]
+        prices += [('SENRK', 'CNNBO', day(1, 5), 1000), ('SENRK', 'CNNBO', day(1, 5), 1001)] * 2
+        with connection.cursor() as cursor:
+            cursor.executemany("INSERT INTO prices VALUES (%s, %s, %s, %s)", prices)
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+
+    def setUp(self) -> None:
+        super().setUp()
+        memory_prices.invalidate()
+
+    def tearDown(self) -> None:
+        memory_prices.invalidate()
+        super().tearDown()
+
+    @staticmethod
+    def fetch(engine, origin, destination, date_from, date_to, page, page_size, granularity):
+        with override_settings(RATES_ENGINE=engine):
+            sparse = Prices.fetch_sparse_rates(origin, destination, date_from, date_to, page_size, page, granularity)
+        return fill_dates(sparse["rows"], sparse["min_date"], sparse["max_date"], page, page_size, False, granularity)
+
+    def assertEnginesMatch(self):
+        for origin, destination in LANES:
+            for date_from, date_to in [(None, None), (day(1, 5), day(3, 20)), (day(2, 1), day(2, 29))]:
+                for granularity in GRANULARITIES:
+                    for page, page_size in [(None, None), (1, 10), (3, 7), (50, 10)]:
+                        args = (origin, destination, date_from, date_to, page, page_size, granularity)
+                        self.assertEqual(self.fetch('memory', *args), self.fetch('sql', *args), args)
+
+    def test_matches_sql(self):
+        self.assertEnginesMatch()
+        # The repeated lane day averages 1000.5, rounded up like Postgres does.
+        self.assertEqual(
+            self.fetch('memory', 'SENRK', 'CNNBO', day(1, 5), day(1, 5), None, None, Granularity.DAY),
+            ([(day(1, 5), 1001.0)], 1)
+        )
+
+    def test_matches_sql_from_rollup(self):
+        call_command('refresh_rollup', '--install', stdout=StringIO())
+        with override_settings(RATES_USE_ROLLUP=True):
+            self.assertEnginesMatch()
+
+    def test_rates_view(self):
+        params = {'origin': 'scandinavia', 'destination': 'china_main', 'date_from': '2016-01-10', 'date_to': '2016-04-01'}
+        for extra in ({}, {'page': 2, 'page_size': 20}, {'granularity': 'week'}):
+            with override_settings(RATES_ENGINE='sql'):
+                expected = self.client.get('/rates/', {**params, **extra})
+            rates_cache.clear()
+            with override_settings(RATES_ENGINE='memory'):
+                response = self.client.get('/rates/', {**params, **extra})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), expected.json())
+            self.assertEqual(response['max_count'], expected['max_count'])
+
+    def test_reloads_on_new_prices(self):
+        snapshot = memory_prices.snapshot()
+        self.assertIs(memory_prices.snapshot(), snapshot)
+
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-06-01', 100), ('NOMAY', 'CNSNZ', '2016-06-01', 100)")
+        self.assertIsNot(memory_prices.snapshot(), snapshot)
+        self.assertEqual(len(memory_prices.snapshot()), len(snapshot) + 2)
+        self.assertEnginesMatch()
+
+    def test_reloads_on_rollup_refresh(self):
+        call_command('refresh_rollup', '--install', stdout=StringIO())
+        with override_settings(RATES_USE_ROLLUP=True):
+            snapshot = memory_prices.snapshot()
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-06-01', 100)")
+            # The new prices are only in the rollup once it is refreshed.
+            self.assertEqual(len(memory_prices.snapshot()), len(snapshot))
+            call_command('refresh_rollup', stdout=StringIO())
+            self.assertEqual(len(memory_prices.snapshot()), len(snapshot) + 1)
+            self.assertEnginesMatch()
+
+    def test_falls_back_to_sql_without_data_version(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER prices_data_version ON prices")
+            cursor.execute("DROP TABLE data_version")
+        prices_version.invalidate()
+        with self.assertLogs('app.repository', 'WARNING'):
+            self.assertIsNone(memory_prices.snapshot())
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-06-01', 100)")
+        self.assertEqual(
+            self.fetch('memory', 'SENRK', 'CNNBO', day(6, 1), day(6, 1), None, None, Granularity.DAY), ([(day(6, 1), None)], 1)
+        )
+
+    def test_snapshot_file_seeds_the_catalogue_from_region_ports(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM region_ports WHERE region_slug = 'scandinavia' AND port_code = 'NOMAY'")
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            RATES_SNAPSHOT_PATH=os.path.join(directory, 'rates.snap')
+        ):
+            call_command('build_snapshot', stdout=StringIO())
+            catalogue.invalidate()
+            memory_prices.map_file()
+            self.assertNotIn('NOMAY', catalogue.port_codes('scandinavia', refresh=False))
+            self.assertIn('SENRK', catalogue.port_codes('scandinavia', refresh=False))
+
+    def test_snapshot_file(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            RATES_SNAPSHOT_PATH=os.path.join(directory, 'rates.snap')
+        ):
+            call_command('build_snapshot', stdout=StringIO())
+            out = StringIO()
+            call_command('build_snapshot', '--if-stale', stdout=out)
+            self.assertIn('up to date', out.getvalue())
+
+            # Mapping the file seeds the catalogue without querying it.
+            catalogue.invalidate()
+            with self.assertNumQueries(0):
+                mapped = memory_prices.map_file()
+            self.assertEqual(catalogue.get_version(refresh=False), mapped.metadata["catalogue"]["version"])
+            self.assertIs(memory_prices.snapshot(), mapped)
+            self.assertEnginesMatch()
+
+            # A stale file is not used, the database serves the rates until it is rebuilt, then the
+            # workers switch to the new file.
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-06-01', 100)")
+            self.assertIsNone(memory_prices.snapshot())
+            self.assertEnginesMatch()
+
+            call_command('build_snapshot', '--if-stale', stdout=StringIO())
+            self.assertIsNot(memory_prices.map_file(), mapped)
+            self.assertIs(memory_prices.snapshot(), memory_prices.map_file())
+            self.assertEqual(len(memory_prices.snapshot()), len(mapped) + 1)
+            self.assertEnginesMatch()
+
+    def test_watch_survives_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rates.snap')
+            with mock.patch.object(MemoryPrices, 'build', side_effect=[OperationalError('connection lost'), MemoryPrices.build()]), \
+                    mock.patch('app.management.commands.build_snapshot.time.sleep', side_effect=[None, None, KeyboardInterrupt]), \
+                    self.assertLogs('app.management.commands.build_snapshot', 'ERROR') as logs:
+                with self.assertRaises(KeyboardInterrupt):
+                    call_command('build_snapshot', '--path', path, '--watch', '60', stdout=StringIO())
+            self.assertIn('connection lost', logs.output[0])
+            self.assertTrue(MemoryPrices.is_current(RatesSnapshot.open(path)))
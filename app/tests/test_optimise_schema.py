@@ -0,0 +1,44 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+
+from app.queries import schema_optimisation_steps
+from app.repository import Repository, SchemaOptimisations
+from app.tests.fixtures import RatesTestCase
+
+
+class OptimiseSchemaTestCase(RatesTestCase):
+
+    def test_applies_steps_once(self):
+        self.assertEqual(SchemaOptimisations.pending(), [version for version, _ in schema_optimisation_steps])
+
+        out = StringIO()
+        call_command('optimise_schema', '--lane', 'stockholm_area:china_main', '--lane', 'SENRK:CNNBO', stdout=out)
+        self.assertIn('Applied 0001_prices_lane_day_index', out.getvalue())
+        self.assertIn('stockholm_area -> china_main', out.getvalue())
+        self.assertEqual(SchemaOptimisations.pending(), [])
+
+        indexes = {
+            name for name, in Repository.fetch_all(
+                "select indexname from pg_indexes where tablename in ('prices', 'ports', 'regions')"
+            )
+        }
+        self.assertTrue({
+            'prices_orig_dest_day_idx', 'ports_pkey', 'regions_pkey',
+            'ports_parent_slug_idx', 'regions_parent_slug_idx'
+        } <= indexes)
+
+        out = StringIO()
+        call_command('optimise_schema', '--no-explain', stdout=out)
+        self.assertIn('Schema is up to date', out.getvalue())
+
+    def test_steps_are_idempotent(self):
+        # Keys that already exist, as in `ratestask/rates.sql`, are left alone.
+        with connection.cursor() as cursor:
+            cursor.execute("alter table ports add constraint ports_pkey primary key (code)")
+            for _, queries in schema_optimisation_steps:
+                for query in queries:
+                    cursor.execute(query)
+
+        self.assertEqual(SchemaOptimisations.apply(), [version for version, _ in schema_optimisation_steps])
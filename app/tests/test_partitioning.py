@@ -0,0 +1,193 @@
+import datetime
+import json
+import random
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.db import IntegrityError, connection, transaction
+
+from app import service as rate_service
+from app.queries import RateQuery
+from app.repository import PricePartitions, Repository, catalogue, prepared_statements
+from app.tests.fixtures import RatesTestCase, add_keys
+
+
+def prices():
+    return Repository.fetch_all("select orig_code, dest_code, day, price from prices order by 1, 2, 3, 4")
+
+
+def scanned_relations(plan: dict) -> set:
+    """
+    Tables and partitions a plan actually read, the pruned ones are either removed from the plan
+    or never executed.
+    """
+    relations = set()
+    if 'Relation Name' in plan and plan.get('Actual Loops', 1) > 0:
+        relations.add(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        relations |= scanned_relations(child)
+    return relations
+
+
+@override_settings(RATES_CACHE={'ENABLED': False})
+class PricePartitionsTestCase(RatesTestCase):
+
+    foreign_keys = False
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        rnd = random.Random(20)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO prices VALUES (%s, %s, %s, %s)",
+                [
+                    (
+                        rnd.choice(['SENRK', 'SESOE', 'SEMMA']), rnd.choice(['CNNBO', 'CNYAT']),
+                        datetime.date(2016, 1, 1) + datetime.timedelta(days=rnd.randint(0, 120)), rnd.randint(900, 1500)
+                    )
+                    for _ in range(400)
+                ]
+            )
+            if cls.foreign_keys:
+                add_keys(cursor)
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+        call_command('refresh_rollup', '--install', stdout=StringIO())
+
+    def rates(self):
+        return [
+            rate_service.get_rates_with_dates_filled(origin, destination, date_from, date_to, page_size, page)
+            for origin, destination in [('SENRK', 'CNNBO'), ('stockholm_area', 'china_main')]
+            for date_from, date_to, page_size, page in [(None, None, None, None), ('2016-02-10', '2016-03-20', 5, 2)]
+        ]
+
+    def test_converts_online_keeping_the_concurrent_writes(self):
+        months = PricePartitions.prepare(datetime.date(2016, 5, 20), months_ahead=2)
+        self.assertEqual(months, [datetime.date(2016, month, 1) for month in (1, 2, 3, 4)])
+
+        with connection.cursor() as cursor:
+            # Written before and after their month is backfilled, including a month without any prices yet.
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-02-03', 1000), ('SENRK', 'CNNBO', '2016-02-03', 1000)")
+            cursor.execute("DELETE FROM prices WHERE ctid = (SELECT ctid FROM prices WHERE day = '2016-01-15' LIMIT 1)")
+            PricePartitions.backfill(months[0])
+            PricePartitions.backfill(months[1])
+            cursor.execute("UPDATE prices SET day = day + 31, price = price + 1 WHERE day = '2016-01-20'")
+            cursor.execute("DELETE FROM prices WHERE ctid = (SELECT ctid FROM prices WHERE day = '2016-02-03' LIMIT 1)")
+            cursor.execute("INSERT INTO prices VALUES ('SEMMA', 'CNYAT', '2016-09-01', 1200)")
+            for month in months[2:]:
+                PricePartitions.backfill(month)
+            cursor.execute("INSERT INTO prices VALUES ('SEMMA', 'CNYAT', '2016-03-03', 1300)")
+
+        expected, expected_rates = prices(), self.rates()
+        self.assertEqual(
+            sorted(PricePartitions.swap()),
+            ['prices_daily_delete', 'prices_daily_insert', 'prices_daily_truncate', 'prices_daily_update', 'prices_data_version']
+        )
+
+        self.assertTrue(PricePartitions.is_partitioned())
+        self.assertEqual(prices(), expected)
+        self.assertEqual(self.rates(), expected_rates)
+        self.assertEqual(
+            PricePartitions.partitions(),
+            ['prices_default'] + [f'prices_p2016_{month:02d}' for month in range(1, 8)]
+        )
+        self.assertEqual(Repository.fetch_all("select count(*) from prices_default"), [(1,)])
+        self.assertEqual(Repository.fetch_all("select count(*) from prices_unpartitioned"), [(len(expected),)])
+
+        # The triggers moved over: writes bump the data version and queue the rollup days.
+        version = Repository.fetch_one("select version from data_version where name = 'prices'")
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-01-02', 1100)")
+            cursor.execute("DELETE FROM prices WHERE day = '2016-01-02' AND price = 1100")
+        self.assertEqual(Repository.fetch_one("select version from data_version where name = 'prices'"), version + 2)
+        call_command('refresh_rollup', stdout=StringIO())
+        self.assertEqual(
+            Repository.fetch_all("select sum(sum_price), sum(n_prices) from prices_daily"),
+            Repository.fetch_all("select sum(price), count(*) from prices")
+        )
+
+    def test_command_converts_then_creates_the_coming_partitions(self):
+        before, expected = self.rates(), prices()
+        out = StringIO()
+        call_command('partition_prices', '--today', '2016-04-10', '--months-ahead', '1', '--drop-old', stdout=out)
+        self.assertIn("backfilling 4 months", out.getvalue())
+        self.assertEqual(prices(), expected)
+        self.assertEqual(self.rates(), before)
+        self.assertIsNone(Repository.fetch_one("select to_regclass('prices_unpartitioned')"))
+
+        # Prices of a month without a partition go to the default partition until it is created.
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-07-02', 1000)")
+        out = StringIO()
+        call_command('partition_prices', '--today', '2016-06-15', '--months-ahead', '2', stdout=out)
+        self.assertEqual(out.getvalue().split('\n')[:3], [
+            "Created the partition of 2016-06", "Created the partition of 2016-07", "Created the partition of 2016-08"
+        ])
+        self.assertEqual(Repository.fetch_all("select count(*) from prices_default"), [(0,)])
+        self.assertEqual(Repository.fetch_all("select count(*) from prices_p2016_07"), [(1,)])
+
+        call_command('partition_prices', '--today', '2016-06-15', '--months-ahead', '2', stdout=out)
+        self.assertIn("The partitions are up to date.", out.getvalue())
+
+    def test_ingestion_creates_the_partitions_of_its_months(self):
+        call_command('partition_prices', '--today', '2016-04-10', '--months-ahead', '0', stdout=StringIO())
+        rate_service.ingest_prices(['SENRK,CNNBO,2017-02-01,1000\n', 'SENRK,CNNBO,2017-02-02,1000\n'], 'csv')
+        self.assertIn('prices_p2017_02', PricePartitions.partitions())
+        self.assertEqual(Repository.fetch_all("select count(*) from prices_p2017_02"), [(2,)])
+        self.assertEqual(Repository.fetch_all("select count(*) from prices_default"), [(0,)])
+
+    def test_date_filters_prune_the_partitions(self):
+        call_command('partition_prices', '--today', '2016-04-10', '--months-ahead', '1', stdout=StringIO())
+        catalogue.invalidate()
+
+        rate_query = RateQuery().add_port_codes_filter(
+            catalogue.port_codes('stockholm_area'), catalogue.port_codes('china_main')
+        ).add_dates_filter('2016-02-05', '2016-02-25').add_pagination_params(2, 5).add_ordering('dd')
+        for query, params in [rate_query.sparse_query, rate_query.cursor_query]:
+            plan = Repository.explain_analyze(query, params)
+            self.assertEqual(scanned_relations(plan['Plan']), {'prices_p2016_02'}, query)
+
+        # Also with the bounds bound as parameters of a generic plan of a prepared statement.
+        query, params = rate_query.sparse_query
+        with connection.cursor() as cursor:
+            cursor.execute("set local plan_cache_mode = force_generic_plan")
+            prepared_statements.execute(cursor, query, params)
+            name = prepared_statements.statement_name(query)
+            cursor.execute(
+                f"EXPLAIN (ANALYZE, FORMAT JSON) EXECUTE {name} ({', '.join(['%s'] * len(params))})", params
+            )
+            plan = cursor.fetchone()[0]
+            plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+        self.assertEqual(scanned_relations(plan['Plan']), {'prices_p2016_02'})
+
+
+class ForeignKeysPricePartitionsTestCase(PricePartitionsTestCase):
+    """
+        Same conversion of a `prices` table with the foreign keys of `ratestask/rates.sql`.
+    """
+
+    foreign_keys = True
+
+    def assertEnforcesForeignKeys(self):
+        self.assertEqual(
+            [name for name, _ in Repository.fetch_all("select conname, 1 from pg_constraint where conrelid = 'prices'::regclass and contype = 'f' order by 1")],
+            ['prices_dest_code_fkey', 'prices_orig_code_fkey']
+        )
+        for orig_code, dest_code in [('XXXXX', 'CNNBO'), ('SENRK', 'XXXXX')]:
+            with self.assertRaises(IntegrityError), transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("INSERT INTO prices VALUES (%s, %s, '2016-02-01', 1000)", [orig_code, dest_code])
+
+    def test_keeps_the_foreign_keys(self):
+        call_command('partition_prices', '--today', '2016-04-10', '--months-ahead', '1', '--drop-old', stdout=StringIO())
+        self.assertTrue(PricePartitions.is_partitioned())
+        self.assertEnforcesForeignKeys()
+
+    def test_swap_adds_the_foreign_keys_missing_on_the_copy(self):
+        for month in PricePartitions.prepare(datetime.date(2016, 4, 10), months_ahead=0):
+            PricePartitions.backfill(month)
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE prices_partitioned DROP CONSTRAINT prices_orig_code_fkey")
+        PricePartitions.swap(drop_old=True)
+        self.assertEnforcesForeignKeys()
@@ -0,0 +1,75 @@
+import datetime
+
+from django.test import override_settings
+from django.db import connection
+
+from app import service as rate_service
+from app.queries import RateQuery
+from app.repository import Port, Repository, catalogue, prepared_statements
+from app.tests.fixtures import RatesTestCase
+
+
+class PreparedStatementsTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                    INSERT INTO public.prices (orig_code,dest_code,"day",price) VALUES
+                    ('SENRK','CNNBO','2016-01-01',1244),
+                    ('SENRK','CNNBO','2016-01-01',1044),
+                    ('SENRK','CNNBO','2016-01-01',944),
+                    ('SEMMA','CNYAT','2016-01-02',1224);
+                """
+            )
+
+    def prepared_statements(self):
+        return {
+            name: calls for name, calls in Repository.fetch_all(
+                "select name, generic_plans + custom_plans from pg_prepared_statements"
+            )
+        }
+
+    def test_query_shape_does_not_depend_on_values(self):
+        first = RateQuery().add_port_codes_filter({'SENRK'}, {'CNNBO'}).add_dates_filter(
+            '2016-01-01', '2016-01-31'
+        ).add_pagination_params(1, 10).add_ordering('dd')
+        second = RateQuery().add_port_codes_filter({'SENRK', 'SESOE', 'SEMMA'}, set()).add_dates_filter(
+            datetime.datetime(2017, 2, 1), datetime.date(2017, 3, 1)
+        ).add_pagination_params(3, 20).add_ordering('dd')
+
+        self.assertEqual(first.query[0], second.query[0])
+        self.assertEqual(
+            second.query[1],
+            [['SEMMA', 'SENRK', 'SESOE'], [], datetime.date(2017, 2, 1), datetime.date(2017, 3, 1), 20, 40]
+        )
+
+    @override_settings(RATES_CACHE={'ENABLED': False})
+    def test_statements_are_prepared_once_per_connection(self):
+        for _ in range(3):
+            r = rate_service.get_rates('stockholm_area', 'china_main', '2016-01-01', '2016-01-31')
+            self.assertEqual(
+                list(r['rates']), [
+                    {'day': datetime.date(2016, 1, 1), 'average_price': 1077.0},
+                ]
+            )
+        rate_query = RateQuery().add_port_codes_filter(
+            catalogue.port_codes('stockholm_area'), catalogue.port_codes('china_main')
+        ).add_dates_filter('2016-01-01', '2016-01-31').add_pagination_params(1, 10).add_ordering('dd')
+        name = prepared_statements.statement_name(rate_query.sparse_query[0])
+        self.assertGreaterEqual(self.prepared_statements()[name], 3)
+
+    def test_values_are_not_interpolated(self):
+        self.assertIsNone(Port.exists("' or '1'='1"))
+        self.assertTrue(Port.exists('SENRK'))
+
+    def test_recursive_region_filter_is_parameterized(self):
+        rate_query = RateQuery().add_source_destination_filter(
+            'scandinavia', 'CNNBO'
+        ).add_ordering('dd')
+        self.assertEqual(
+            Repository.fetch_all(*rate_query.query), [(datetime.date(2016, 1, 1), 1077)]
+        )
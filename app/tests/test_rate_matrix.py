@@ -0,0 +1,105 @@
+import datetime
+import random
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+
+from app.exception import ErrorReason
+from app.repository import catalogue
+from app.tests.fixtures import RatesTestCase
+
+
+ORIGINS, DESTINATIONS = ['SENRK', 'SESOE', 'SEMMA', 'FRANT'], ['CNNBO', 'CNYAT', 'CNSNZ']
+
+
+class RateMatrixTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        rnd = random.Random(23)
+        start = datetime.date(2016, 1, 1)
+        cls.prices = [
+            (rnd.choice(ORIGINS), rnd.choice(DESTINATIONS), start + datetime.timedelta(days=rnd.randint(0, 20)), rnd.randint(900, 1500))
+            for _ in range(150)
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany("INSERT INTO prices VALUES (%s, %s, %s, %s)", cls.prices)
+
+    def expected(self, origin, destination, date_from, date_to, by_day=False) -> dict:
+        """
+        The matrix computed from the raw prices.
+        """
+        origins, destinations = catalogue.port_codes(origin), catalogue.port_codes(destination)
+        groups = defaultdict(list)
+        for orig_code, dest_code, day, price in self.prices:
+            if orig_code in origins and dest_code in destinations and date_from <= day <= date_to:
+                groups[(orig_code, dest_code, day.isoformat()) if by_day else (orig_code, dest_code)].append(price)
+
+        names = ('orig_code', 'dest_code', 'day') if by_day else ('orig_code', 'dest_code')
+        columns = {name: [] for name in names + ('average_price', 'count')}
+        for key in sorted(groups):
+            prices = groups[key]
+            for name, value in zip(names, key):
+                columns[name].append(value)
+            columns['average_price'].append(float(
+                (Decimal(sum(prices)) / len(prices)).quantize(Decimal(1), ROUND_HALF_UP)
+            ) if len(prices) >= 3 else None)
+            columns['count'].append(len(prices))
+        return columns
+
+    def get(self, origin, destination, **params):
+        return self.client.get('/rates/matrix/', {'origin': origin, 'destination': destination, **params})
+
+    def assertMatrixMatchesRawPrices(self):
+        for origin, destination in [('scandinavia', 'china_main'), ('northern_europe', 'CNNBO'), ('SENRK', 'CNYAT')]:
+            for date_from, date_to in [('2016-01-01', '2016-01-31'), ('2016-01-05', '2016-01-09')]:
+                for by_day in (False, True):
+                    response = self.get(origin, destination, date_from=date_from, date_to=date_to, by_day=str(by_day).lower())
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.json(), self.expected(
+                        origin, destination, datetime.date.fromisoformat(date_from), datetime.date.fromisoformat(date_to), by_day
+                    ), (origin, destination, date_from, date_to, by_day))
+
+    def test_matrix_matches_raw_prices(self):
+        self.assertMatrixMatchesRawPrices()
+        response = self.get('northern_europe', 'china_main')
+        self.assertEqual(len(response.json()['orig_code']), len(ORIGINS) * len(DESTINATIONS))
+        self.assertEqual(sum(response.json()['count']), len(self.prices))
+
+    def test_matrix_from_rollup_matches_raw_prices(self):
+        call_command('refresh_rollup', '--install', stdout=StringIO())
+        with override_settings(RATES_USE_ROLLUP=True):
+            self.assertMatrixMatchesRawPrices()
+
+    def test_one_query(self):
+        # Warms the catalogue and the prepared statement up.
+        dates = {'date_from': '2016-01-01', 'date_to': '2016-01-31'}
+        self.get('scandinavia', 'china_main', by_day='1', **dates)
+        with self.assertNumQueries(1):
+            self.get('northern_europe', 'china_main', by_day='1', **dates)
+
+    def test_no_prices(self):
+        self.assertEqual(
+            self.get('scandinavia', 'china_main', date_from='2017-01-01').json(),
+            {'orig_code': [], 'dest_code': [], 'average_price': [], 'count': []}
+        )
+
+    def test_validation(self):
+        for params, code in [
+            ({'origin': 'scandinavia'}, ErrorReason.ENPOINTS_REQUIRED),
+            ({'origin': 'scandinavia', 'destination': 'atlantis'}, ErrorReason.ENDPOINT_NOT_FOUND),
+            ({'origin': 'scandinavia', 'destination': 'china_main', 'date_from': '2016-02-01', 'date_to': '2016-01-01'}, ErrorReason.INVALID_DATES),
+            ({'origin': 'scandinavia', 'destination': 'china_main', 'by_day': 'yes please'}, ErrorReason.INVALID_BY_DAY),
+            ({'origin': 'scandinavia', 'destination': 'china_main', 'by_day': 'true'}, ErrorReason.INVALID_MATRIX_RANGE),
+            ({'origin': 'scandinavia', 'destination': 'china_main', 'by_day': 'true', 'date_from': '2016-01-01'}, ErrorReason.INVALID_MATRIX_RANGE),
+            ({'origin': 'scandinavia', 'destination': 'china_main', 'by_day': 'true', 'date_from': '2016-01-01', 'date_to': '2016-02-01'}, ErrorReason.INVALID_MATRIX_RANGE),
+        ]:
+            response = self.client.get('/rates/matrix/', params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertEqual(response.json()['code'], str(code), params)
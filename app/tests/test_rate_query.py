@@ -1,77 +1,13 @@
 import datetime
 
-from django.test import TestCase
 from django.db import connection
 
 from app import service as rate_service
+from app.tests.fixtures import RatesTestCase
 
 
-class RateQueryTestCase(TestCase):
-    
-    
-    @classmethod
-    def setUpTestData(cls) -> None:
-        super().setUpTestData()
-        
-        with connection.cursor() as cursor:
-            # Create regions table
-            cursor.execute("""
-                CREATE TABLE regions (
-                    slug text NOT NULL,
-                    name text NOT NULL,
-                    parent_slug text
-                );
-            """) 
-
-            # Create ports table
-            cursor.execute("""
-                CREATE TABLE ports (
-                    code text NOT NULL,
-                    name text NOT NULL,
-                    parent_slug text NOT NULL
-                );
-            """)
-
-            # Create prices table
-            cursor.execute("""
-                CREATE TABLE prices (
-                    orig_code text NOT NULL,
-                    dest_code text NOT NULL,
-                    day date NOT NULL,
-                    price integer NOT NULL
-                );
-            """)
-            
-            cursor.execute(
-                """
-                    INSERT INTO public.regions (slug,"name",parent_slug) VALUES
-                    ('china_main','China Main',NULL),
-                    ('northern_europe','Northern Europe',NULL),
-                    ('scandinavia','Scandinavia','northern_europe'),
-                    ('north_europe_sub','North Europe Sub','northern_europe'),
-                    ('stockholm_area','Stockholm Area','scandinavia'),
-                    ('kattegat','Kattegat','scandinavia'),
-                    ('china_east_main','China East Main','china_main'),
-                    ('china_south_main','China South Main','china_main');
-                """
-            )
+class RateQueryTestCase(RatesTestCase):
 
-            cursor.execute(
-                """
-                INSERT INTO public.ports (code,"name",parent_slug) VALUES
-                ('SENRK','Norrköping','stockholm_area'),
-                ('SESOE','Södertälje','stockholm_area'),
-                ('SEMMA','Malmö','kattegat'),
-                ('DKFRC','Fredericia','kattegat'),
-                ('NOMAY','Måløy','scandinavia'),
-                ('FRANT','Antibes','north_europe_sub'),
-                ('CNCWN','Chiwan','china_south_main'),
-                ('CNSNZ','Shenzhen','china_south_main'),
-                ('CNYAT','Yantai','china_east_main'),
-                ('CNNBO','Ningbo','china_east_main');
-                """
-            )
-    
     def test_if_endpoints_are_regions(self):
         """
             Test price info from,
@@ -176,3 +112,34 @@ class RateQueryTestCase(TestCase):
                 {'day': datetime.date(2016, 1, 1), 'average_price': 1077.0}
             ]
         )        
+
+    def test_count_is_fetched_along_with_the_page(self):
+        """
+            Test the total count of the dense date series, also when the page is past the end.
+        """
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                    INSERT INTO public.prices (orig_code,dest_code,"day",price) VALUES
+                    ('SENRK','CNNBO','2016-01-01',1244),
+                    ('SENRK','CNNBO','2016-01-04',1044),
+                    ('SENRK','CNNBO','2016-01-05',944);
+                """
+            )
+        r = rate_service.get_rates('SENRK', 'CNNBO', page=1, page_size=2)
+        self.assertEqual(
+            list(r['rates']), [
+                {'day': datetime.date(2016, 1, 1), 'average_price': None},
+                {'day': datetime.date(2016, 1, 2), 'average_price': None}
+            ]
+        )
+        self.assertEqual(r['count'], 5)
+
+        r = rate_service.get_rates('SENRK', 'CNNBO', page=4, page_size=2)
+        self.assertEqual(list(r['rates']), [])
+        self.assertEqual(r['count'], 5)
+
+        r = rate_service.get_rates('SENRK', 'CNSNZ')
+        self.assertEqual(list(r['rates']), [])
+        self.assertEqual(r['count'], 0)
@@ -0,0 +1,119 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+
+from app.repository import Catalogue, Repository, RegionClosure, catalogue
+from app.tests.fixtures import RatesTestCase
+
+
+class RegionClosureTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+        with connection.cursor() as cursor:
+            cursor.executemany("INSERT INTO prices VALUES (%s, %s, %s, %s)", [
+                (orig_code, dest_code, datetime.date(2016, 1, day), 1000 + 10 * day + index)
+                for index, (orig_code, dest_code) in enumerate([
+                    ('SENRK', 'CNNBO'), ('SEMMA', 'CNNBO'), ('DKFRC', 'CNYAT'), ('NOMAY', 'CNCWN'), ('FRANT', 'CNSNZ')
+                ])
+                for day in range(1, 6)
+            ])
+        call_command('optimise_schema', '--no-explain', stdout=StringIO())
+
+    @staticmethod
+    def region_ports(region_slug: str) -> set:
+        return {code for code, in Repository.fetch_all(
+            "select port_code from region_ports where region_slug = %s", [region_slug]
+        )}
+
+    @staticmethod
+    def descendants(region_slug: str) -> dict:
+        return dict(Repository.fetch_all(
+            "select descendant_slug, depth from region_closure where ancestor_slug = %s", [region_slug]
+        ))
+
+    def assertMatchesCatalogue(self):
+        # The tree walked in Python, the shared catalogue reads `region_ports` once it is installed.
+        walked = Catalogue()
+        walked.load(
+            None, Repository.fetch_all("select slug, parent_slug from regions"),
+            Repository.fetch_all("select code, parent_slug from ports")
+        )
+        catalogue.invalidate()
+        for region_slug, in Repository.fetch_all("select slug from regions"):
+            self.assertEqual(self.region_ports(region_slug), set(walked.port_codes(region_slug, refresh=False)), region_slug)
+            self.assertEqual(self.region_ports(region_slug), set(catalogue.port_codes(region_slug)), region_slug)
+
+    def test_closure(self):
+        self.assertTrue(RegionClosure.installed())
+        self.assertEqual(self.descendants('northern_europe'), {
+            'northern_europe': 0, 'scandinavia': 1, 'north_europe_sub': 1, 'stockholm_area': 2, 'kattegat': 2
+        })
+        self.assertEqual(self.descendants('kattegat'), {'kattegat': 0})
+        self.assertEqual(self.region_ports('scandinavia'), {'SENRK', 'SESOE', 'SEMMA', 'DKFRC', 'NOMAY'})
+        self.assertMatchesCatalogue()
+
+    def test_reparenting_a_region(self):
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE regions SET parent_slug = 'china_main' WHERE slug = 'kattegat'")
+        self.assertEqual(self.descendants('china_main')['kattegat'], 1)
+        self.assertNotIn('kattegat', self.descendants('northern_europe'))
+        self.assertEqual(self.region_ports('scandinavia'), {'SENRK', 'SESOE', 'NOMAY'})
+        self.assertLessEqual({'SEMMA', 'DKFRC'}, self.region_ports('china_main'))
+        self.assertMatchesCatalogue()
+
+        # A subtree moved under a new region, at any depth.
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO regions VALUES ('baltic', 'Baltic', 'stockholm_area')")
+            cursor.execute("UPDATE regions SET parent_slug = 'baltic' WHERE slug = 'china_east_main'")
+        self.assertEqual(self.descendants('northern_europe')['china_east_main'], 4)
+        self.assertLessEqual({'CNYAT', 'CNNBO'}, self.region_ports('northern_europe'))
+        self.assertNotIn('CNNBO', self.region_ports('china_main'))
+        self.assertMatchesCatalogue()
+
+    def test_adding_and_removing_ports(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO ports VALUES ('SEGOT', 'Göteborg', 'kattegat'), ('CNSHA', 'Shanghai', 'china_main')")
+        self.assertIn('SEGOT', self.region_ports('kattegat'))
+        self.assertIn('SEGOT', self.region_ports('northern_europe'))
+        self.assertIn('CNSHA', self.region_ports('china_main'))
+        self.assertNotIn('CNSHA', self.region_ports('china_east_main'))
+        self.assertMatchesCatalogue()
+
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM ports WHERE code = 'SEGOT'")
+            cursor.execute("UPDATE ports SET parent_slug = 'north_europe_sub' WHERE code = 'SENRK'")
+        self.assertNotIn('SEGOT', self.region_ports('northern_europe'))
+        self.assertEqual(self.region_ports('stockholm_area'), {'SESOE'})
+        self.assertIn('SENRK', self.region_ports('north_europe_sub'))
+        self.assertMatchesCatalogue()
+
+    def test_cycles_terminate(self):
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE regions SET parent_slug = 'kattegat' WHERE slug = 'northern_europe'")
+        self.assertEqual(set(self.descendants('kattegat')), set(self.descendants('northern_europe')))
+        self.assertMatchesCatalogue()
+
+    def test_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM region_ports")
+        RegionClosure.rebuild()
+        self.assertMatchesCatalogue()
+
+    def test_catalogue_reads_region_ports(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE ports DISABLE TRIGGER USER")
+            cursor.execute("UPDATE ports SET parent_slug = 'china_main' WHERE code = 'NOMAY'")
+            cursor.execute("ALTER TABLE ports ENABLE TRIGGER USER")
+        catalogue.invalidate()
+        self.assertIn('NOMAY', catalogue.port_codes('scandinavia'))
+        self.assertNotIn('NOMAY', catalogue.port_codes('china_main'))
+
+        RegionClosure.rebuild()
+        catalogue.invalidate()
+        self.assertNotIn('NOMAY', catalogue.port_codes('scandinavia'))
+        self.assertIn('NOMAY', catalogue.port_codes('china_main'))
+        self.assertEqual(catalogue.port_codes('kattegat'), {'SEMMA', 'DKFRC'})
@@ -0,0 +1,128 @@
+import csv
+import datetime
+import io
+import json
+import unittest
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+
+from app.renderers import msgpack, pyarrow
+from app.tests.fixtures import RatesTestCase
+
+
+class RatesFormatsTestCase(RatesTestCase):
+
+    params = {
+        'origin': 'stockholm_area', 'destination': 'china_main', 'date_from': '2016-01-01', 'date_to': '2016-01-07'
+    }
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            # 3 prices on the 1st, 2nd and 5th, a single price on the 3rd.
+            cursor.executemany(
+                "INSERT INTO prices VALUES ('SENRK', 'CNNBO', %s, %s)",
+                [(datetime.date(2016, 1, day), 1000 + day + n) for day in (1, 2, 5) for n in range(3)]
+                + [(datetime.date(2016, 1, 3), 1200)]
+            )
+
+    def expected(self, **params):
+        response = self.client.get('/rates/', {**self.params, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(rate['day'], rate['average_price']) for rate in response.json()]
+
+    def test_columnar_json(self):
+        response = self.client.get('/rates/', {**self.params, 'format': 'columnar'})
+        self.assertEqual(response['Content-Type'], 'application/vnd.rates.columnar+json')
+        self.assertEqual(response['max_count'], '5')
+        data = response.json()
+        self.assertEqual(data['avg'][2], None)
+        self.assertEqual(list(zip(data['days'], data['avg'])), self.expected())
+
+    def test_csv_negotiated_with_accept_header(self):
+        response = self.client.get('/rates/', {**self.params, 'page_size': 3, 'page': 2}, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        reader = csv.reader(io.StringIO(response.content.decode()))
+        self.assertEqual(next(reader), ['day', 'average_price'])
+        self.assertEqual(
+            [(day, float(average_price) if average_price else None) for day, average_price in reader],
+            self.expected(page_size=3, page=2)
+        )
+
+    @unittest.skipIf(msgpack is None, "msgpack isn't installed")
+    def test_msgpack(self):
+        response = self.client.get('/rates/', self.params, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        data = msgpack.unpackb(response.content)
+        self.assertEqual(list(zip(data['days'], data['avg'])), self.expected())
+
+    @unittest.skipIf(pyarrow is None, "pyarrow isn't installed")
+    def test_arrow(self):
+        response = self.client.get('/rates/', {**self.params, 'format': 'arrow'})
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.stream')
+        table = pyarrow.ipc.open_stream(response.content).read_all()
+        self.assertEqual(str(table.schema.field('day').type), 'date32[day]')
+        self.assertEqual(
+            [(day.isoformat(), average_price) for day, average_price in zip(*table.to_pydict().values())],
+            self.expected()
+        )
+
+    def test_cursor_pages_return_the_cursors_in_headers(self):
+        response = self.client.get('/rates/', {**self.params, 'format': 'columnar', 'cursor': '', 'page_size': 3})
+        self.assertEqual(response.json()['days'], ['2016-01-01', '2016-01-02', '2016-01-03'])
+        self.assertNotIn('previous_cursor', response)
+
+        response = self.client.get(
+            '/rates/', {**self.params, 'format': 'columnar', 'cursor': response['next_cursor'], 'page_size': 3}
+        )
+        self.assertEqual(response.json()['days'], ['2016-01-04', '2016-01-05'])
+        self.assertIn('previous_cursor', response)
+        self.assertNotIn('next_cursor', response)
+
+    def decode_rows(self, response) -> list:
+        content_type = response['Content-Type'].split(';')[0]
+        if content_type == 'text/csv':
+            reader = csv.reader(io.StringIO(response.content.decode()))
+            next(reader)
+            return [(day, float(average_price) if average_price else None) for day, average_price in reader]
+        if content_type == 'application/vnd.apache.arrow.stream':
+            table = pyarrow.ipc.open_stream(response.content).read_all()
+            return [(day.isoformat(), average_price) for day, average_price in zip(*table.to_pydict().values())]
+        data = msgpack.unpackb(response.content) if content_type == 'application/msgpack' else response.json()
+        return list(zip(data['days'], data['avg']))
+
+    def test_cursor_pages_in_every_format(self):
+        formats = ['columnar', 'csv'] + (['msgpack'] if msgpack else []) + (['arrow'] if pyarrow else [])
+        for format in formats:
+            response = self.client.get('/rates/', {**self.params, 'format': format, 'cursor': '', 'page_size': 3})
+            self.assertEqual(response.status_code, 200, format)
+            self.assertEqual(self.decode_rows(response), self.expected(page_size=3), format)
+
+            response = self.client.get(
+                '/rates/', {**self.params, 'format': format, 'cursor': response['next_cursor'], 'page_size': 3}
+            )
+            self.assertEqual(self.decode_rows(response), self.expected(page_size=3, page=2), format)
+
+    def test_errors_are_rendered_as_json(self):
+        response = self.client.get('/rates/', {**self.params, 'origin': 'atlantis', 'format': 'csv'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()['message'], "Endpoint atlantis doesn't exist.")
+
+    def test_unknown_format_is_not_acceptable(self):
+        response = self.client.get('/rates/', self.params, HTTP_ACCEPT='application/xml')
+        self.assertEqual(response.status_code, 406)
+
+    def test_benchmark_formats_command(self):
+        out = StringIO()
+        call_command(
+            'benchmark_formats', '--origin', 'SENRK', '--destination', 'china_main', '--repeat', '2', stdout=out
+        )
+        report = out.getvalue()
+        self.assertIn('SENRK -> china_main, 5 days', report)
+        for format in ('json', 'columnar', 'csv'):
+            self.assertRegex(report, rf'\n{format} +\d+ ')
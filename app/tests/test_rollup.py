@@ -0,0 +1,87 @@
+import random
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+
+from app.queries import RateQuery
+from app.repository import PriceRollup, Repository, catalogue
+from app.tests.fixtures import RatesTestCase
+
+
+LANES = [
+    ('SENRK', 'CNNBO'),
+    ('scandinavia', 'china_main'),
+    ('stockholm_area', 'china_east_main'),
+    ('northern_europe', 'CNYAT'),
+]
+
+
+class PriceRollupTestCase(RatesTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        call_command('refresh_rollup', '--install', stdout=StringIO())
+
+    def insert_random_prices(self, seed: int, count: int):
+        rnd = random.Random(seed)
+        origins, destinations = ['SENRK', 'SESOE', 'SEMMA', 'NOMAY'], ['CNNBO', 'CNYAT', 'CNSNZ']
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO prices VALUES (%s, %s, %s, %s)",
+                [
+                    (
+                        rnd.choice(origins), rnd.choice(destinations),
+                        f"2016-01-{rnd.randint(1, 20):02d}", rnd.randint(900, 1500)
+                    )
+                    for _ in range(count)
+                ]
+            )
+
+    def fetch(self, origin: str, destination: str, use_rollup: bool):
+        rate_query = RateQuery(use_rollup=use_rollup).add_port_codes_filter(
+            catalogue.port_codes(origin), catalogue.port_codes(destination)
+        ).add_dates_filter(
+            date_from='2016-01-03', date_to='2016-01-18'
+        ).add_ordering('dd')
+        return (
+            Repository.fetch_all(*rate_query.query),
+            Repository.fetch_all_with_bounds(*rate_query.sparse_query)
+        )
+
+    def assertRollupMatchesRawPrices(self):
+        for origin, destination in LANES:
+            raw = self.fetch(origin, destination, use_rollup=False)
+            self.assertTrue(raw[0])
+            self.assertEqual(self.fetch(origin, destination, use_rollup=True), raw)
+
+    def test_full_refresh_matches_raw_prices(self):
+        self.insert_random_prices(seed=1, count=300)
+        PriceRollup.refresh(full=True)
+        self.assertRollupMatchesRawPrices()
+
+    def test_incremental_refresh_only_recomputes_touched_days(self):
+        self.insert_random_prices(seed=2, count=300)
+        PriceRollup.refresh()
+        self.assertRollupMatchesRawPrices()
+
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO prices VALUES ('SENRK', 'CNNBO', '2016-01-05', 1000), ('SENRK', 'CNNBO', '2016-01-05', 1001)")
+            cursor.execute("UPDATE prices SET price = price + 1 WHERE orig_code = 'SEMMA' AND day = '2016-01-07'")
+            cursor.execute("DELETE FROM prices WHERE orig_code = 'NOMAY' AND day = '2016-01-09'")
+            cursor.execute(
+                "select count(*) from (select distinct orig_code, dest_code, day from prices_daily_queue) q"
+            )
+            queued = cursor.fetchone()[0]
+
+        self.assertEqual(PriceRollup.refresh(), queued)
+        self.assertRollupMatchesRawPrices()
+        self.assertEqual(PriceRollup.refresh(), 0)
+
+    def test_truncate_empties_rollup(self):
+        self.insert_random_prices(seed=3, count=50)
+        PriceRollup.refresh()
+
+        with connection.cursor() as cursor:
+            cursor.execute("TRUNCATE prices")
+        self.assertEqual(Repository.fetch_one("select count(*) from prices_daily"), 0)
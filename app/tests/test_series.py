@@ -0,0 +1,90 @@
+import datetime
+import random
+
+from django.test import SimpleTestCase
+from django.db import connection
+
+from app.queries import RateQuery
+from app.repository import Repository, catalogue
+from app.series import fill_batches, fill_dates, page_range
+from app.tests.fixtures import RatesTestCase
+
+
+def day(number: int) -> datetime.date:
+    return datetime.date(2016, 1, number)
+
+
+class FillDatesTestCase(SimpleTestCase):
+
+    rows = [(day(2), 1000, 3), (day(3), 1100, 2), (day(6), 1200, 5)]
+
+    def test_fills_missing_days_and_days_with_too_few_prices(self):
+        self.assertEqual(
+            fill_dates(self.rows, day(2), day(6)),
+            ([(day(2), 1000.0), (day(3), None), (day(4), None), (day(5), None), (day(6), 1200.0)], 5)
+        )
+
+    def test_pages(self):
+        self.assertEqual(fill_dates(self.rows, day(2), day(6), 2, 2), ([(day(4), None), (day(5), None)], 5))
+        self.assertEqual(fill_dates(self.rows, day(2), day(6), 3, 2), ([(day(6), 1200.0)], 5))
+        self.assertEqual(fill_dates(self.rows, day(2), day(6), 4, 2), ([], 5))
+        self.assertEqual(
+            fill_dates(self.rows, day(2), day(6), 1, 2, descending=True), ([(day(6), 1200.0), (day(5), None)], 5)
+        )
+        self.assertEqual(page_range(day(2), day(6), 3, 2, descending=True), (day(2), day(2)))
+        # Only a page size, or only a page, paginates with the defaults.
+        self.assertEqual(page_range(day(1), day(31), None, 5), (day(1), day(5)))
+        self.assertEqual(page_range(day(1), day(31), 2, None), (day(11), day(20)))
+
+    def test_empty_series(self):
+        self.assertEqual(fill_dates([], None, None, 1, 10), ([], 0))
+        self.assertEqual(list(fill_batches([[(None, None, None, None, None)]])), [])
+
+    def test_fills_batches(self):
+        rows = [row + (day(2), day(6)) for row in self.rows]
+        self.assertEqual(
+            list(fill_batches([rows[:1], rows[1:2], rows[2:]])),
+            [[(day(2), 1000.0)], [(day(3), None)], [(day(4), None), (day(5), None), (day(6), 1200.0)]]
+        )
+        self.assertEqual(list(fill_batches([rows])), [fill_dates(self.rows, day(2), day(6))[0]])
+
+
+class SparseQueryTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            rnd = random.Random(16)
+            cursor.executemany(
+                "INSERT INTO prices VALUES (%s, %s, %s, %s)",
+                [
+                    (
+                        rnd.choice(['SENRK', 'SESOE', 'SEMMA']), rnd.choice(['CNNBO', 'CNYAT']),
+                        day(rnd.choice([1, 2, 3, 5, 8, 9, 13, 21])), rnd.randint(900, 1500)
+                    )
+                    for _ in range(80)
+                ]
+            )
+
+    def test_matches_dates_filled_in_sql(self):
+        for origin, destination in [('SENRK', 'CNNBO'), ('scandinavia', 'china_main'), ('SEMMA', 'CNSNZ')]:
+            for page, page_size in [(None, None), (1, 5), (2, 5), (5, 5), (3, 4)]:
+                for order in ('ASC', 'DESC'):
+                    rate_query = RateQuery().add_port_codes_filter(
+                        catalogue.port_codes(origin), catalogue.port_codes(destination)
+                    ).add_dates_filter(
+                        date_to=day(20)
+                    ).add_pagination_params(page, page_size).add_ordering('dd', order)
+
+                    all_days = RateQuery().add_port_codes_filter(
+                        catalogue.port_codes(origin), catalogue.port_codes(destination)
+                    ).add_dates_filter(date_to=day(20))
+
+                    rows, (min_date, max_date) = Repository.fetch_all_with_bounds(*rate_query.sparse_query)
+                    self.assertEqual(
+                        fill_dates(rows, min_date, max_date, page, page_size, rate_query.descending),
+                        (Repository.fetch_all(*rate_query.query), len(Repository.fetch_all(*all_days.query))),
+                        (origin, destination, page, page_size, order)
+                    )
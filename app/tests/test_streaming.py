@@ -0,0 +1,75 @@
+import datetime
+import json
+import warnings
+
+from django.test import override_settings
+from django.db import connection
+
+from app.tests.fixtures import RatesTestCase
+
+
+@override_settings(RATES_STREAM_BATCH_SIZE=7)
+class StreamingTestCase(RatesTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+
+        with connection.cursor() as cursor:
+            # 40 days of prices, every third day with too few prices.
+            cursor.executemany(
+                "INSERT INTO prices VALUES ('SENRK', 'CNNBO', %s, %s)",
+                [
+                    (datetime.date(2016, 1, 1) + datetime.timedelta(days=day), 1000 + day + n)
+                    for day in range(40) for n in range(1 if day % 3 == 0 else 3)
+                ]
+            )
+
+    def get(self, **params):
+        return self.client.get('/rates/', {'origin': 'scandinavia', 'destination': 'CNNBO', **params})
+
+    def test_json_stream_matches_the_regular_response(self):
+        response = self.get(stream='json', date_to='2016-02-05')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        streamed = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(streamed), 36)
+        self.assertEqual(streamed, self.get(date_to='2016-02-05').json())
+        self.assertEqual(streamed[:2], [
+            {'day': '2016-01-01', 'average_price': None},
+            {'day': '2016-01-02', 'average_price': 1002.0},
+        ])
+
+    def test_ndjson_stream(self):
+        response = self.get(stream='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.get().json())
+
+    def test_gaps_are_filled_across_batches(self):
+        with connection.cursor() as cursor:
+            # Two weeks without prices, longer than a batch.
+            cursor.execute("DELETE FROM prices WHERE day between '2016-01-10' and '2016-01-23'")
+        response = self.get(stream='json')
+        streamed = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(streamed), 40)
+        self.assertEqual(streamed, self.get(page_size=40).json())
+
+    async def test_asgi_stream_is_not_buffered(self):
+        response = await self.async_client.get(
+            '/rates/', {'origin': 'scandinavia', 'destination': 'CNNBO', 'stream': 'ndjson'}
+        )
+        self.assertTrue(response.is_async)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            lines = b''.join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual(len(lines), 40)
+        self.assertEqual(json.loads(lines[1]), {'day': '2016-01-02', 'average_price': 1002.0})
+
+    def test_empty_and_invalid_streams(self):
+        response = self.client.get('/rates/', {'origin': 'SENRK', 'destination': 'CNYAT', 'stream': 'json'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
+        self.assertEqual(self.get(stream='xml').status_code, 400)
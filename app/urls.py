@@ -1,7 +1,14 @@
 from django.urls import re_path
 from . import views
+from .aio import views as async_views
 
 urlpatterns = [
     re_path(r'^rates/$', views.GetRatesView.as_view(), name='get-rates-view'),
+    re_path(r'^rates/batch/?$', views.BatchRatesView.as_view(), name='batch-rates-view'),
+    re_path(r'^rates/matrix/?$', views.RateMatrixView.as_view(), name='rate-matrix-view'),
+    re_path(r'^async/rates/$', async_views.AsyncGetRatesView.as_view(), name='async-get-rates-view'),
+    re_path(r'^rates/cache/stats/$', views.RatesCacheStatsView.as_view(), name='rates-cache-stats-view'),
+    re_path(r'^prices/ingest/?$', views.PricesIngestView.as_view(), name='prices-ingest-view'),
+    re_path(r'^db/pool/stats/$', views.DatabasePoolStatsView.as_view(), name='database-pool-stats-view'),
 ]
 
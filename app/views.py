@@ -1,10 +1,21 @@
 from datetime import datetime
+import json
 import logging
 from app import service
+from app.instrumentation import timed
+from app.permissions import IngestTokenPermission
+from app.renderers import RowsRenderer, rows_renderer_classes
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
 
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 
@@ -36,11 +47,39 @@ class RateSerializer(serializers.Serializer):
         ),
         OpenApiParameter(
             name='page_size', location=OpenApiParameter.QUERY, description='Size of prices to fetch at once', default=10, type=int
-        )            
+        ),
+        OpenApiParameter(
+            name='cursor', location=OpenApiParameter.QUERY, required=False, type=str,
+            description='Keyset pagination cursor, from `next`/`previous` of a previous response, empty for the first page. '
+                        'The response is then `{"next": ..., "previous": ..., "results": [...]}` and `page` is ignored.'
+        ),
+        OpenApiParameter(
+            name='stream', location=OpenApiParameter.QUERY, required=False, type=str, enum=list(service.STREAM_FORMATS),
+            description='Stream the whole date range, unpaginated, as a JSON array or as NDJSON.'
+        ),
+        OpenApiParameter(
+            name='granularity', location=OpenApiParameter.QUERY, required=False, type=str, default='day',
+            description='Average the rates over buckets of days: `day`, `week` (Monday to Sunday), `month` or a number '
+                        'of days like `14d` counted from the first day. A bucket is returned as its first day, and gets '
+                        'a null average with fewer than 3 prices. Not supported with `cursor` nor `stream`.'
+        ),
+        OpenApiParameter(
+            name='format', location=OpenApiParameter.QUERY, required=False, type=str,
+            enum=[renderer.format for renderer in rows_renderer_classes()],
+            description='Compact format of the rates, also negotiable with the `Accept` header. '
+                        'With `cursor`, the cursors are returned in the `next_cursor`/`previous_cursor` headers.'
+        )
     ],
 )
 class GetRatesView(APIView):
     serializer_class = RateSerializer
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, *rows_renderer_classes()]
+
+    def renders_rows(self) -> bool:
+        return isinstance(getattr(self.request, 'accepted_renderer', None), RowsRenderer)
+
+    def renders_fast_json(self) -> bool:
+        return settings.RATES_FAST_JSON and isinstance(getattr(self.request, 'accepted_renderer', None), JSONRenderer)
 
     def validate_parameters(self, request):
         logger.info(f"Got params:: {request.query_params.dict()}")
@@ -55,14 +94,237 @@ class GetRatesView(APIView):
         # Add page and page_sizes
         params['page'], params['page_size'] = service.validate_pagination(request)
 
+        # Keyset pagination cursor
+        params['cursor'] = service.validate_cursor(request)
+
+        # Size of the buckets of days the rates are averaged over
+        params['granularity'] = service.validate_granularity(request)
+
         return params
+
+    def get_streamed(self, params, stream):
+        content_type = 'application/x-ndjson' if stream == 'ndjson' else 'application/json'
+        content = service.stream_rates(
+            params['origin'], params['destination'], params['date_from'], params['date_to'], stream
+        )
+        if isinstance(self.request._request, ASGIRequest):
+            content = service.aiterate(content)
+        return StreamingHttpResponse(content, content_type=content_type)
+
+    def get_by_cursor(self, params):
+        params.pop('page')
+        params.pop('granularity')
+        rate_info = service.get_rates_by_cursor(**params)
+        if self.renders_rows():
+            headers = {
+                f"{name}_cursor": rate_info[name] for name in ('next', 'previous') if rate_info[name] is not None
+            }
+            return Response(data=list(rate_info["rows"]), headers=headers)
+        if self.renders_fast_json():
+            with timed('serialisation'):
+                content = '{"next":%s,"previous":%s,"results":%s}' % (
+                    json.dumps(rate_info["next"]), json.dumps(rate_info["previous"]),
+                    service.encode_rates(rate_info["rows"])
+                )
+            return HttpResponse(content, content_type='application/json')
+        with timed('serialisation'):
+            results = RateSerializer(rate_info["rates"], many=True).data
+        return Response(data={
+            "next": rate_info["next"],
+            "previous": rate_info["previous"],
+            "results": results
+        })
         
+    @staticmethod
+    def add_validators(response, validators):
+        """
+        Sets the `ETag`/`Last-Modified` validators, clients must revalidate rather than reuse the response.
+        """
+        if validators:
+            etag, last_modified = validators
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+            patch_cache_control(response, no_cache=True)
+        return response
+
     def get(self, request, *args, **kwargs):
         try:
-            params = self.validate_parameters(request)
-            rate_info= service.get_rates(**params)
+            with timed('validation'):
+                params = self.validate_parameters(request)
+                stream = service.validate_stream(request)
+                service.check_granularity_supported(params['granularity'], params['cursor'], stream)
+                validators = service.rates_validators(params, stream, request.accepted_media_type)
+
+            # Answers `If-None-Match`/`If-Modified-Since` from the validators alone, without querying the prices.
+            # `If-Modified-Since` is ignored without a `last_modified` covering the catalogue changes.
+            if validators:
+                etag, last_modified = validators
+                not_modified = get_conditional_response(
+                    request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+                )
+                if not_modified is not None:
+                    return self.add_validators(not_modified, validators)
+            return self.add_validators(self.get_rates(params, stream), validators)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            raise e
+
+    def get_rates(self, params, stream):
+        if stream:
+            return self.get_streamed(params, stream)
+
+        if params['cursor'] is not None:
+            return self.get_by_cursor(params)
+
+        params.pop('cursor')
+        rate_info= service.get_rates(**params)
+        if self.renders_rows():
+            return Response(data=list(rate_info["rows"]), headers={"max_count": rate_info["count"]})
+        if self.renders_fast_json():
+            with timed('serialisation'):
+                content = service.encode_rates(rate_info["rows"])
+            return HttpResponse(content, content_type='application/json', headers={"max_count": rate_info["count"]})
+        with timed('serialisation'):
             serialized = RateSerializer(rate_info["rates"], many=True).data
-            return Response(data=serialized, headers={"max_count": rate_info["count"]})
+        return Response(data=serialized, headers={"max_count": rate_info["count"]})
+
+
+class LaneSerializer(serializers.Serializer):
+    origin = serializers.CharField()
+    destination = serializers.CharField()
+    key = serializers.CharField(required=False, help_text='Key of the lane in the response, `origin:destination` by default')
+
+
+class BatchRatesRequestSerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    lanes = LaneSerializer(many=True)
+
+
+class LaneRatesSerializer(serializers.Serializer):
+    rates = RateSerializer(many=True, required=False)
+    error = serializers.DictField(required=False)
+
+
+@extend_schema(
+    request=BatchRatesRequestSerializer,
+    responses={200: serializers.DictField(child=LaneRatesSerializer())}
+)
+class BatchRatesView(APIView):
+    """
+        Rates of many lanes over the same date range, fetched with a single query.
+        Returns the rates of every lane keyed by the lane keys, an invalid lane gets an `error` instead.
+    """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            with timed('validation'):
+                lanes, date_from, date_to = service.validate_batch(request.data)
+            lane_rates = service.get_batch_rates(lanes, date_from, date_to)
+            with timed('serialisation'):
+                data = {
+                    key: (
+                        {"rates": RateSerializer(rates["rates"], many=True).data} if "rates" in rates else rates
+                    ) for key, rates in lane_rates.items()
+                }
+            return Response(data=data)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            raise e
+
+
+@extend_schema(
+    parameters=[
+        OpenApiParameter(
+            name='origin', location=OpenApiParameter.QUERY, description='Origin Port/Region', required=True, type=str
+        ),
+        OpenApiParameter(
+            name='destination', location=OpenApiParameter.QUERY, description='Destination Port/Region', required=True, type=str
+        ),
+        OpenApiParameter(
+            name='date_from', location=OpenApiParameter.QUERY, description='From date', required=False, type=str
+        ),
+        OpenApiParameter(
+            name='date_to', location=OpenApiParameter.QUERY, description='To date', required=False, type=str
+        ),
+        OpenApiParameter(
+            name='by_day', location=OpenApiParameter.QUERY, required=False, type=bool, default=False,
+            description='One row per port pair and day instead of per port pair, with a `day` column.'
+        ),
+    ],
+    responses={200: serializers.DictField(child=serializers.ListField())}
+)
+class RateMatrixView(APIView):
+    """
+        Average price and number of prices of every port pair of a lane, e.g. of a region to region
+        lane, over the date range, in one query. Only the pairs with prices are returned, as columns
+        `{"orig_code": [...], "dest_code": [...], "average_price": [...], "count": [...]}`, the average
+        being null with fewer than 3 prices.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            with timed('validation'):
+                origin, destination = service.validate_endpoints(request)
+                date_from, date_to = service.validate_dates(request)
+                by_day = service.validate_by_day(request)
+                service.validate_matrix_range(date_from, date_to, by_day)
+            return Response(data=service.get_rate_matrix(origin, destination, date_from, date_to, by_day))
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            raise e
+
+
+class RatesCacheStatsView(APIView):
+    """
+        Hit/miss counters of the rates cache of this process.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response(data=service.get_rates_cache_stats())
+
+
+class DatabasePoolStatsView(APIView):
+    """
+        Size, usage and wait time metrics of the database connection pool of this process.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response(data=service.get_database_pool_stats())
+
+
+class PricesIngestView(APIView):
+    """
+        Bulk loads prices from a `text/csv` or `application/x-ndjson` body of `orig_code, dest_code, day, price`
+        rows, appended to the prices. A `batch_id` already loaded is skipped.
+        Returns the load counts and the touched keys.
+    """
+
+    permission_classes = [IngestTokenPermission]
+
+    CONTENT_TYPE_FORMATS = {
+        'text/csv': 'csv',
+        'application/x-ndjson': 'ndjson',
+        'application/jsonl': 'ndjson',
+    }
+
+    def post(self, request, *args, **kwargs):
+        try:
+            content_type = request.content_type.split(';')[0].strip()
+            format = self.CONTENT_TYPE_FORMATS.get(content_type, content_type)
+            stream = request.stream
+            lines = (line.decode('utf-8') for line in iter(stream.readline, b'')) if stream else ()
+            result = service.ingest_prices(lines, format, request.query_params.get('batch_id'))
+            return Response(data={
+                "received": result["received"],
+                "inserted": result["inserted"],
+                "duplicate": result["duplicate"],
+                "touched": [
+                    {"orig_code": orig_code, "dest_code": dest_code, "day": day}
+                    for orig_code, dest_code, day in result["touched"]
+                ]
+            })
         except Exception as e:
             logger.error(e, exc_info=True)
             raise e
@@ -6,7 +6,19 @@ while ! nc -z ${MY_DB_HOST:-db} ${MY_DB_PORT:-5432}; do
 done
 echo "DB Ready ..."
 
+# The workers map the memory engine snapshot file, built here and rebuilt in the background when stale.
+if [ -n "$RATES_SNAPSHOT_PATH" ]; then
+  echo "Building the rates snapshot ......."
+  python manage.py build_snapshot --if-stale
+  python manage.py build_snapshot --watch ${RATES_SNAPSHOT_WATCH_INTERVAL:-60} &
+fi
+
 echo "Starting Gunicorn ......."
 gunicorn -v
-gunicorn api.wsgi:application --bind=0.0.0.0:8000 --log-level='debug' --capture-output
+# SERVER_MODE=asgi serves the app on api.asgi with uvicorn workers, for the async /async/rates/ path.
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+  gunicorn api.asgi:application -c api/gunicorn.conf.py -k uvicorn_worker.UvicornWorker --bind=0.0.0.0:8000 --log-level='debug' --capture-output
+else
+  gunicorn api.wsgi:application -c api/gunicorn.conf.py --bind=0.0.0.0:8000 --log-level='debug' --capture-output
+fi
 